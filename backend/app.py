@@ -12,6 +12,9 @@ import time
 import logging
 from contextlib import asynccontextmanager
 
+from config import settings
+from utils.rate_limiter import RateLimitMiddleware
+
 # Import route modules
 from routes import (
     users_router,
@@ -21,7 +24,9 @@ from routes import (
     admin_router,
     activity_router,
     notifications_router,
-    search_router
+    search_router,
+    waitlist_router,
+    loans_router
 )
 
 # Configure logging
@@ -54,12 +59,89 @@ async def lifespan(app: FastAPI):
         logger.info("Admin user check completed")
     except Exception as e:
         logger.error(f"Admin user creation failed: {e}")
+
+    # Relay live events published by the other workers
+    try:
+        from services.event_bus import event_bus
+        event_bus.start()
+        logger.info("Event bus started")
+    except Exception as e:
+        logger.error(f"Event bus failed to start: {e}")
+
+    # Start relaying outbox events (including any left over from a crash)
+    try:
+        from services.outbox import outbox_relay
+        outbox_relay.start()
+        logger.info("Outbox relay started")
+    except Exception as e:
+        logger.error(f"Outbox relay failed to start: {e}")
+
+    # Send queued emails in the background
+    try:
+        from services.email_worker import email_worker
+        email_worker.start()
+        logger.info("Email worker started")
+    except Exception as e:
+        logger.error(f"Email worker failed to start: {e}")
+
+    # Start periodic maintenance jobs
+    try:
+        from services.scheduler import scheduler
+        scheduler.start()
+        logger.info("Scheduler started")
+    except Exception as e:
+        logger.error(f"Scheduler failed to start: {e}")
     
     logger.info("API is ready to accept requests")
     yield
     # Shutdown
     logger.info("Shutting down Share-IT API...")
 
+    # Stop periodic maintenance jobs
+    try:
+        from services.scheduler import scheduler
+        scheduler.stop()
+    except Exception as e:
+        logger.error(f"Scheduler shutdown failed: {e}")
+
+    # Relay outbox events that are ready before the consumers shut down
+    try:
+        from services.outbox import outbox_relay
+        outbox_relay.stop()
+        logger.info(f"Outbox relay stopped: {outbox_relay.stats()}")
+    except Exception as e:
+        logger.error(f"Outbox relay shutdown failed: {e}")
+
+    # Stop sending emails (pending ones stay queued)
+    try:
+        from services.email_worker import email_worker
+        email_worker.stop()
+    except Exception as e:
+        logger.error(f"Email worker shutdown failed: {e}")
+
+    # Stop relaying live events
+    try:
+        from services.event_bus import event_bus
+        event_bus.stop()
+    except Exception as e:
+        logger.error(f"Event bus shutdown failed: {e}")
+
+    # Deliver queued notifications
+    try:
+        from services.notifications import notification_dispatcher
+        notification_dispatcher.shutdown()
+        logger.info(f"Notifications delivered: {notification_dispatcher.stats()}")
+    except Exception as e:
+        logger.error(f"Notification flush failed: {e}")
+
+    # Flush buffered activity log entries
+    try:
+        from services.activity_logger import activity_logger
+        activity_logger.shutdown()
+        logger.info(f"Activity log flushed: {activity_logger.stats()}")
+    except Exception as e:
+        logger.error(f"Activity log flush failed: {e}")
+
 
 # Create FastAPI app
 app = FastAPI(
@@ -72,6 +154,10 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Rate limiting middleware (added before CORS so 429 responses carry CORS headers)
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+
 # CORS middleware configuration
 app.add_middleware(
     CORSMiddleware,
@@ -177,6 +263,8 @@ app.include_router(admin_router, tags=["Admin"])
 app.include_router(activity_router, tags=["Activity"])
 app.include_router(notifications_router, tags=["Notifications"])
 app.include_router(search_router, tags=["Search"])
+app.include_router(waitlist_router, tags=["Waitlist"])
+app.include_router(loans_router, tags=["Loans"])
 
 
 # Root endpoint
@@ -238,10 +326,33 @@ async def api_health_check():
         logger.error(f"Database health check failed: {e}")
         db_status = "error"
 
+    from services.activity_logger import activity_logger
+    from services.notifications import notification_dispatcher
+    from services.outbox import outbox_relay
+    from services.notification_stream import notification_hub
+    from services.request_events import request_event_hub
+    from services.event_bus import event_bus
+    from services.scheduler import scheduler
+    from services.retention import notification_retention
+    from services.email_worker import email_worker
+    from services.digests import digest_batcher
+    from services.loan_reminders import loan_reminders
+
     return {
         "success": True,
         "status": "healthy",
         "database": db_status,
+        "activity_log": activity_logger.stats(),
+        "notifications": notification_dispatcher.stats(),
+        "outbox": outbox_relay.stats(),
+        "streams": notification_hub.stats(),
+        "request_events": request_event_hub.stats(),
+        "event_bus": event_bus.stats(),
+        "jobs": scheduler.stats(),
+        "retention": notification_retention.stats(),
+        "email": email_worker.stats(),
+        "digests": digest_batcher.stats(),
+        "loan_reminders": loan_reminders.stats(),
         "timestamp": time.time(),
         "uptime": time.process_time()
     }
@@ -276,8 +387,10 @@ async def api_info():
             "header": "Authorization: Bearer <token>"
         },
         "rate_limiting": {
-            "enabled": False,
-            "requests_per_minute": 60
+            "enabled": settings.RATE_LIMIT_ENABLED,
+            "requests_per_window": settings.RATE_LIMIT_REQUESTS,
+            "window_seconds": settings.RATE_LIMIT_WINDOW,
+            "route_costs": settings.RATE_LIMIT_ROUTE_COSTS
         },
         "contact": {
             "email": "support@shareit.com",
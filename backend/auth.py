@@ -1,8 +1,12 @@
 import bcrypt
 import jwt
 from datetime import datetime, timedelta
+import hashlib
 import os
-from database import execute_query, execute_one
+import secrets
+import uuid
+from database import execute_query, execute_one, db_timestamp
+from services.activity_logger import log_activity
 import json
 import logging
 
@@ -36,14 +40,22 @@ class AuthService:
             return False
 
     @staticmethod
-    def generate_token(user_id):
-        """Generate JWT token"""
+    def generate_token(user_id, username=None, is_admin=False, token_epoch=0):
+        """Generate JWT token
+
+        The username, admin flag and token epoch are embedded as claims so
+        requests can be authorized without loading the user row.
+        """
         try:
             # Token payload
             payload = {
                 'user_id': user_id,
+                'username': username,
+                'is_admin': bool(is_admin),
+                'token_epoch': token_epoch or 0,
+                'jti': uuid.uuid4().hex,
                 'exp': datetime.utcnow() + timedelta(
-                    hours=int(os.getenv('JWT_EXPIRATION_HOURS', 24))
+                    minutes=AuthService.access_token_minutes()
                 ),
                 'iat': datetime.utcnow(),
                 'type': 'access'
@@ -62,6 +74,110 @@ class AuthService:
             logger.error(f"Error generating token: {e}")
             raise
 
+    @staticmethod
+    def access_token_minutes():
+        """Lifetime of access tokens in minutes"""
+        return int(os.getenv('JWT_ACCESS_EXPIRATION_MINUTES', 15))
+
+    @staticmethod
+    def hash_refresh_token(refresh_token):
+        """Hash a refresh token for storage (tokens are high entropy, no salt needed)"""
+        return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def issue_refresh_token(user_id):
+        """Create and store a new refresh token, returning the raw token"""
+        refresh_token = secrets.token_urlsafe(48)
+        expires_at = datetime.utcnow() + timedelta(
+            days=int(os.getenv('JWT_REFRESH_EXPIRATION_DAYS', 30))
+        )
+
+        execute_query(
+            """INSERT INTO refresh_tokens (user_id, token_hash, expires_at)
+               VALUES (%s, %s, %s)""",
+            (user_id, AuthService.hash_refresh_token(refresh_token), db_timestamp(expires_at))
+        )
+
+        return refresh_token
+
+    @staticmethod
+    def create_session(user_id, username, is_admin=False, token_epoch=0):
+        """Issue an access/refresh token pair"""
+        return {
+            'token': AuthService.generate_token(user_id, username, is_admin, token_epoch),
+            'refresh_token': AuthService.issue_refresh_token(user_id),
+            'expires_in': AuthService.access_token_minutes() * 60
+        }
+
+    @staticmethod
+    def refresh_session(refresh_token):
+        """Exchange a refresh token for a new access/refresh token pair
+
+        The presented refresh token is rotated. Presenting an already rotated
+        token revokes every refresh token of that user, since it means the
+        token leaked.
+        """
+        try:
+            if not refresh_token:
+                return None, "Refresh token is required"
+
+            stored = execute_one(
+                """SELECT rt.id, rt.user_id, rt.expires_at, rt.revoked_at,
+                          u.username, u.is_admin, u.is_active, u.token_epoch
+                   FROM refresh_tokens rt
+                   JOIN users u ON rt.user_id = u.id
+                   WHERE rt.token_hash = %s""",
+                (AuthService.hash_refresh_token(refresh_token),)
+            )
+
+            if not stored:
+                return None, "Invalid refresh token"
+
+            if stored['revoked_at']:
+                logger.warning(f"Reuse of revoked refresh token for user ID: {stored['user_id']}")
+                AuthService.revoke_user_refresh_tokens(stored['user_id'])
+                return None, "Invalid refresh token"
+
+            if str(stored['expires_at']) < db_timestamp():
+                return None, "Refresh token has expired"
+
+            if not stored['is_active']:
+                return None, "Account is deactivated. Please contact support."
+
+            # Rotate: the old token can only be used once
+            revoked = execute_query(
+                "UPDATE refresh_tokens SET revoked_at = %s WHERE id = %s AND revoked_at IS NULL",
+                (db_timestamp(), stored['id'])
+            )
+            if not revoked:
+                return None, "Invalid refresh token"
+
+            return AuthService.create_session(
+                stored['user_id'], stored['username'],
+                stored['is_admin'], stored['token_epoch']
+            ), None
+
+        except Exception as e:
+            logger.error(f"Error refreshing session: {e}")
+            return None, "Token refresh failed. Please log in again."
+
+    @staticmethod
+    def revoke_refresh_token(refresh_token):
+        """Revoke a single refresh token"""
+        execute_query(
+            """UPDATE refresh_tokens SET revoked_at = %s
+               WHERE token_hash = %s AND revoked_at IS NULL""",
+            (db_timestamp(), AuthService.hash_refresh_token(refresh_token))
+        )
+
+    @staticmethod
+    def revoke_user_refresh_tokens(user_id):
+        """Revoke every refresh token of a user"""
+        execute_query(
+            "UPDATE refresh_tokens SET revoked_at = %s WHERE user_id = %s AND revoked_at IS NULL",
+            (db_timestamp(), user_id)
+        )
+
     @staticmethod
     def verify_token(token):
         """Verify JWT token"""
@@ -138,15 +254,11 @@ class AuthService:
                 )
             )
 
-            # Generate token
-            token = AuthService.generate_token(user_id)
+            # Generate tokens
+            session = AuthService.create_session(user_id, username)
 
             # Log registration
-            execute_query(
-                """INSERT INTO activity_log (user_id, action, item_type)
-                   VALUES (%s, %s, %s)""",
-                (user_id, 'registered', 'user')
-            )
+            log_activity(user_id, 'registered', 'user')
 
             logger.info(f"User registered successfully: {username}")
 
@@ -154,8 +266,8 @@ class AuthService:
                 'user_id': user_id,
                 'username': username,
                 'email': email,
-                'token': token,
-                'is_admin': False
+                'is_admin': False,
+                **session
             }, None
 
         except Exception as e:
@@ -175,7 +287,7 @@ class AuthService:
                 """SELECT id, username, email, password_hash, 
                           is_admin, is_active, full_name,
                           flat_number, phone_number, preferred_contact,
-                          contact_times, interests
+                          contact_times, interests, token_epoch
                    FROM users 
                    WHERE email = %s""",
                 (email,)
@@ -192,15 +304,13 @@ class AuthService:
             if not AuthService.verify_password(password, user['password_hash']):
                 return None, "Invalid email or password"
 
-            # Generate token
-            token = AuthService.generate_token(user['id'])
+            # Generate tokens
+            session = AuthService.create_session(
+                user['id'], user['username'], user['is_admin'], user['token_epoch']
+            )
 
             # Log login
-            execute_query(
-                """INSERT INTO activity_log (user_id, action, item_type)
-                   VALUES (%s, %s, %s)""",
-                (user['id'], 'login', 'user')
-            )
+            log_activity(user['id'], 'login', 'user')
 
             logger.info(f"User logged in successfully: {user['username']}")
 
@@ -231,7 +341,7 @@ class AuthService:
                 'contact_times': contact_times,
                 'interests': interests,
                 'is_admin': bool(user['is_admin']),
-                'token': token
+                **session
             }, None
 
         except Exception as e:
@@ -311,12 +421,13 @@ class AuthService:
                 (new_password_hash, user_id)
             )
 
+            # Invalidate tokens issued with the old password
+            from utils.token_epoch import token_epochs
+            token_epochs.bump(user_id)
+            AuthService.revoke_user_refresh_tokens(user_id)
+
             # Log password change
-            execute_query(
-                """INSERT INTO activity_log (user_id, action, item_type)
-                   VALUES (%s, %s, %s)""",
-                (user_id, 'password_changed', 'user')
-            )
+            log_activity(user_id, 'password_changed', 'user')
 
             logger.info(f"Password updated for user ID: {user_id}")
 
@@ -3,7 +3,7 @@ Configuration settings for Share-IT backend
 """
 
 import os
-from typing import List
+from typing import Dict, List
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -42,7 +42,8 @@ class Settings:
         "your-very-secret-key-change-this-in-production"
     )
     JWT_ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
-    JWT_EXPIRATION_HOURS: int = int(os.getenv("JWT_EXPIRATION_HOURS", 24))
+    JWT_ACCESS_EXPIRATION_MINUTES: int = int(os.getenv("JWT_ACCESS_EXPIRATION_MINUTES", 15))
+    JWT_REFRESH_EXPIRATION_DAYS: int = int(os.getenv("JWT_REFRESH_EXPIRATION_DAYS", 30))
 
     # CORS Settings
     ALLOWED_ORIGINS: List[str] = [
@@ -64,18 +65,114 @@ class Settings:
     PASSWORD_MIN_LENGTH: int = 6
     PASSWORD_MAX_LENGTH: int = 100
 
-    # Rate Limiting (for future implementation)
-    RATE_LIMIT_ENABLED: bool = False
-    RATE_LIMIT_REQUESTS: int = 100
-    RATE_LIMIT_WINDOW: int = 60  # seconds
+    # Rate Limiting
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
+    RATE_LIMIT_REQUESTS: int = int(os.getenv("RATE_LIMIT_REQUESTS", 100))
+    RATE_LIMIT_WINDOW: int = int(os.getenv("RATE_LIMIT_WINDOW", 60))  # seconds
+    RATE_LIMIT_STORAGE: str = os.getenv("RATE_LIMIT_STORAGE", "memory").lower()  # 'memory' or 'sqlite'
+    RATE_LIMIT_SQLITE_PATH: str = os.getenv("RATE_LIMIT_SQLITE_PATH", "rate_limits.db")
+    RATE_LIMIT_TRUST_PROXY: bool = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+    # Cost weight per route prefix (longest prefix wins, default cost is 1)
+    RATE_LIMIT_ROUTE_COSTS: Dict[str, int] = {
+        "/api/search": 5,
+        "/api/admin/stats": 10,
+        "/api/admin/reports": 10,
+        "/api/activity/summary": 3,
+        "/api/auth/login": 3,
+        "/api/auth/register": 5,
+    }
+    RATE_LIMIT_EXEMPT_PATHS: List[str] = ["/health", "/api/health", "/docs", "/redoc", "/openapi.json"]
 
-    # Email Settings (for future implementation)
-    EMAIL_ENABLED: bool = False
+    # Shared Cache (in-process LRU backed by a SQLite file shared by workers)
+    CACHE_SHARED_PATH: str = os.getenv("CACHE_SHARED_PATH", "shared_cache.db")
+    CACHE_SYNC_INTERVAL: float = float(os.getenv("CACHE_SYNC_INTERVAL", 0.5))  # seconds
+    CACHE_LOCAL_MAXSIZE: int = int(os.getenv("CACHE_LOCAL_MAXSIZE", 4096))
+
+    # Activity log (write-behind, batched inserts)
+    ACTIVITY_LOG_BATCH_SIZE: int = int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", 100))
+    ACTIVITY_LOG_FLUSH_INTERVAL: float = float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", 1.0))  # seconds
+    ACTIVITY_LOG_MAX_QUEUE: int = int(os.getenv("ACTIVITY_LOG_MAX_QUEUE", 10000))
+    ACTIVITY_LOG_BLOCK_TIMEOUT: float = float(os.getenv("ACTIVITY_LOG_BLOCK_TIMEOUT", 0.05))  # seconds
+
+    # Notification dispatcher (deduplicated, batched fan-out to sinks)
+    NOTIFICATION_BATCH_SIZE: int = int(os.getenv("NOTIFICATION_BATCH_SIZE", 100))
+    NOTIFICATION_FLUSH_INTERVAL: float = float(os.getenv("NOTIFICATION_FLUSH_INTERVAL", 0.5))  # seconds
+    NOTIFICATION_MAX_QUEUE: int = int(os.getenv("NOTIFICATION_MAX_QUEUE", 10000))
+    NOTIFICATION_DEDUP_WINDOW: float = float(os.getenv("NOTIFICATION_DEDUP_WINDOW", 60))  # seconds
+    NOTIFICATION_COUNTER_RECONCILE_INTERVAL: float = float(os.getenv("NOTIFICATION_COUNTER_RECONCILE_INTERVAL", 3600))  # seconds, 0 disables
+
+    # Notification retention (read notifications past the TTL are archived and deleted)
+    NOTIFICATION_RETENTION_DAYS: int = int(os.getenv("NOTIFICATION_RETENTION_DAYS", 90))  # 0 keeps them forever
+    NOTIFICATION_RETENTION_INTERVAL: float = float(os.getenv("NOTIFICATION_RETENTION_INTERVAL", 3600))  # seconds
+    NOTIFICATION_RETENTION_BATCH_SIZE: int = int(os.getenv("NOTIFICATION_RETENTION_BATCH_SIZE", 500))
+    NOTIFICATION_RETENTION_PAUSE: float = float(os.getenv("NOTIFICATION_RETENTION_PAUSE", 0.05))  # seconds between batches
+    NOTIFICATION_ARCHIVE_DIR: str = os.getenv("NOTIFICATION_ARCHIVE_DIR", "archive/notifications")  # empty disables archival
+    SQLITE_VACUUM_PAGES: int = int(os.getenv("SQLITE_VACUUM_PAGES", 1000))  # pages released after each retention run
+
+    # Notification digests (hourly/daily summaries for users who opt in)
+    DIGEST_CHECK_INTERVAL: float = float(os.getenv("DIGEST_CHECK_INTERVAL", 300))  # seconds, 0 disables
+
+    # Per-user request counters behind the request statistics endpoint
+    REQUEST_COUNTERS_ENABLED: bool = os.getenv("REQUEST_COUNTERS_ENABLED", "true").lower() == "true"
+    REQUEST_COUNTER_RECONCILE_INTERVAL: float = float(os.getenv("REQUEST_COUNTER_RECONCILE_INTERVAL", 3600))  # seconds, 0 disables
+
+    # Loan reminders (due-soon and overdue notifications, one worker at a time)
+    LOAN_REMINDER_INTERVAL: float = float(os.getenv("LOAN_REMINDER_INTERVAL", 3600))  # seconds, 0 disables
+    LOAN_REMINDER_DAYS: int = int(os.getenv("LOAN_REMINDER_DAYS", 2))  # days ahead, 0 sends overdue notices only
+    LOAN_REMINDER_BATCH_SIZE: int = int(os.getenv("LOAN_REMINDER_BATCH_SIZE", 500))
+
+    # Loan history and lending statistics (updated on approve and return)
+    LOAN_HISTORY_ENABLED: bool = os.getenv("LOAN_HISTORY_ENABLED", "true").lower() == "true"
+    LOAN_HISTORY_BACKFILL_INTERVAL: float = float(os.getenv("LOAN_HISTORY_BACKFILL_INTERVAL", 86400))  # seconds, 0 disables
+    LOAN_HISTORY_BATCH_SIZE: int = int(os.getenv("LOAN_HISTORY_BATCH_SIZE", 500))
+
+    # Idempotency keys for create endpoints (stored responses replayed to retries)
+    IDEMPOTENCY_KEY_TTL: int = int(os.getenv("IDEMPOTENCY_KEY_TTL", 24))  # hours
+    IDEMPOTENCY_PURGE_INTERVAL: float = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", 3600))  # seconds, 0 disables
+
+    # Live notification stream (Server-Sent Events)
+    SSE_HEARTBEAT_INTERVAL: float = float(os.getenv("SSE_HEARTBEAT_INTERVAL", 15))  # seconds
+    SSE_RETRY_MS: int = int(os.getenv("SSE_RETRY_MS", 5000))
+    SSE_QUEUE_SIZE: int = int(os.getenv("SSE_QUEUE_SIZE", 50))  # events buffered per connection
+    SSE_MAX_CONNECTIONS_PER_USER: int = int(os.getenv("SSE_MAX_CONNECTIONS_PER_USER", 5))
+    SSE_RESUME_LIMIT: int = int(os.getenv("SSE_RESUME_LIMIT", 100))
+
+    # Request lifecycle WebSocket (/api/requests/events)
+    WS_HEARTBEAT_INTERVAL: float = float(os.getenv("WS_HEARTBEAT_INTERVAL", 30))  # seconds
+    WS_QUEUE_SIZE: int = int(os.getenv("WS_QUEUE_SIZE", 100))  # events buffered per connection
+    WS_MAX_CONNECTIONS_PER_USER: int = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", 10))
+
+    # Cross-worker event bus (SQLite log shared by the workers on a host)
+    EVENT_BUS_PATH: str = os.getenv("EVENT_BUS_PATH", "event_bus.db")
+    EVENT_BUS_POLL_INTERVAL: float = float(os.getenv("EVENT_BUS_POLL_INTERVAL", 0.25))  # seconds
+    EVENT_BUS_RETENTION: int = int(os.getenv("EVENT_BUS_RETENTION", 300))  # seconds
+
+    # Transactional outbox relay
+    OUTBOX_BATCH_SIZE: int = int(os.getenv("OUTBOX_BATCH_SIZE", 100))
+    OUTBOX_POLL_INTERVAL: float = float(os.getenv("OUTBOX_POLL_INTERVAL", 1.0))  # seconds
+    OUTBOX_LEASE_SECONDS: int = int(os.getenv("OUTBOX_LEASE_SECONDS", 60))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 10))
+    OUTBOX_RETENTION_HOURS: int = int(os.getenv("OUTBOX_RETENTION_HOURS", 24))
+
+    # Email Settings
+    EMAIL_ENABLED: bool = os.getenv("EMAIL_ENABLED", "false").lower() == "true"
     SMTP_HOST: str = os.getenv("SMTP_HOST", "smtp.gmail.com")
     SMTP_PORT: int = int(os.getenv("SMTP_PORT", 587))
     SMTP_USER: str = os.getenv("SMTP_USER", "")
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
     EMAIL_FROM: str = os.getenv("EMAIL_FROM", "noreply@shareit.com")
+    SMTP_USE_TLS: bool = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+    SMTP_TIMEOUT: float = float(os.getenv("SMTP_TIMEOUT", 10))  # seconds
+    SMTP_IDLE_TIMEOUT: float = float(os.getenv("SMTP_IDLE_TIMEOUT", 60))  # seconds before an idle connection is closed
+
+    # Email delivery worker
+    EMAIL_WORKERS: int = int(os.getenv("EMAIL_WORKERS", 1))  # threads, each with its own SMTP connection
+    EMAIL_BATCH_SIZE: int = int(os.getenv("EMAIL_BATCH_SIZE", 50))
+    EMAIL_POLL_INTERVAL: float = float(os.getenv("EMAIL_POLL_INTERVAL", 2.0))  # seconds
+    EMAIL_LEASE_SECONDS: int = int(os.getenv("EMAIL_LEASE_SECONDS", 120))
+    EMAIL_MAX_ATTEMPTS: int = int(os.getenv("EMAIL_MAX_ATTEMPTS", 6))
+    EMAIL_RETRY_BASE: float = float(os.getenv("EMAIL_RETRY_BASE", 30))  # seconds, doubled per attempt
+    EMAIL_RETENTION_DAYS: int = int(os.getenv("EMAIL_RETENTION_DAYS", 30))  # sent/failed records kept
 
     # Default Admin Account
     DEFAULT_ADMIN_EMAIL: str = "admin@shareit.com"
@@ -2,6 +2,7 @@ import os
 import sqlite3
 import mysql.connector
 from mysql.connector import pooling
+from mysql.connector.constants import ClientFlag
 from dotenv import load_dotenv
 import logging
 from contextlib import contextmanager
@@ -28,7 +29,10 @@ mysql_config = {
     'auth_plugin': 'mysql_native_password',
     'autocommit': False,
     'use_unicode': True,
-    'charset': 'utf8mb4'
+    'charset': 'utf8mb4',
+    # UPDATE row counts include matched but unchanged rows, as on SQLite,
+    # so conditional updates can be checked the same way on both databases
+    'client_flags': [ClientFlag.FOUND_ROWS]
 }
 
 # Global connection pool for MySQL
@@ -238,6 +242,239 @@ def execute_many(query, params_list):
             conn.close()
 
 
+# Insert that silently skips rows violating a unique key (idempotent consumers)
+INSERT_IGNORE = 'INSERT OR IGNORE' if DB_TYPE == 'sqlite' else 'INSERT IGNORE'
+
+
+class Transaction:
+    """Statements run on a single connection and committed by transaction()"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        if DB_TYPE == 'sqlite':
+            self.cursor = conn.cursor()
+        else:
+            self.cursor = conn.cursor(dictionary=True, buffered=True)
+        self._on_commit = []
+
+    def _run(self, query, params):
+        if DB_TYPE == 'sqlite':
+            self.cursor.execute(query.replace('%s', '?'), params or ())
+        else:
+            self.cursor.execute(query, params or ())
+
+    def execute(self, query, params=None):
+        """Execute a statement
+
+        Returns:
+            Last insert ID for INSERT statements, affected rows otherwise
+        """
+        self._run(query, params)
+        if query.strip().upper().startswith('INSERT'):
+            return self.cursor.lastrowid
+        return self.cursor.rowcount
+
+    def execute_many(self, query, params_list):
+        """Execute a statement once per parameter tuple"""
+        if DB_TYPE == 'sqlite':
+            self.cursor.executemany(query.replace('%s', '?'), params_list)
+        else:
+            self.cursor.executemany(query, params_list)
+        return self.cursor.rowcount
+
+    def fetch_all(self, query, params=None):
+        """Run a query and return all rows as dictionaries"""
+        self._run(query, params)
+        rows = self.cursor.fetchall()
+        if DB_TYPE == 'sqlite' and rows:
+            columns = [description[0] for description in self.cursor.description]
+            return [dict(zip(columns, row)) for row in rows]
+        return list(rows)
+
+    def fetch_one(self, query, params=None):
+        """Run a query and return the first row as a dictionary or None"""
+        self._run(query, params)
+        row = self.cursor.fetchone()
+        if DB_TYPE == 'sqlite' and row is not None:
+            columns = [description[0] for description in self.cursor.description]
+            return dict(zip(columns, row))
+        return row
+
+    def on_commit(self, callback):
+        """Run callback() after a successful commit"""
+        self._on_commit.append(callback)
+
+
+@contextmanager
+def transaction():
+    """Run several statements atomically
+
+    Usage:
+        with transaction() as tx:
+            tx.execute("UPDATE ...", params)
+            tx.execute("INSERT ...", params)
+
+    Commits when the block exits normally and rolls back on any exception.
+    """
+    conn = get_db_connection()
+    tx = Transaction(conn)
+
+    try:
+        yield tx
+        conn.commit()
+    except (sqlite3.Error, mysql.connector.Error) as err:
+        conn.rollback()
+        logger.error(f"Database error in transaction: {err}")
+        raise
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        tx.cursor.close()
+        conn.close()
+
+    for callback in tx._on_commit:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Commit callback failed: {e}")
+
+
+# Columns added after the initial schema, applied to existing databases
+# (table, column, SQLite definition, MySQL definition)
+COLUMN_MIGRATIONS = [
+    ('users', 'token_epoch', 'INTEGER DEFAULT 0', 'INT DEFAULT 0'),
+    ('notifications', 'event_key', 'VARCHAR(64)', 'VARCHAR(64) NULL UNIQUE'),
+    ('activity_log', 'event_key', 'VARCHAR(64)', 'VARCHAR(64) NULL UNIQUE'),
+    ('requests', 'item_title', 'VARCHAR(200)', 'VARCHAR(200) NULL'),
+    ('requests', 'item_creator', 'VARCHAR(100)', 'VARCHAR(100) NULL'),
+    ('requests', 'item_image', 'VARCHAR(500)', 'VARCHAR(500) NULL'),
+    ('requests', 'version', 'INTEGER NOT NULL DEFAULT 1', 'INT NOT NULL DEFAULT 1'),
+    ('books', 'version', 'INTEGER NOT NULL DEFAULT 1', 'INT NOT NULL DEFAULT 1'),
+    ('board_games', 'version', 'INTEGER NOT NULL DEFAULT 1', 'INT NOT NULL DEFAULT 1'),
+]
+
+
+def apply_column_migrations(cursor):
+    """Add any missing columns listed in COLUMN_MIGRATIONS
+
+    Args:
+        cursor: Cursor on the initialized database
+    """
+    existing_columns = {}
+
+    for table, column, sqlite_definition, mysql_definition in COLUMN_MIGRATIONS:
+        if table not in existing_columns:
+            if DB_TYPE == 'sqlite':
+                cursor.execute(f"PRAGMA table_info({table})")
+                existing_columns[table] = {row[1] for row in cursor.fetchall()}
+            else:
+                cursor.execute(f"SHOW COLUMNS FROM {table}")
+                existing_columns[table] = {row[0] for row in cursor.fetchall()}
+
+        if column in existing_columns[table]:
+            continue
+
+        definition = sqlite_definition if DB_TYPE == 'sqlite' else mysql_definition
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        existing_columns[table].add(column)
+        logger.info(f"Added column {table}.{column}")
+
+
+# Indexes added after the initial schema, applied to existing MySQL
+# databases (SQLite uses CREATE INDEX IF NOT EXISTS)
+# (table, index name, columns)
+INDEX_MIGRATIONS = [
+    ('notifications', 'idx_user_created', 'user_id, created_at'),
+    ('notifications', 'idx_read_created', 'is_read, created_at'),
+    ('requests', 'idx_requester_status', 'requester_id, status'),
+    ('requests', 'idx_owner_status', 'owner_id, status'),
+    ('requests', 'idx_item', 'item_type, item_id, status'),
+    ('requests', 'idx_status_return', 'status, return_date'),
+]
+
+
+def apply_index_migrations(cursor):
+    """Create any missing MySQL indexes listed in INDEX_MIGRATIONS
+
+    Args:
+        cursor: Cursor on the initialized database
+    """
+    if DB_TYPE == 'sqlite':
+        return
+
+    for table, index, columns in INDEX_MIGRATIONS:
+        cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (index,))
+        if cursor.fetchall():
+            continue
+        cursor.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+        logger.info(f"Added index {table}.{index}")
+
+
+# Data fixes run once per database, in order; completion is recorded in
+# job_state under 'migration:<name>'
+# (name, statements)
+DATA_MIGRATIONS = [
+    # Copy item summaries onto requests created before the columns existed
+    ('request-item-summaries', [
+        f"""UPDATE requests SET
+                item_title = (SELECT title FROM {table} WHERE {table}.id = requests.item_id),
+                item_creator = (SELECT {creator} FROM {table} WHERE {table}.id = requests.item_id),
+                item_image = (SELECT {image} FROM {table} WHERE {table}.id = requests.item_id)
+            WHERE item_type = '{item_type}' AND item_title IS NULL"""
+        for item_type, table, creator, image in (('book', 'books', 'author', 'cover_url'),
+                                                 ('boardgame', 'board_games', 'designer', 'image_url'))
+    ]),
+]
+
+
+def apply_data_migrations(cursor):
+    """Run the DATA_MIGRATIONS this database has not run yet
+
+    Args:
+        cursor: Cursor on the initialized database
+    """
+    placeholder = '?' if DB_TYPE == 'sqlite' else '%s'
+
+    for name, statements in DATA_MIGRATIONS:
+        key = f"migration:{name}"
+        cursor.execute(f"SELECT name FROM job_state WHERE name = {placeholder}", (key,))
+        if cursor.fetchall():
+            continue
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute(
+            f"{INSERT_IGNORE} INTO job_state (name, updated_at) VALUES ({placeholder}, {placeholder})",
+            (key, db_timestamp())
+        )
+        logger.info(f"Applied data migration {name}")
+
+
+def incremental_vacuum(pages):
+    """Return up to pages free pages of the SQLite file to the filesystem
+
+    Args:
+        pages: Maximum number of pages to release
+
+    Returns:
+        Number of pages released (0 for MySQL or without auto_vacuum)
+    """
+    if DB_TYPE != 'sqlite' or pages <= 0:
+        return 0
+
+    conn = sqlite3.connect(SQLITE_DB_PATH)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # executescript steps the pragma to completion (execute frees one page)
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return before - after
+    finally:
+        conn.close()
+
+
 def init_database():
     """Initialize database with tables if they don't exist"""
     conn = None
@@ -252,6 +489,10 @@ def init_database():
             # Enable foreign keys
             cursor.execute("PRAGMA foreign_keys = ON")
 
+            # Let retention jobs hand freed pages back in small steps (applies
+            # to new database files; existing ones need a one-off VACUUM)
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
             # Create tables with SQLite-compatible syntax
             tables = [
                 """CREATE TABLE IF NOT EXISTS users (
@@ -267,6 +508,7 @@ def init_database():
                     interests TEXT,
                     is_admin INTEGER DEFAULT 0,
                     is_active INTEGER DEFAULT 1,
+                    token_epoch INTEGER DEFAULT 0,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )""",
@@ -308,6 +550,7 @@ def init_database():
                     tags TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    version INTEGER NOT NULL DEFAULT 1,
                     FOREIGN KEY (owner_id) REFERENCES users(id),
                     FOREIGN KEY (community_id) REFERENCES communities(id)
                 )""",
@@ -329,6 +572,7 @@ def init_database():
                     components TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    version INTEGER NOT NULL DEFAULT 1,
                     FOREIGN KEY (owner_id) REFERENCES users(id),
                     FOREIGN KEY (community_id) REFERENCES communities(id)
                 )""",
@@ -345,6 +589,10 @@ def init_database():
                     pickup_date DATE,
                     return_date DATE,
                     notes TEXT,
+                    item_title VARCHAR(200),
+                    item_creator VARCHAR(100),
+                    item_image VARCHAR(500),
+                    version INTEGER NOT NULL DEFAULT 1,
                     FOREIGN KEY (requester_id) REFERENCES users(id),
                     FOREIGN KEY (owner_id) REFERENCES users(id)
                 )""",
@@ -357,6 +605,7 @@ def init_database():
                     type VARCHAR(10) DEFAULT 'info' CHECK (type IN ('info', 'success', 'warning', 'error')),
                     is_read INTEGER DEFAULT 0,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    event_key VARCHAR(64),
                     FOREIGN KEY (user_id) REFERENCES users(id)
                 )""",
 
@@ -368,6 +617,180 @@ def init_database():
                     item_id INTEGER,
                     details TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    event_key VARCHAR(64),
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS refresh_tokens (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    token_hash CHAR(64) UNIQUE NOT NULL,
+                    expires_at TIMESTAMP NOT NULL,
+                    revoked_at TIMESTAMP,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS revoked_tokens (
+                    jti VARCHAR(64) PRIMARY KEY,
+                    user_id INTEGER,
+                    expires_at TIMESTAMP NOT NULL,
+                    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_key VARCHAR(64) UNIQUE NOT NULL,
+                    event_type VARCHAR(50) NOT NULL,
+                    payload TEXT NOT NULL,
+                    status VARCHAR(10) DEFAULT 'pending' CHECK (status IN ('pending', 'done', 'failed')),
+                    attempts INTEGER DEFAULT 0,
+                    available_at TIMESTAMP NOT NULL,
+                    claim_token VARCHAR(32),
+                    last_error TEXT,
+                    processed_at TIMESTAMP,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS notification_counters (
+                    user_id INTEGER PRIMARY KEY,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    unread INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS request_counters (
+                    user_id INTEGER PRIMARY KEY,
+                    sent_pending INTEGER NOT NULL DEFAULT 0,
+                    sent_approved INTEGER NOT NULL DEFAULT 0,
+                    sent_rejected INTEGER NOT NULL DEFAULT 0,
+                    sent_returned INTEGER NOT NULL DEFAULT 0,
+                    received_pending INTEGER NOT NULL DEFAULT 0,
+                    received_approved INTEGER NOT NULL DEFAULT 0,
+                    received_rejected INTEGER NOT NULL DEFAULT 0,
+                    received_returned INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS email_deliveries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_key VARCHAR(64) UNIQUE NOT NULL,
+                    user_id INTEGER,
+                    recipient VARCHAR(100) NOT NULL,
+                    subject VARCHAR(255) NOT NULL,
+                    body TEXT NOT NULL,
+                    status VARCHAR(10) DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed')),
+                    attempts INTEGER DEFAULT 0,
+                    available_at TIMESTAMP NOT NULL,
+                    claim_token VARCHAR(32),
+                    last_error TEXT,
+                    sent_at TIMESTAMP,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS notification_preferences (
+                    user_id INTEGER PRIMARY KEY,
+                    digest_mode VARCHAR(10) DEFAULT 'off' CHECK (digest_mode IN ('off', 'hourly', 'daily')),
+                    last_digest_at TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS digest_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    title VARCHAR(200),
+                    message TEXT,
+                    type VARCHAR(10) DEFAULT 'info',
+                    email INTEGER DEFAULT 0,
+                    event_key VARCHAR(64) UNIQUE NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS job_leases (
+                    name VARCHAR(100) PRIMARY KEY,
+                    holder VARCHAR(100) NOT NULL,
+                    expires_at TIMESTAMP NOT NULL
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS job_state (
+                    name VARCHAR(100) PRIMARY KEY,
+                    state TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS waitlist_entries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    item_type VARCHAR(10) NOT NULL CHECK (item_type IN ('book', 'boardgame')),
+                    item_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    loan_days INTEGER NOT NULL DEFAULT 14,
+                    notes TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (item_type, item_id, user_id),
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS loan_history (
+                    request_id INTEGER PRIMARY KEY,
+                    item_type VARCHAR(10) NOT NULL CHECK (item_type IN ('book', 'boardgame')),
+                    item_id INTEGER NOT NULL,
+                    item_title VARCHAR(200),
+                    owner_id INTEGER NOT NULL,
+                    borrower_id INTEGER NOT NULL,
+                    requested_at TIMESTAMP,
+                    approved_at TIMESTAMP,
+                    pickup_date DATE,
+                    return_date DATE,
+                    returned_on DATE,
+                    status VARCHAR(10) NOT NULL DEFAULT 'active' CHECK (status IN ('active', 'returned')),
+                    response_minutes INTEGER,
+                    planned_days INTEGER,
+                    loan_days INTEGER,
+                    late_days INTEGER,
+                    FOREIGN KEY (owner_id) REFERENCES users(id),
+                    FOREIGN KEY (borrower_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS user_lending_stats (
+                    user_id INTEGER PRIMARY KEY,
+                    lent_count INTEGER NOT NULL DEFAULT 0,
+                    lent_returned INTEGER NOT NULL DEFAULT 0,
+                    lent_days INTEGER NOT NULL DEFAULT 0,
+                    response_minutes INTEGER NOT NULL DEFAULT 0,
+                    borrowed_count INTEGER NOT NULL DEFAULT 0,
+                    borrowed_returned INTEGER NOT NULL DEFAULT 0,
+                    borrowed_days INTEGER NOT NULL DEFAULT 0,
+                    late_returns INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS item_loan_stats (
+                    item_type VARCHAR(10) NOT NULL CHECK (item_type IN ('book', 'boardgame')),
+                    item_id INTEGER NOT NULL,
+                    owner_id INTEGER,
+                    item_title VARCHAR(200),
+                    last_loan_at TIMESTAMP,
+                    loan_count INTEGER NOT NULL DEFAULT 0,
+                    returned_count INTEGER NOT NULL DEFAULT 0,
+                    loan_days INTEGER NOT NULL DEFAULT 0,
+                    late_returns INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (item_type, item_id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    user_id INTEGER NOT NULL,
+                    idempotency_key VARCHAR(64) NOT NULL,
+                    request_hash CHAR(64) NOT NULL,
+                    status_code INTEGER,
+                    response TEXT,
+                    expires_at TIMESTAMP NOT NULL,
+                    PRIMARY KEY (user_id, idempotency_key),
                     FOREIGN KEY (user_id) REFERENCES users(id)
                 )"""
             ]
@@ -383,9 +806,36 @@ def init_database():
                 "CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status)",
                 "CREATE INDEX IF NOT EXISTS idx_requests_requester ON requests(requester_id)",
                 "CREATE INDEX IF NOT EXISTS idx_requests_owner ON requests(owner_id)",
+                "CREATE INDEX IF NOT EXISTS idx_requests_requester_status ON requests(requester_id, status)",
+                "CREATE INDEX IF NOT EXISTS idx_requests_owner_status ON requests(owner_id, status)",
+                "CREATE INDEX IF NOT EXISTS idx_requests_item ON requests(item_type, item_id, status)",
+                "CREATE INDEX IF NOT EXISTS idx_requests_status_return ON requests(status, return_date)",
+                "CREATE INDEX IF NOT EXISTS idx_waitlist_item ON waitlist_entries(item_type, item_id, created_at, id)",
+                "CREATE INDEX IF NOT EXISTS idx_waitlist_user ON waitlist_entries(user_id)",
+                "CREATE INDEX IF NOT EXISTS idx_loan_history_owner ON loan_history(owner_id, approved_at)",
+                "CREATE INDEX IF NOT EXISTS idx_loan_history_borrower ON loan_history(borrower_id, approved_at)",
+                "CREATE INDEX IF NOT EXISTS idx_loan_history_item ON loan_history(item_type, item_id)",
+                "CREATE INDEX IF NOT EXISTS idx_loan_history_status ON loan_history(status)",
+                "CREATE INDEX IF NOT EXISTS idx_lending_stats_lent ON user_lending_stats(lent_count)",
+                "CREATE INDEX IF NOT EXISTS idx_lending_stats_borrowed ON user_lending_stats(borrowed_count)",
+                "CREATE INDEX IF NOT EXISTS idx_item_loan_stats_count ON item_loan_stats(loan_count)",
+                "CREATE INDEX IF NOT EXISTS idx_item_loan_stats_type_count ON item_loan_stats(item_type, loan_count)",
+                "CREATE INDEX IF NOT EXISTS idx_item_loan_stats_owner ON item_loan_stats(owner_id)",
+                "CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)",
                 "CREATE INDEX IF NOT EXISTS idx_notifications_user_read ON notifications(user_id, is_read)",
+                "CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications(user_id, created_at)",
+                "CREATE INDEX IF NOT EXISTS idx_notifications_read_created ON notifications(is_read, created_at)",
                 "CREATE INDEX IF NOT EXISTS idx_activity_user ON activity_log(user_id)",
-                "CREATE INDEX IF NOT EXISTS idx_activity_created ON activity_log(created_at)"
+                "CREATE INDEX IF NOT EXISTS idx_activity_created ON activity_log(created_at)",
+                "CREATE INDEX IF NOT EXISTS idx_refresh_tokens_user ON refresh_tokens(user_id)",
+                "CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON revoked_tokens(expires_at)",
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_event_key ON notifications(event_key)",
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_activity_event_key ON activity_log(event_key)",
+                "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(status, available_at)",
+                "CREATE INDEX IF NOT EXISTS idx_outbox_claim ON outbox(claim_token)",
+                "CREATE INDEX IF NOT EXISTS idx_email_pending ON email_deliveries(status, available_at)",
+                "CREATE INDEX IF NOT EXISTS idx_email_claim ON email_deliveries(claim_token)",
+                "CREATE INDEX IF NOT EXISTS idx_digest_events_user ON digest_events(user_id, id)"
             ]
 
         else:
@@ -415,6 +865,7 @@ def init_database():
                     interests JSON,
                     is_admin BOOLEAN DEFAULT FALSE,
                     is_active BOOLEAN DEFAULT TRUE,
+                    token_epoch INT DEFAULT 0,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
                 )""",
@@ -456,6 +907,7 @@ def init_database():
                     tags JSON,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    version INT NOT NULL DEFAULT 1,
                     FOREIGN KEY (owner_id) REFERENCES users(id),
                     FOREIGN KEY (community_id) REFERENCES communities(id),
                     INDEX idx_title (title),
@@ -480,6 +932,7 @@ def init_database():
                     components JSON,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    version INT NOT NULL DEFAULT 1,
                     FOREIGN KEY (owner_id) REFERENCES users(id),
                     FOREIGN KEY (community_id) REFERENCES communities(id),
                     INDEX idx_title (title),
@@ -499,11 +952,19 @@ def init_database():
                     pickup_date DATE,
                     return_date DATE,
                     notes TEXT,
+                    item_title VARCHAR(200),
+                    item_creator VARCHAR(100),
+                    item_image VARCHAR(500),
+                    version INT NOT NULL DEFAULT 1,
                     FOREIGN KEY (requester_id) REFERENCES users(id),
                     FOREIGN KEY (owner_id) REFERENCES users(id),
                     INDEX idx_status (status),
                     INDEX idx_requester (requester_id),
-                    INDEX idx_owner (owner_id)
+                    INDEX idx_owner (owner_id),
+                    INDEX idx_requester_status (requester_id, status),
+                    INDEX idx_owner_status (owner_id, status),
+                    INDEX idx_item (item_type, item_id, status),
+                    INDEX idx_status_return (status, return_date)
                 )""",
 
                 """CREATE TABLE IF NOT EXISTS notifications (
@@ -514,8 +975,11 @@ def init_database():
                     type ENUM('info', 'success', 'warning', 'error') DEFAULT 'info',
                     is_read BOOLEAN DEFAULT FALSE,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    event_key VARCHAR(64) NULL UNIQUE,
                     FOREIGN KEY (user_id) REFERENCES users(id),
-                    INDEX idx_user_read (user_id, is_read)
+                    INDEX idx_user_read (user_id, is_read),
+                    INDEX idx_user_created (user_id, created_at),
+                    INDEX idx_read_created (is_read, created_at)
                 )""",
 
                 """CREATE TABLE IF NOT EXISTS activity_log (
@@ -526,9 +990,202 @@ def init_database():
                     item_id INT,
                     details JSON,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    event_key VARCHAR(64) NULL UNIQUE,
                     FOREIGN KEY (user_id) REFERENCES users(id),
                     INDEX idx_user (user_id),
                     INDEX idx_created (created_at)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS refresh_tokens (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    token_hash CHAR(64) UNIQUE NOT NULL,
+                    expires_at DATETIME NOT NULL,
+                    revoked_at DATETIME NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id),
+                    INDEX idx_user (user_id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS revoked_tokens (
+                    jti VARCHAR(64) PRIMARY KEY,
+                    user_id INT,
+                    expires_at DATETIME NOT NULL,
+                    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_expires (expires_at)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS outbox (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    event_key VARCHAR(64) UNIQUE NOT NULL,
+                    event_type VARCHAR(50) NOT NULL,
+                    payload JSON NOT NULL,
+                    status ENUM('pending', 'done', 'failed') DEFAULT 'pending',
+                    attempts INT DEFAULT 0,
+                    available_at DATETIME NOT NULL,
+                    claim_token VARCHAR(32) NULL,
+                    last_error TEXT,
+                    processed_at DATETIME NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_pending (status, available_at),
+                    INDEX idx_claim (claim_token)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS notification_counters (
+                    user_id INT PRIMARY KEY,
+                    total INT NOT NULL DEFAULT 0,
+                    unread INT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS request_counters (
+                    user_id INT PRIMARY KEY,
+                    sent_pending INT NOT NULL DEFAULT 0,
+                    sent_approved INT NOT NULL DEFAULT 0,
+                    sent_rejected INT NOT NULL DEFAULT 0,
+                    sent_returned INT NOT NULL DEFAULT 0,
+                    received_pending INT NOT NULL DEFAULT 0,
+                    received_approved INT NOT NULL DEFAULT 0,
+                    received_rejected INT NOT NULL DEFAULT 0,
+                    received_returned INT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS email_deliveries (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    event_key VARCHAR(64) UNIQUE NOT NULL,
+                    user_id INT,
+                    recipient VARCHAR(100) NOT NULL,
+                    subject VARCHAR(255) NOT NULL,
+                    body TEXT NOT NULL,
+                    status ENUM('pending', 'sent', 'failed') DEFAULT 'pending',
+                    attempts INT DEFAULT 0,
+                    available_at DATETIME NOT NULL,
+                    claim_token VARCHAR(32) NULL,
+                    last_error TEXT,
+                    sent_at DATETIME NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_pending (status, available_at),
+                    INDEX idx_claim (claim_token)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS notification_preferences (
+                    user_id INT PRIMARY KEY,
+                    digest_mode ENUM('off', 'hourly', 'daily') DEFAULT 'off',
+                    last_digest_at DATETIME NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS digest_events (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    title VARCHAR(200),
+                    message TEXT,
+                    type ENUM('info', 'success', 'warning', 'error') DEFAULT 'info',
+                    email BOOLEAN DEFAULT FALSE,
+                    event_key VARCHAR(64) UNIQUE NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id),
+                    INDEX idx_user (user_id, id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS job_leases (
+                    name VARCHAR(100) PRIMARY KEY,
+                    holder VARCHAR(100) NOT NULL,
+                    expires_at DATETIME NOT NULL
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS job_state (
+                    name VARCHAR(100) PRIMARY KEY,
+                    state TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS waitlist_entries (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    item_type ENUM('book', 'boardgame') NOT NULL,
+                    item_id INT NOT NULL,
+                    user_id INT NOT NULL,
+                    loan_days INT NOT NULL DEFAULT 14,
+                    notes TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE KEY uniq_item_user (item_type, item_id, user_id),
+                    FOREIGN KEY (user_id) REFERENCES users(id),
+                    INDEX idx_item_created (item_type, item_id, created_at, id),
+                    INDEX idx_user (user_id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS loan_history (
+                    request_id INT PRIMARY KEY,
+                    item_type ENUM('book', 'boardgame') NOT NULL,
+                    item_id INT NOT NULL,
+                    item_title VARCHAR(200),
+                    owner_id INT NOT NULL,
+                    borrower_id INT NOT NULL,
+                    requested_at DATETIME NULL,
+                    approved_at DATETIME NULL,
+                    pickup_date DATE,
+                    return_date DATE,
+                    returned_on DATE NULL,
+                    status ENUM('active', 'returned') NOT NULL DEFAULT 'active',
+                    response_minutes INT NULL,
+                    planned_days INT NULL,
+                    loan_days INT NULL,
+                    late_days INT NULL,
+                    FOREIGN KEY (owner_id) REFERENCES users(id),
+                    FOREIGN KEY (borrower_id) REFERENCES users(id),
+                    INDEX idx_owner (owner_id, approved_at),
+                    INDEX idx_borrower (borrower_id, approved_at),
+                    INDEX idx_item (item_type, item_id),
+                    INDEX idx_status (status)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS user_lending_stats (
+                    user_id INT PRIMARY KEY,
+                    lent_count INT NOT NULL DEFAULT 0,
+                    lent_returned INT NOT NULL DEFAULT 0,
+                    lent_days INT NOT NULL DEFAULT 0,
+                    response_minutes INT NOT NULL DEFAULT 0,
+                    borrowed_count INT NOT NULL DEFAULT 0,
+                    borrowed_returned INT NOT NULL DEFAULT 0,
+                    borrowed_days INT NOT NULL DEFAULT 0,
+                    late_returns INT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id),
+                    INDEX idx_lent (lent_count),
+                    INDEX idx_borrowed (borrowed_count)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS item_loan_stats (
+                    item_type ENUM('book', 'boardgame') NOT NULL,
+                    item_id INT NOT NULL,
+                    owner_id INT NULL,
+                    item_title VARCHAR(200),
+                    last_loan_at DATETIME NULL,
+                    loan_count INT NOT NULL DEFAULT 0,
+                    returned_count INT NOT NULL DEFAULT 0,
+                    loan_days INT NOT NULL DEFAULT 0,
+                    late_returns INT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (item_type, item_id),
+                    INDEX idx_count (loan_count),
+                    INDEX idx_type_count (item_type, loan_count),
+                    INDEX idx_owner (owner_id)
+                )""",
+
+                """CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    user_id INT NOT NULL,
+                    idempotency_key VARCHAR(64) NOT NULL,
+                    request_hash CHAR(64) NOT NULL,
+                    status_code SMALLINT NULL,
+                    response TEXT,
+                    expires_at DATETIME NOT NULL,
+                    PRIMARY KEY (user_id, idempotency_key),
+                    FOREIGN KEY (user_id) REFERENCES users(id),
+                    INDEX idx_expires (expires_at)
                 )"""
             ]
 
@@ -539,13 +1196,36 @@ def init_database():
             cursor.execute(table_query)
             logger.info(f"Table created/verified")
 
+        # Add columns introduced after the initial schema
+        apply_column_migrations(cursor)
+
         # Execute index creation
         for index_query in indexes:
             cursor.execute(index_query)
+        apply_index_migrations(cursor)
+
+        # One-shot data fixes (e.g. backfilling new columns)
+        apply_data_migrations(cursor)
+
+        # Seed counters for users that have notifications but no counter row
+        # (first start after the table was added)
+        cursor.execute(
+            f"""{INSERT_IGNORE} INTO notification_counters (user_id, total, unread)
+                SELECT user_id, COUNT(*), SUM(CASE WHEN is_read = FALSE THEN 1 ELSE 0 END)
+                FROM notifications
+                WHERE user_id IS NOT NULL
+                  AND user_id NOT IN (SELECT user_id FROM notification_counters)
+                GROUP BY user_id"""
+        )
 
         conn.commit()
         logger.info(f"Database initialization completed successfully ({DB_TYPE})")
 
+        if DB_TYPE == 'sqlite':
+            cursor.execute("PRAGMA auto_vacuum")
+            if cursor.fetchone()[0] != 2:
+                logger.info("SQLite incremental vacuum is off; run VACUUM once to enable it")
+
         # Initialize connection pool for MySQL after database is ready
         if DB_TYPE == 'mysql':
             init_mysql_pool()
@@ -563,6 +1243,12 @@ def init_database():
             conn.close()
 
 
+def db_timestamp(value=None):
+    """Format a UTC datetime for TIMESTAMP/DATETIME columns (defaults to now)"""
+    value = value or datetime.utcnow()
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
 # Helper function to handle JSON fields
 def json_serialize(data):
     """Serialize data to JSON string for storage"""
@@ -10,6 +10,8 @@ from .admin import router as admin_router
 from .activity import router as activity_router
 from .notifications import router as notifications_router
 from .search import router as search_router
+from .waitlist import router as waitlist_router
+from .loans import router as loans_router
 
 __all__ = [
     'users_router',
@@ -19,5 +21,7 @@ __all__ = [
     'admin_router',
     'activity_router',
     'notifications_router',
-    'search_router'
+    'search_router',
+    'waitlist_router',
+    'loans_router'
 ]
\ No newline at end of file
@@ -5,8 +5,16 @@ from datetime import datetime, timedelta
 import json
 import os
 
-from database import execute_query, execute_one
+from database import execute_query, execute_one, transaction
 from utils.jwt_handler import get_current_user, require_admin
+from utils.token_epoch import token_epochs
+from utils.cache import user_cache
+from auth import AuthService
+from services.activity_logger import log_activity_async
+from services.request_counters import adjust_request_counters
+from services.loan_history import (
+    forget_user_loans, get_top_users, get_popular_items, summarize_lending, USER_COLUMNS
+)
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
@@ -98,32 +106,10 @@ async def get_admin_stats(current_user: dict = Depends(require_admin)):
 
     stats['recent_activities'] = recent_activities
 
-    # Top users
-    top_lenders = execute_query(
-        """SELECT u.id, u.username, COUNT(r.id) as loans_count
-           FROM users u
-           JOIN requests r ON u.id = r.owner_id
-           WHERE r.status IN ('approved', 'returned')
-           GROUP BY u.id, u.username
-           ORDER BY loans_count DESC
-           LIMIT 5""",
-        fetch=True
-    )
-
-    top_borrowers = execute_query(
-        """SELECT u.id, u.username, COUNT(r.id) as borrows_count
-           FROM users u
-           JOIN requests r ON u.id = r.requester_id
-           WHERE r.status IN ('approved', 'returned')
-           GROUP BY u.id, u.username
-           ORDER BY borrows_count DESC
-           LIMIT 5""",
-        fetch=True
-    )
-
+    # Top users, from the lending totals
     stats['top_users'] = {
-        'lenders': top_lenders,
-        'borrowers': top_borrowers
+        'lenders': get_top_users('lent'),
+        'borrowers': get_top_users('borrowed')
     }
 
     return {"success": True, "data": stats}
@@ -346,6 +332,12 @@ async def update_user(
         query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s"
         execute_query(query, params)
 
+        # Role/activation changes invalidate the user's existing tokens
+        token_epochs.bump(user_id)
+        user_cache.invalidate(user_id)
+        if updates.is_active is False:
+            AuthService.revoke_user_refresh_tokens(user_id)
+
         # Log activity
         changes = {}
         if updates.is_admin is not None:
@@ -353,11 +345,7 @@ async def update_user(
         if updates.is_active is not None:
             changes['is_active'] = updates.is_active
 
-        execute_query(
-            """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-               VALUES (%s, %s, %s, %s, %s)""",
-            (current_user['id'], 'updated_user', 'user', user_id, json.dumps(changes))
-        )
+        await log_activity_async(current_user['id'], 'updated_user', 'user', user_id, changes)
 
     return {"success": True, "message": "User updated successfully"}
 
@@ -387,34 +375,57 @@ async def delete_user(
             )
 
     # Delete user's data in order (due to foreign key constraints)
-    # 1. Delete notifications
+    # 1. Delete notifications and their counters
     execute_query("DELETE FROM notifications WHERE user_id = %s", (user_id,))
+    execute_query("DELETE FROM notification_counters WHERE user_id = %s", (user_id,))
+    execute_query("DELETE FROM notification_preferences WHERE user_id = %s", (user_id,))
+    execute_query("DELETE FROM digest_events WHERE user_id = %s", (user_id,))
 
     # 2. Delete activity logs
     execute_query("DELETE FROM activity_log WHERE user_id = %s", (user_id,))
 
-    # 3. Delete requests (both as requester and owner)
-    execute_query("DELETE FROM requests WHERE requester_id = %s OR owner_id = %s", (user_id, user_id))
+    # 3. Delete requests (both as requester and owner), loan history and
+    # their counts on the other party's counters and lending totals
+    with transaction() as tx:
+        requests = tx.fetch_all(
+            "SELECT requester_id, owner_id, status FROM requests WHERE requester_id = %s OR owner_id = %s",
+            (user_id, user_id)
+        )
+        tx.execute("DELETE FROM requests WHERE requester_id = %s OR owner_id = %s", (user_id, user_id))
+        adjust_request_counters(
+            tx, [(r['requester_id'], r['owner_id'], r['status'], None) for r in requests]
+        )
+        tx.execute("DELETE FROM request_counters WHERE user_id = %s", (user_id,))
+        forget_user_loans(tx, user_id)
 
-    # 4. Delete books
+    # 4. Delete waitlist entries (theirs and those for their items)
+    execute_query(
+        """DELETE FROM waitlist_entries
+           WHERE user_id = %s
+           OR (item_type = 'book' AND item_id IN (SELECT id FROM books WHERE owner_id = %s))
+           OR (item_type = 'boardgame' AND item_id IN (SELECT id FROM board_games WHERE owner_id = %s))""",
+        (user_id, user_id, user_id)
+    )
+
+    # 5. Delete books
     execute_query("DELETE FROM books WHERE owner_id = %s", (user_id,))
 
-    # 5. Delete board games
+    # 6. Delete board games
     execute_query("DELETE FROM board_games WHERE owner_id = %s", (user_id,))
 
-    # 6. Delete community memberships
+    # 7. Delete community memberships, sessions and idempotency keys
     execute_query("DELETE FROM community_members WHERE user_id = %s", (user_id,))
+    execute_query("DELETE FROM refresh_tokens WHERE user_id = %s", (user_id,))
+    execute_query("DELETE FROM idempotency_keys WHERE user_id = %s", (user_id,))
 
-    # 7. Finally, delete the user
+    # 8. Finally, delete the user
     execute_query("DELETE FROM users WHERE id = %s", (user_id,))
+    token_epochs.forget(user_id)
+    user_cache.invalidate(user_id)
 
     # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (current_user['id'], 'deleted_user', 'user', user_id,
-         json.dumps({"username": user['username']}))
-    )
+    await log_activity_async(current_user['id'], 'deleted_user', 'user', user_id,
+                             {"username": user['username']})
 
     return {"success": True, "message": "User and all associated data deleted successfully"}
 
@@ -527,12 +538,8 @@ async def create_community(
     )
 
     # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (current_user['id'], 'created_community', 'community', community_id,
-         json.dumps({"name": community.name}))
-    )
+    await log_activity_async(current_user['id'], 'created_community', 'community', community_id,
+                             {"name": community.name})
 
     return {"success": True, "data": {"id": community_id, "message": "Community created successfully"}}
 
@@ -608,4 +615,29 @@ async def get_usage_report(
             f"SELECT COUNT(*) as count FROM requests WHERE request_date >= DATE_SUB(CURRENT_DATE, INTERVAL {days} DAY)"
         )['count']
 
-    return {"success": True, "data": report}
\ No newline at end of file
+    return {"success": True, "data": report}
+
+
+@router.get("/reports/lending")
+async def get_lending_report(
+        limit: int = Query(10, ge=1, le=50),
+        current_user: dict = Depends(require_admin)
+):
+    """Get lending analytics: top lenders and borrowers, popular items and averages"""
+    totals = execute_one(
+        f"SELECT {', '.join(f'SUM({c}) as {c}' for c in USER_COLUMNS)} FROM user_lending_stats"
+    )
+    active_loans = execute_one(
+        "SELECT COUNT(*) as count FROM loan_history WHERE status = 'active'"
+    )['count']
+
+    report = {
+        'top_lenders': get_top_users('lent', limit),
+        'top_borrowers': get_top_users('borrowed', limit),
+        'popular_items': get_popular_items(limit=limit),
+        'active_loans': active_loans,
+        # Every loan has a lender and a borrower, so the lent side covers all loans
+        'averages': summarize_lending(totals)
+    }
+
+    return {"success": True, "data": report}
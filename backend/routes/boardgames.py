@@ -1,12 +1,20 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Header, Response
 from pydantic import BaseModel, Field
 from typing import Optional, List
 import json
 from datetime import datetime
 
-from database import execute_query, execute_one
+from database import execute_query, execute_one, transaction
 from utils.jwt_handler import get_current_user
-from utils.validators import sanitize_html
+from utils.validators import validate_date_range, sanitize_html
+from utils.cache import catalog_cache
+from utils.versioning import etag, expected_version, version_conflict
+from services.activity_logger import log_activity_async
+from services.idempotency import IdempotentRequest
+from services.item_summaries import refresh_item_summaries
+from services.reservations import bookable_condition, free_condition
+from services.waitlists import promote_next
+from services.notifications import notify_async
 
 router = APIRouter(prefix="/api/boardgames", tags=["boardgames"])
 
@@ -36,6 +44,7 @@ class BoardGameUpdate(BaseModel):
     categories: Optional[List[str]] = None
     components: Optional[List[str]] = None
     is_available: Optional[bool] = None
+    expected_version: Optional[int] = Field(None, ge=1, description="Version the update is based on")
 
 
 def safe_format_datetime(dt_value):
@@ -54,6 +63,8 @@ async def get_boardgames(
         search: Optional[str] = Query(None, description="Search in title or designer"),
         complexity: Optional[str] = Query(None, pattern="^(Easy|Medium|Hard)$"),
         available: Optional[bool] = Query(None, description="Filter by availability"),
+        free_from: Optional[str] = Query(None, description="Free from this day (YYYY-MM-DD)"),
+        free_until: Optional[str] = Query(None, description="Free until this day (YYYY-MM-DD, exclusive)"),
         min_players: Optional[int] = Query(None, ge=1),
         max_players: Optional[int] = Query(None, le=20),
         owner_id: Optional[int] = Query(None, description="Filter by owner"),
@@ -85,6 +96,15 @@ async def get_boardgames(
         query += " AND bg.is_available = %s"
         params.append(available)
 
+    if free_from or free_until:
+        if not (free_from and free_until and validate_date_range(free_from, free_until)):
+            raise HTTPException(
+                status_code=400,
+                detail="free_from and free_until must both be given, with free_until after free_from"
+            )
+        query += f" AND {bookable_condition('boardgame', 'bg')} AND {free_condition('boardgame', 'bg')}"
+        params.extend([free_until, free_from])
+
     if min_players is not None:
         query += " AND bg.min_players <= %s AND bg.max_players >= %s"
         params.extend([min_players, min_players])
@@ -127,9 +147,16 @@ async def get_boardgames(
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def create_boardgame(
         game: BoardGameCreate,
+        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
         current_user: dict = Depends(get_current_user)
 ):
     """Create a new board game"""
+    # A retry of a create that already succeeded gets the original response
+    idempotency = IdempotentRequest(idempotency_key, current_user['id'], 'POST /api/boardgames', game)
+    replay = idempotency.lookup()
+    if replay:
+        return replay
+
     # Validate min/max players
     if game.min_players and game.max_players:
         if game.min_players > game.max_players:
@@ -142,37 +169,40 @@ async def create_boardgame(
     if game.description:
         game.description = sanitize_html(game.description)
 
-    game_id = execute_query(
-        """INSERT INTO board_games (title, designer, min_players, max_players, 
-           play_time, complexity, description, image_url, owner_id, categories, components)
-           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-        (game.title, game.designer, game.min_players, game.max_players,
-         game.play_time, game.complexity, game.description, game.image_url,
-         current_user['id'], json.dumps(game.categories), json.dumps(game.components))
-    )
+    with transaction() as tx:
+        replay = idempotency.claim(tx)
+        if replay:
+            return replay
+
+        game_id = tx.execute(
+            """INSERT INTO board_games (title, designer, min_players, max_players, 
+               play_time, complexity, description, image_url, owner_id, categories, components)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+            (game.title, game.designer, game.min_players, game.max_players,
+             game.play_time, game.complexity, game.description, game.image_url,
+             current_user['id'], json.dumps(game.categories), json.dumps(game.components))
+        )
+
+        result = {"success": True, "data": {"id": game_id, "message": "Board game created successfully"}}
+        idempotency.save(tx, result)
+
+    catalog_cache.invalidate('boardgame_complexities', 'boardgame_categories')
 
     # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (current_user['id'], 'added', 'boardgame', game_id,
-         json.dumps({"title": game.title, "designer": game.designer}))
-    )
+    await log_activity_async(current_user['id'], 'added', 'boardgame', game_id,
+                             {"title": game.title, "designer": game.designer})
 
     # Create notification
-    execute_query(
-        """INSERT INTO notifications (user_id, title, message, type)
-           VALUES (%s, %s, %s, %s)""",
-        (current_user['id'], 'Board Game Added',
-         f'You have successfully added "{game.title}"', 'success')
-    )
+    await notify_async(current_user['id'], 'Board Game Added',
+                       f'You have successfully added "{game.title}"', 'success')
 
-    return {"success": True, "data": {"id": game_id, "message": "Board game created successfully"}}
+    return result
 
 
 @router.get("/{game_id}")
 async def get_boardgame(
         game_id: int,
+        response: Response,
         current_user: dict = Depends(get_current_user)
 ):
     """Get board game by ID"""
@@ -198,6 +228,7 @@ async def get_boardgame(
         game.pop('owner_email', None)
         game.pop('owner_phone', None)
 
+    response.headers['ETag'] = etag(game['version'])
     return {"success": True, "data": game}
 
 
@@ -205,11 +236,15 @@ async def get_boardgame(
 async def update_boardgame(
         game_id: int,
         game_update: BoardGameUpdate,
+        response: Response,
+        if_match: Optional[str] = Header(None, alias="If-Match"),
         current_user: dict = Depends(get_current_user)
 ):
     """Update board game (owner only)"""
+    version = expected_version(if_match, game_update.expected_version)
+
     # Check ownership
-    game = execute_one("SELECT owner_id FROM board_games WHERE id = %s", (game_id,))
+    game = execute_one("SELECT owner_id, version FROM board_games WHERE id = %s", (game_id,))
     if not game:
         raise HTTPException(status_code=404, detail="Board game not found")
 
@@ -274,18 +309,45 @@ async def update_boardgame(
 
     if update_fields:
         update_fields.append("updated_at = CURRENT_TIMESTAMP")
+        update_fields.append("version = version + 1")
         params.append(game_id)
         query = f"UPDATE board_games SET {', '.join(update_fields)} WHERE id = %s"
-        execute_query(query, params)
+        if version is not None:
+            # Compare and swap: only apply the edit to the version it was made on
+            query += " AND version = %s"
+            params.append(version)
+        with transaction() as tx:
+            # Listing the item again hands it to the first user waiting for
+            # it; flipped on its own first to learn whether it was unlisted
+            relisted = bool(game_update.is_available) and tx.execute(
+                "UPDATE board_games SET is_available = TRUE WHERE id = %s AND is_available = FALSE",
+                (game_id,)
+            )
+            if not tx.execute(query, params):
+                current = tx.fetch_one("SELECT version FROM board_games WHERE id = %s", (game_id,))
+                if not current:
+                    raise HTTPException(status_code=404, detail="Board game not found")
+                raise version_conflict(current['version'])
+            game['version'] = tx.fetch_one("SELECT version FROM board_games WHERE id = %s", (game_id,))['version']
+            # Requests show a copy of the title, creator and image
+            if (game_update.title is not None or game_update.designer is not None
+                    or game_update.image_url is not None):
+                refresh_item_summaries(tx, 'boardgame', game_id)
+            if relisted:
+                promote_next(tx, 'boardgame', game_id, current_user['id'])
+
+        if game_update.complexity is not None or game_update.categories is not None:
+            catalog_cache.invalidate('boardgame_complexities', 'boardgame_categories')
 
         # Log activity
-        execute_query(
-            """INSERT INTO activity_log (user_id, action, item_type, item_id)
-               VALUES (%s, %s, %s, %s)""",
-            (current_user['id'], 'updated', 'boardgame', game_id)
-        )
+        await log_activity_async(current_user['id'], 'updated', 'boardgame', game_id)
 
-    return {"success": True, "message": "Board game updated successfully"}
+    response.headers['ETag'] = etag(game['version'])
+    return {
+        "success": True,
+        "message": "Board game updated successfully",
+        "data": {"version": game['version']}
+    }
 
 
 @router.delete("/{game_id}")
@@ -315,16 +377,15 @@ async def delete_boardgame(
             detail="Cannot delete board game with pending requests"
         )
 
-    # Delete game
+    # Delete game, its waitlist and its loan totals
     execute_query("DELETE FROM board_games WHERE id = %s", (game_id,))
+    execute_query("DELETE FROM waitlist_entries WHERE item_type = 'boardgame' AND item_id = %s", (game_id,))
+    execute_query("DELETE FROM item_loan_stats WHERE item_type = 'boardgame' AND item_id = %s", (game_id,))
+    catalog_cache.invalidate('boardgame_complexities', 'boardgame_categories')
 
     # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (current_user['id'], 'deleted', 'boardgame', game_id,
-         json.dumps({"title": game['title']}))
-    )
+    await log_activity_async(current_user['id'], 'deleted', 'boardgame', game_id,
+                             {"title": game['title']})
 
     return {"success": True, "message": "Board game deleted successfully"}
 
@@ -332,7 +393,7 @@ async def delete_boardgame(
 @router.get("/complexities/list")
 async def get_complexities(current_user: dict = Depends(get_current_user)):
     """Get list of all complexities with counts"""
-    complexities = execute_query(
+    complexities = catalog_cache.get_or_load('boardgame_complexities', lambda: execute_query(
         """SELECT complexity, COUNT(*) as count 
            FROM board_games 
            WHERE complexity IS NOT NULL 
@@ -344,7 +405,7 @@ async def get_complexities(current_user: dict = Depends(get_current_user)):
                WHEN 'Hard' THEN 3 
              END""",
         fetch=True
-    )
+    ))
 
     return {"success": True, "data": complexities}
 
@@ -352,6 +413,14 @@ async def get_complexities(current_user: dict = Depends(get_current_user)):
 @router.get("/categories/list")
 async def get_categories(current_user: dict = Depends(get_current_user)):
     """Get list of all board game categories"""
+    return {
+        "success": True,
+        "data": catalog_cache.get_or_load('boardgame_categories', _count_categories)
+    }
+
+
+def _count_categories():
+    """Count board games per category"""
     # Since categories are stored as JSON, we need to extract them
     games = execute_query(
         "SELECT categories FROM board_games WHERE categories IS NOT NULL",
@@ -366,7 +435,7 @@ async def get_categories(current_user: dict = Depends(get_current_user)):
             category_count[category] = category_count.get(category, 0) + 1
 
     # Convert to list format
-    categories = [
+    return [
         {"category": cat, "count": count}
         for cat, count in sorted(
             category_count.items(),
@@ -375,8 +444,6 @@ async def get_categories(current_user: dict = Depends(get_current_user)):
         )
     ]
 
-    return {"success": True, "data": categories}
-
 
 @router.get("/my/boardgames")
 async def get_my_boardgames(
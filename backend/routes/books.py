@@ -1,12 +1,20 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Header, Response
 from pydantic import BaseModel, Field
 from typing import Optional, List
 import json
 from datetime import datetime
 
-from database import execute_query, execute_one
+from database import execute_query, execute_one, transaction
 from utils.jwt_handler import get_current_user
-from utils.validators import validate_isbn, sanitize_html
+from utils.validators import validate_date_range, validate_isbn, sanitize_html
+from utils.cache import catalog_cache
+from utils.versioning import etag, expected_version, version_conflict
+from services.activity_logger import log_activity_async
+from services.idempotency import IdempotentRequest
+from services.item_summaries import refresh_item_summaries
+from services.reservations import bookable_condition, free_condition
+from services.waitlists import promote_next
+from services.notifications import notify_async
 
 router = APIRouter(prefix="/api/books", tags=["books"])
 
@@ -34,6 +42,7 @@ class BookUpdate(BaseModel):
     cover_url: Optional[str] = Field(None, max_length=500)
     tags: Optional[List[str]] = None
     is_available: Optional[bool] = None
+    expected_version: Optional[int] = Field(None, ge=1, description="Version the update is based on")
 
 
 def safe_format_datetime(dt_value):
@@ -52,6 +61,8 @@ async def get_books(
         search: Optional[str] = Query(None, description="Search in title or author"),
         genre: Optional[str] = Query(None, description="Filter by genre"),
         available: Optional[bool] = Query(None, description="Filter by availability"),
+        free_from: Optional[str] = Query(None, description="Free from this day (YYYY-MM-DD)"),
+        free_until: Optional[str] = Query(None, description="Free until this day (YYYY-MM-DD, exclusive)"),
         owner_id: Optional[int] = Query(None, description="Filter by owner"),
         limit: int = Query(20, ge=1, le=100),
         offset: int = Query(0, ge=0),
@@ -80,6 +91,15 @@ async def get_books(
         query += " AND b.is_available = %s"
         params.append(available)
 
+    if free_from or free_until:
+        if not (free_from and free_until and validate_date_range(free_from, free_until)):
+            raise HTTPException(
+                status_code=400,
+                detail="free_from and free_until must both be given, with free_until after free_from"
+            )
+        query += f" AND {bookable_condition('book', 'b')} AND {free_condition('book', 'b')}"
+        params.extend([free_until, free_from])
+
     if owner_id:
         query += " AND b.owner_id = %s"
         params.append(owner_id)
@@ -113,9 +133,16 @@ async def get_books(
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def create_book(
         book: BookCreate,
+        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
         current_user: dict = Depends(get_current_user)
 ):
     """Create a new book"""
+    # A retry of a create that already succeeded gets the original response
+    idempotency = IdempotentRequest(idempotency_key, current_user['id'], 'POST /api/books', book)
+    replay = idempotency.lookup()
+    if replay:
+        return replay
+
     # Validate ISBN if provided
     if book.isbn and not validate_isbn(book.isbn):
         raise HTTPException(status_code=400, detail="Invalid ISBN format")
@@ -124,37 +151,40 @@ async def create_book(
     if book.description:
         book.description = sanitize_html(book.description)
 
-    book_id = execute_query(
-        """INSERT INTO books (title, author, isbn, genre, publication_year, 
-           language, description, cover_url, owner_id, tags)
-           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-        (book.title, book.author, book.isbn, book.genre, book.publication_year,
-         book.language, book.description, book.cover_url, current_user['id'],
-         json.dumps(book.tags))
-    )
+    with transaction() as tx:
+        replay = idempotency.claim(tx)
+        if replay:
+            return replay
+
+        book_id = tx.execute(
+            """INSERT INTO books (title, author, isbn, genre, publication_year, 
+               language, description, cover_url, owner_id, tags)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+            (book.title, book.author, book.isbn, book.genre, book.publication_year,
+             book.language, book.description, book.cover_url, current_user['id'],
+             json.dumps(book.tags))
+        )
+
+        result = {"success": True, "data": {"id": book_id, "message": "Book created successfully"}}
+        idempotency.save(tx, result)
+
+    catalog_cache.invalidate('book_genres')
 
     # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (current_user['id'], 'added', 'book', book_id,
-         json.dumps({"title": book.title, "author": book.author}))
-    )
+    await log_activity_async(current_user['id'], 'added', 'book', book_id,
+                             {"title": book.title, "author": book.author})
 
     # Create notification
-    execute_query(
-        """INSERT INTO notifications (user_id, title, message, type)
-           VALUES (%s, %s, %s, %s)""",
-        (current_user['id'], 'Book Added',
-         f'You have successfully added "{book.title}"', 'success')
-    )
+    await notify_async(current_user['id'], 'Book Added',
+                       f'You have successfully added "{book.title}"', 'success')
 
-    return {"success": True, "data": {"id": book_id, "message": "Book created successfully"}}
+    return result
 
 
 @router.get("/{book_id}")
 async def get_book(
         book_id: int,
+        response: Response,
         current_user: dict = Depends(get_current_user)
 ):
     """Get book by ID"""
@@ -179,6 +209,7 @@ async def get_book(
         book.pop('owner_email', None)
         book.pop('owner_phone', None)
 
+    response.headers['ETag'] = etag(book['version'])
     return {"success": True, "data": book}
 
 
@@ -186,11 +217,15 @@ async def get_book(
 async def update_book(
         book_id: int,
         book_update: BookUpdate,
+        response: Response,
+        if_match: Optional[str] = Header(None, alias="If-Match"),
         current_user: dict = Depends(get_current_user)
 ):
     """Update book (owner only)"""
+    version = expected_version(if_match, book_update.expected_version)
+
     # Check ownership
-    book = execute_one("SELECT owner_id FROM books WHERE id = %s", (book_id,))
+    book = execute_one("SELECT owner_id, version FROM books WHERE id = %s", (book_id,))
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
 
@@ -245,18 +280,45 @@ async def update_book(
 
     if update_fields:
         update_fields.append("updated_at = CURRENT_TIMESTAMP")
+        update_fields.append("version = version + 1")
         params.append(book_id)
         query = f"UPDATE books SET {', '.join(update_fields)} WHERE id = %s"
-        execute_query(query, params)
+        if version is not None:
+            # Compare and swap: only apply the edit to the version it was made on
+            query += " AND version = %s"
+            params.append(version)
+        with transaction() as tx:
+            # Listing the item again hands it to the first user waiting for
+            # it; flipped on its own first to learn whether it was unlisted
+            relisted = bool(book_update.is_available) and tx.execute(
+                "UPDATE books SET is_available = TRUE WHERE id = %s AND is_available = FALSE",
+                (book_id,)
+            )
+            if not tx.execute(query, params):
+                current = tx.fetch_one("SELECT version FROM books WHERE id = %s", (book_id,))
+                if not current:
+                    raise HTTPException(status_code=404, detail="Book not found")
+                raise version_conflict(current['version'])
+            book['version'] = tx.fetch_one("SELECT version FROM books WHERE id = %s", (book_id,))['version']
+            # Requests show a copy of the title, creator and image
+            if (book_update.title is not None or book_update.author is not None
+                    or book_update.cover_url is not None):
+                refresh_item_summaries(tx, 'book', book_id)
+            if relisted:
+                promote_next(tx, 'book', book_id, current_user['id'])
+
+        if book_update.genre is not None:
+            catalog_cache.invalidate('book_genres')
 
         # Log activity
-        execute_query(
-            """INSERT INTO activity_log (user_id, action, item_type, item_id)
-               VALUES (%s, %s, %s, %s)""",
-            (current_user['id'], 'updated', 'book', book_id)
-        )
+        await log_activity_async(current_user['id'], 'updated', 'book', book_id)
 
-    return {"success": True, "message": "Book updated successfully"}
+    response.headers['ETag'] = etag(book['version'])
+    return {
+        "success": True,
+        "message": "Book updated successfully",
+        "data": {"version": book['version']}
+    }
 
 
 @router.delete("/{book_id}")
@@ -286,16 +348,15 @@ async def delete_book(
             detail="Cannot delete book with pending requests"
         )
 
-    # Delete book
+    # Delete book, its waitlist and its loan totals
     execute_query("DELETE FROM books WHERE id = %s", (book_id,))
+    execute_query("DELETE FROM waitlist_entries WHERE item_type = 'book' AND item_id = %s", (book_id,))
+    execute_query("DELETE FROM item_loan_stats WHERE item_type = 'book' AND item_id = %s", (book_id,))
+    catalog_cache.invalidate('book_genres')
 
     # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (current_user['id'], 'deleted', 'book', book_id,
-         json.dumps({"title": book['title']}))
-    )
+    await log_activity_async(current_user['id'], 'deleted', 'book', book_id,
+                             {"title": book['title']})
 
     return {"success": True, "message": "Book deleted successfully"}
 
@@ -303,14 +364,14 @@ async def delete_book(
 @router.get("/genres/list")
 async def get_genres(current_user: dict = Depends(get_current_user)):
     """Get list of all book genres"""
-    genres = execute_query(
+    genres = catalog_cache.get_or_load('book_genres', lambda: execute_query(
         """SELECT DISTINCT genre, COUNT(*) as count 
            FROM books 
            WHERE genre IS NOT NULL 
            GROUP BY genre 
            ORDER BY count DESC""",
         fetch=True
-    )
+    ))
 
     return {"success": True, "data": genres}
 
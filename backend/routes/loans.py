@@ -0,0 +1,65 @@
+from fastapi import APIRouter, Depends, Query
+from typing import Optional
+from datetime import datetime, date
+
+from database import execute_query
+from utils.jwt_handler import get_current_user
+from services.loan_history import get_lending_stats, get_popular_items
+
+router = APIRouter(prefix="/api/loans", tags=["loans"])
+
+
+def safe_format_datetime(dt_value):
+    """Safely format datetime values to ISO format"""
+    if dt_value is None:
+        return None
+    if isinstance(dt_value, str):
+        return dt_value  # Already a string
+    if isinstance(dt_value, (datetime, date)):
+        return dt_value.isoformat()
+    return str(dt_value)
+
+
+@router.get("/history")
+async def get_loan_history(
+        role: Optional[str] = Query(None, pattern="^(lender|borrower)$"),
+        limit: int = Query(20, ge=1, le=100),
+        offset: int = Query(0, ge=0),
+        current_user: dict = Depends(get_current_user)
+):
+    """Get the current user's loans, most recent first"""
+    if role == 'lender':
+        condition, params = "owner_id = %s", [current_user['id']]
+    elif role == 'borrower':
+        condition, params = "borrower_id = %s", [current_user['id']]
+    else:
+        condition, params = "(owner_id = %s OR borrower_id = %s)", [current_user['id']] * 2
+
+    loans = execute_query(
+        f"""SELECT * FROM loan_history WHERE {condition}
+            ORDER BY approved_at DESC LIMIT %s OFFSET %s""",
+        params + [limit, offset],
+        fetch=True
+    )
+
+    for loan in loans:
+        for key in ('requested_at', 'approved_at', 'pickup_date', 'return_date', 'returned_on'):
+            loan[key] = safe_format_datetime(loan[key])
+
+    return {"success": True, "data": loans}
+
+
+@router.get("/stats")
+async def get_loan_stats(current_user: dict = Depends(get_current_user)):
+    """Get the current user's lending and borrowing statistics"""
+    return {"success": True, "data": get_lending_stats(current_user['id'])}
+
+
+@router.get("/popular")
+async def get_popular_loans(
+        item_type: Optional[str] = Query(None, pattern="^(book|boardgame)$"),
+        limit: int = Query(10, ge=1, le=50),
+        current_user: dict = Depends(get_current_user)
+):
+    """Get the most borrowed items"""
+    return {"success": True, "data": get_popular_items(item_type, limit)}
@@ -1,13 +1,32 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from typing import Optional
-from datetime import datetime
-
-from database import execute_query, execute_one
-from utils.jwt_handler import get_current_user
+from fastapi import APIRouter, HTTPException, Depends, Query, Header, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List
+from datetime import datetime, timezone
+import asyncio
+import json
+
+from config import settings
+from database import execute_query, execute_one, transaction, db_timestamp, INSERT_IGNORE
+from utils.jwt_handler import get_current_user, get_stream_user
+from utils.token_epoch import token_epochs
+from services.notification_stream import notification_hub, RESYNC, CLOSE
+from services.notification_counters import get_counts, adjust_counters, reset_counters
 
 router = APIRouter(prefix="/api/notifications", tags=["notifications"])
 
 
+class NotificationBulkAction(BaseModel):
+    ids: Optional[List[int]] = Field(None, min_length=1, max_length=500)
+    older_than: Optional[datetime] = None
+    type: Optional[str] = Field(None, pattern="^(info|success|warning|error)$")
+    is_read: Optional[bool] = None
+
+
+class NotificationPreferences(BaseModel):
+    digest_mode: str = Field(..., pattern="^(off|hourly|daily)$")
+
+
 def safe_format_datetime(dt_value):
     """Safely format datetime values to ISO format"""
     if dt_value is None:
@@ -27,11 +46,7 @@ async def get_notifications(
         current_user: dict = Depends(get_current_user)
 ):
     """Get user notifications"""
-    query = """
-        SELECT *, COUNT(*) OVER() as total_count
-        FROM notifications
-        WHERE user_id = %s
-    """
+    query = "SELECT * FROM notifications WHERE user_id = %s"
     params = [current_user['id']]
 
     if is_read is not None:
@@ -43,52 +58,120 @@ async def get_notifications(
 
     notifications = execute_query(query, params, fetch=True)
 
-    if not notifications:
-        return {"success": True, "data": [], "total": 0, "unread_count": 0}
-
-    total = notifications[0]['total_count'] if notifications else 0
-
-    # Get unread count
-    unread_count = execute_one(
-        "SELECT COUNT(*) as count FROM notifications WHERE user_id = %s AND is_read = FALSE",
-        (current_user['id'],)
-    )['count']
+    # Totals come from the maintained counters instead of COUNT(*) queries
+    counts = get_counts(current_user['id'])
+    if is_read is None:
+        total = counts['total']
+    elif is_read:
+        total = max(counts['total'] - counts['unread'], 0)
+    else:
+        total = counts['unread']
 
-    # Format dates and remove count safely
+    # Format dates safely
     for notification in notifications:
         notification['created_at'] = safe_format_datetime(notification.get('created_at'))
-        notification.pop('total_count', None)
 
     return {
         "success": True,
         "data": notifications,
         "total": total,
-        "unread_count": unread_count,
+        "unread_count": counts['unread'],
         "limit": limit,
         "offset": offset
     }
 
 
+def bulk_conditions(user_id, action: NotificationBulkAction):
+    """Build the WHERE clause selecting a user's notifications for a bulk action"""
+    if not action.ids and action.older_than is None and action.type is None and action.is_read is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Provide ids, older_than, type or is_read to select notifications"
+        )
+
+    # Ownership is part of every bulk statement
+    conditions = ["user_id = %s"]
+    params = [user_id]
+
+    if action.ids:
+        conditions.append(f"id IN ({', '.join(['%s'] * len(action.ids))})")
+        params.extend(action.ids)
+
+    if action.older_than is not None:
+        older_than = action.older_than
+        if older_than.tzinfo is not None:
+            older_than = older_than.astimezone(timezone.utc).replace(tzinfo=None)
+        conditions.append("created_at < %s")
+        params.append(db_timestamp(older_than))
+
+    if action.type is not None:
+        conditions.append("type = %s")
+        params.append(action.type)
+
+    if action.is_read is not None:
+        conditions.append("is_read = %s")
+        params.append(action.is_read)
+
+    return " AND ".join(conditions), params
+
+
+@router.put("/bulk/read")
+async def bulk_mark_notifications_read(
+        action: NotificationBulkAction,
+        current_user: dict = Depends(get_current_user)
+):
+    """Mark the selected notifications as read"""
+    where, params = bulk_conditions(current_user['id'], action)
+
+    with transaction() as tx:
+        updated = tx.execute(
+            f"UPDATE notifications SET is_read = TRUE WHERE {where} AND is_read = FALSE",
+            params
+        )
+        adjust_counters(tx, {current_user['id']: (0, -updated)})
+
+    return {"success": True, "data": {"updated": updated}}
+
+
+@router.post("/bulk/delete")
+async def bulk_delete_notifications(
+        action: NotificationBulkAction,
+        current_user: dict = Depends(get_current_user)
+):
+    """Delete the selected notifications"""
+    where, params = bulk_conditions(current_user['id'], action)
+
+    with transaction() as tx:
+        # Unread rows first so the counters know how many unread went away
+        unread = tx.execute(f"DELETE FROM notifications WHERE {where} AND is_read = FALSE", params)
+        read = tx.execute(f"DELETE FROM notifications WHERE {where}", params)
+        adjust_counters(tx, {current_user['id']: (-(unread + read), -unread)})
+
+    return {"success": True, "data": {"deleted": unread + read}}
+
+
 @router.put("/{notification_id}/read")
 async def mark_notification_read(
         notification_id: int,
         current_user: dict = Depends(get_current_user)
 ):
     """Mark a notification as read"""
-    # Check if notification exists and belongs to user
-    notification = execute_one(
-        "SELECT id FROM notifications WHERE id = %s AND user_id = %s",
-        (notification_id, current_user['id'])
-    )
-
-    if not notification:
-        raise HTTPException(status_code=404, detail="Notification not found")
-
-    # Update notification
-    execute_query(
-        "UPDATE notifications SET is_read = TRUE WHERE id = %s",
-        (notification_id,)
-    )
+    with transaction() as tx:
+        # Check if notification exists and belongs to user
+        notification = tx.fetch_one(
+            "SELECT id FROM notifications WHERE id = %s AND user_id = %s",
+            (notification_id, current_user['id'])
+        )
+
+        if not notification:
+            raise HTTPException(status_code=404, detail="Notification not found")
+
+        # Only an unread notification changes the unread count
+        updated = tx.execute(
+            "UPDATE notifications SET is_read = TRUE WHERE id = %s AND is_read = FALSE",
+            (notification_id,)
+        )
+        adjust_counters(tx, {current_user['id']: (0, -updated)})
 
     return {"success": True, "message": "Notification marked as read"}
 
@@ -98,10 +181,12 @@ async def mark_all_notifications_read(
         current_user: dict = Depends(get_current_user)
 ):
     """Mark all notifications as read"""
-    execute_query(
-        "UPDATE notifications SET is_read = TRUE WHERE user_id = %s AND is_read = FALSE",
-        (current_user['id'],)
-    )
+    with transaction() as tx:
+        updated = tx.execute(
+            "UPDATE notifications SET is_read = TRUE WHERE user_id = %s AND is_read = FALSE",
+            (current_user['id'],)
+        )
+        adjust_counters(tx, {current_user['id']: (0, -updated)})
 
     return {"success": True, "message": "All notifications marked as read"}
 
@@ -112,20 +197,23 @@ async def delete_notification(
         current_user: dict = Depends(get_current_user)
 ):
     """Delete a notification"""
-    # Check if notification exists and belongs to user
-    notification = execute_one(
-        "SELECT id FROM notifications WHERE id = %s AND user_id = %s",
-        (notification_id, current_user['id'])
-    )
-
-    if not notification:
-        raise HTTPException(status_code=404, detail="Notification not found")
-
-    # Delete notification
-    execute_query(
-        "DELETE FROM notifications WHERE id = %s",
-        (notification_id,)
-    )
+    with transaction() as tx:
+        # Check if notification exists and belongs to user
+        notification = tx.fetch_one(
+            "SELECT id, is_read FROM notifications WHERE id = %s AND user_id = %s",
+            (notification_id, current_user['id'])
+        )
+
+        if not notification:
+            raise HTTPException(status_code=404, detail="Notification not found")
+
+        # Delete notification
+        deleted = tx.execute(
+            "DELETE FROM notifications WHERE id = %s",
+            (notification_id,)
+        )
+        unread = deleted if not notification['is_read'] else 0
+        adjust_counters(tx, {current_user['id']: (-deleted, -unread)})
 
     return {"success": True, "message": "Notification deleted"}
 
@@ -135,10 +223,12 @@ async def delete_all_notifications(
         current_user: dict = Depends(get_current_user)
 ):
     """Delete all notifications for the current user"""
-    execute_query(
-        "DELETE FROM notifications WHERE user_id = %s",
-        (current_user['id'],)
-    )
+    with transaction() as tx:
+        tx.execute(
+            "DELETE FROM notifications WHERE user_id = %s",
+            (current_user['id'],)
+        )
+        reset_counters(tx, current_user['id'])
 
     return {"success": True, "message": "All notifications deleted"}
 
@@ -148,20 +238,164 @@ async def get_notification_count(
         current_user: dict = Depends(get_current_user)
 ):
     """Get notification counts"""
-    total_count = execute_one(
-        "SELECT COUNT(*) as count FROM notifications WHERE user_id = %s",
+    return {
+        "success": True,
+        "data": get_counts(current_user['id'])
+    }
+
+
+@router.get("/preferences")
+async def get_notification_preferences(
+        current_user: dict = Depends(get_current_user)
+):
+    """Get notification delivery preferences"""
+    preferences = execute_one(
+        "SELECT digest_mode, last_digest_at FROM notification_preferences WHERE user_id = %s",
         (current_user['id'],)
-    )['count']
+    ) or {"digest_mode": "off", "last_digest_at": None}
 
-    unread_count = execute_one(
-        "SELECT COUNT(*) as count FROM notifications WHERE user_id = %s AND is_read = FALSE",
+    pending = execute_one(
+        "SELECT COUNT(*) as count FROM digest_events WHERE user_id = %s",
         (current_user['id'],)
     )['count']
 
     return {
         "success": True,
         "data": {
-            "total": total_count,
-            "unread": unread_count
+            "digest_mode": preferences['digest_mode'],
+            "last_digest_at": safe_format_datetime(preferences['last_digest_at']),
+            "pending_digest_events": pending
         }
-    }
\ No newline at end of file
+    }
+
+
+@router.put("/preferences")
+async def update_notification_preferences(
+        preferences: NotificationPreferences,
+        current_user: dict = Depends(get_current_user)
+):
+    """Update notification delivery preferences"""
+    with transaction() as tx:
+        current = tx.fetch_one(
+            "SELECT digest_mode FROM notification_preferences WHERE user_id = %s",
+            (current_user['id'],)
+        )
+
+        # A new digest period starts when digests are switched on; staged
+        # events of a user switching them off go out with the next digest run
+        if current is None:
+            tx.execute(
+                f"""{INSERT_IGNORE} INTO notification_preferences (user_id, digest_mode, last_digest_at)
+                    VALUES (%s, %s, %s)""",
+                (current_user['id'], preferences.digest_mode, db_timestamp())
+            )
+        elif current['digest_mode'] != preferences.digest_mode:
+            if current['digest_mode'] == 'off':
+                tx.execute(
+                    """UPDATE notification_preferences SET digest_mode = %s, last_digest_at = %s
+                       WHERE user_id = %s""",
+                    (preferences.digest_mode, db_timestamp(), current_user['id'])
+                )
+            else:
+                tx.execute(
+                    "UPDATE notification_preferences SET digest_mode = %s WHERE user_id = %s",
+                    (preferences.digest_mode, current_user['id'])
+                )
+
+    return {
+        "success": True,
+        "message": "Notification preferences updated",
+        "data": {"digest_mode": preferences.digest_mode}
+    }
+
+
+def format_sse(data, event=None, event_id=None):
+    """Format one Server-Sent Events message"""
+    message = ''
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    if event:
+        message += f"event: {event}\n"
+    message += f"data: {json.dumps(data, default=str)}\n\n"
+    return message
+
+
+@router.get("/stream")
+async def stream_notifications(
+        request: Request,
+        last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+        since_id: Optional[int] = Query(None, ge=0, description="Resume after this notification id"),
+        current_user: dict = Depends(get_stream_user)
+):
+    """Stream new notifications as Server-Sent Events"""
+    user_id = current_user['id']
+    epoch = token_epochs.get(user_id)
+
+    # EventSource sends Last-Event-ID when it reconnects
+    resume_from = since_id
+    if last_event_id and last_event_id.isdigit():
+        resume_from = int(last_event_id)
+
+    # Subscribe before reading the backlog so nothing falls in between
+    subscription = notification_hub.subscribe(user_id)
+
+    async def event_stream():
+        last_sent = resume_from or 0
+        try:
+            yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+
+            if resume_from is not None:
+                missed = execute_query(
+                    """SELECT id, title, message, type, is_read, created_at
+                       FROM notifications
+                       WHERE user_id = %s AND id > %s
+                       ORDER BY id LIMIT %s""",
+                    (user_id, resume_from, settings.SSE_RESUME_LIMIT),
+                    fetch=True
+                )
+                if len(missed) >= settings.SSE_RESUME_LIMIT:
+                    yield format_sse({}, event=RESYNC)
+                else:
+                    for notification in missed:
+                        notification['created_at'] = safe_format_datetime(notification['created_at'])
+                        notification['is_read'] = bool(notification['is_read'])
+                        yield format_sse(notification, event='notification', event_id=notification['id'])
+                        last_sent = notification['id']
+
+            while True:
+                if await request.is_disconnected():
+                    break
+
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.queue.get(), timeout=settings.SSE_HEARTBEAT_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    # End streams of users whose tokens were revoked since connecting
+                    if token_epochs.get(user_id) != epoch:
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+
+                if event == CLOSE:
+                    break
+                if event == RESYNC:
+                    yield format_sse({}, event=RESYNC)
+                    continue
+
+                # Skip events already sent from the backlog
+                if event['id'] is not None and event['id'] <= last_sent:
+                    continue
+                yield format_sse(event, event='notification', event_id=event['id'])
+                last_sent = event['id'] or last_sent
+        finally:
+            notification_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
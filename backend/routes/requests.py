@@ -1,12 +1,30 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Header, Response, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime, date
-import json
+import asyncio
 
-from database import execute_query, execute_one
-from utils.jwt_handler import get_current_user
+from config import settings
+from database import execute_query, execute_one, transaction
+from utils.jwt_handler import get_current_user, authenticate_token
+from utils.token_epoch import token_epochs
 from utils.validators import validate_date_range
+from utils.versioning import etag, expected_version, version_conflict
+from services.activity_logger import log_activity_async
+from services.idempotency import IdempotentRequest
+from services.item_summaries import summary_select
+from services.loan_history import record_loans, record_returns
+from services.outbox import (
+    add_notification, add_activity, add_events, notification_event, activity_event
+)
+from services.request_counters import adjust_request_counters, get_request_counts
+from services.request_events import publish_request_events, request_event_hub
+from services.reservations import (
+    OVERLAP_CONDITION, CONFLICT_CONDITION, find_conflicts, get_calendar, bookable_condition,
+    lent_condition
+)
+from services.stream_hub import RESYNC, CLOSE
+from services.waitlists import promote_next
 
 router = APIRouter(prefix="/api/requests", tags=["requests"])
 
@@ -23,6 +41,114 @@ class RequestUpdate(BaseModel):
     pickup_date: Optional[str] = Field(None, description="Format: YYYY-MM-DD")
     return_date: Optional[str] = Field(None, description="Format: YYYY-MM-DD")
     notes: Optional[str] = Field(None, max_length=500)
+    expected_version: Optional[int] = Field(None, ge=1, description="Version the update is based on")
+
+
+class RequestBulkAction(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=100)
+
+
+# Table holding each item type
+ITEM_TABLES = {'book': 'books', 'boardgame': 'board_games'}
+
+
+def safe_format_datetime(dt_value):
+    """Safely format datetime values to ISO format"""
+    if dt_value is None:
+        return None
+    if isinstance(dt_value, str):
+        return dt_value  # Already a string
+    if isinstance(dt_value, (datetime, date)):
+        return dt_value.isoformat()
+    return str(dt_value)
+
+
+def booked_error(conflicts):
+    """409 naming the first loan that overlaps the requested dates"""
+    conflict = conflicts[0]
+    return HTTPException(
+        status_code=409,
+        detail=(f"Item is already booked from {safe_format_datetime(conflict['pickup_date'])} "
+                f"to {safe_format_datetime(conflict['return_date'])}")
+    )
+
+
+def transition_failed(tx, request_id, role, user_id, detail):
+    """Raise the matching error after a conditional status update changed no row
+
+    Args:
+        tx: Open Transaction
+        request_id: Request that was to be updated
+        role: Column the current user must match (owner_id or requester_id)
+        user_id: Current user
+        detail: Message when the request exists but is in another status
+    """
+    request = tx.fetch_one(
+        f"SELECT id FROM requests WHERE id = %s AND {role} = %s",
+        (request_id, user_id)
+    )
+    if not request:
+        raise HTTPException(status_code=404, detail="Request not found or unauthorized")
+    raise HTTPException(status_code=400, detail=detail)
+
+
+def id_list(ids):
+    return ', '.join(str(request_id) for request_id in ids)
+
+
+def bulk_requests(tx, ids, owner_id, status, detail):
+    """Fetch the requests of a bulk action, checking ownership and status for the whole set
+
+    Args:
+        tx: Open Transaction
+        ids: Requested ids
+        owner_id: Current user, who must own every request
+        status: Status every request must be in
+        detail: Message prefix when some requests are in another status
+
+    Returns:
+        list: Request rows, in the order given
+    """
+    ids = list(dict.fromkeys(ids))
+    placeholders = ', '.join(['%s'] * len(ids))
+    rows = tx.fetch_all(
+        f"SELECT * FROM requests WHERE id IN ({placeholders}) AND owner_id = %s",
+        ids + [owner_id]
+    )
+    by_id = {row['id']: row for row in rows}
+
+    missing = [request_id for request_id in ids if request_id not in by_id]
+    if missing:
+        raise HTTPException(status_code=404,
+                            detail=f"Requests not found or unauthorized: {id_list(missing)}")
+
+    wrong = [request_id for request_id in ids if by_id[request_id]['status'] != status]
+    if wrong:
+        raise HTTPException(status_code=400, detail=f"{detail}: {id_list(wrong)}")
+
+    return [by_id[request_id] for request_id in ids]
+
+
+def bulk_transition(tx, rows, owner_id, from_status, to_status):
+    """Move a set of requests to another status with one conditional update
+
+    A request changed by someone else since bulk_requests() read it fails the
+    whole action, so the caller's transaction rolls back.
+    """
+    ids = [row['id'] for row in rows]
+    placeholders = ', '.join(['%s'] * len(ids))
+    response = ", response_date = CURRENT_TIMESTAMP" if to_status != 'returned' else ""
+    updated = tx.execute(
+        f"""UPDATE requests SET status = %s, version = version + 1{response}
+            WHERE id IN ({placeholders}) AND owner_id = %s AND status = %s""",
+        [to_status] + ids + [owner_id, from_status]
+    )
+    if updated != len(ids):
+        raise HTTPException(status_code=409,
+                            detail="Some requests were changed meanwhile, please retry")
+    adjust_request_counters(
+        tx, [(row['requester_id'], row['owner_id'], from_status, to_status) for row in rows]
+    )
 
 
 @router.get("/")
@@ -41,24 +167,10 @@ async def get_requests(
                u1.email as requester_email,
                u2.username as owner_name,
                u2.email as owner_email,
-               CASE 
-                   WHEN r.item_type = 'book' THEN b.title
-                   WHEN r.item_type = 'boardgame' THEN bg.title
-               END as item_title,
-               CASE 
-                   WHEN r.item_type = 'book' THEN b.author
-                   WHEN r.item_type = 'boardgame' THEN bg.designer
-               END as item_creator,
-               CASE 
-                   WHEN r.item_type = 'book' THEN b.cover_url
-                   WHEN r.item_type = 'boardgame' THEN bg.image_url
-               END as item_image,
                COUNT(*) OVER() as total_count
         FROM requests r
         JOIN users u1 ON r.requester_id = u1.id
         JOIN users u2 ON r.owner_id = u2.id
-        LEFT JOIN books b ON r.item_type = 'book' AND r.item_id = b.id
-        LEFT JOIN board_games bg ON r.item_type = 'boardgame' AND r.item_id = bg.id
         WHERE 1=1
     """
 
@@ -94,10 +206,10 @@ async def get_requests(
 
     # Format dates and remove count
     for req in requests:
-        req['request_date'] = req['request_date'].isoformat() if req['request_date'] else None
-        req['response_date'] = req['response_date'].isoformat() if req['response_date'] else None
-        req['pickup_date'] = req['pickup_date'].isoformat() if req['pickup_date'] else None
-        req['return_date'] = req['return_date'].isoformat() if req['return_date'] else None
+        req['request_date'] = safe_format_datetime(req['request_date'])
+        req['response_date'] = safe_format_datetime(req['response_date'])
+        req['pickup_date'] = safe_format_datetime(req['pickup_date'])
+        req['return_date'] = safe_format_datetime(req['return_date'])
         req['is_owner'] = req['owner_id'] == current_user['id']
         req['is_requester'] = req['requester_id'] == current_user['id']
         req.pop('total_count', None)
@@ -111,12 +223,74 @@ async def get_requests(
     }
 
 
+@router.websocket("/events")
+async def request_events(websocket: WebSocket, token: Optional[str] = Query(None)):
+    """Push lifecycle events of the current user's requests"""
+    # Browsers cannot set headers on a WebSocket, so the token is a query parameter
+    try:
+        current_user = authenticate_token(token or '')
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    user_id = current_user['id']
+    epoch = token_epochs.get(user_id)
+    subscription = request_event_hub.subscribe(user_id)
+
+    async def receive():
+        # Clients do not send anything, reading only detects the disconnect
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+
+    async def send():
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscription.queue.get(), timeout=settings.WS_HEARTBEAT_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                # End connections of users whose tokens were revoked since connecting
+                if token_epochs.get(user_id) != epoch:
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                    return
+                await websocket.send_json({"event": "ping"})
+                continue
+
+            if event == CLOSE:
+                await websocket.close()
+                return
+            if event == RESYNC:
+                event = {"event": "resync"}
+            await websocket.send_json(event)
+
+    tasks = [asyncio.create_task(receive()), asyncio.create_task(send())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        request_event_hub.unsubscribe(subscription)
+
+
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def create_request(
         request_data: RequestCreate,
+        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
         current_user: dict = Depends(get_current_user)
 ):
     """Create a new borrow request"""
+    # A retry of a request that already went through gets the original
+    # response, even once the checks below would now reject it
+    idempotency = IdempotentRequest(idempotency_key, current_user['id'], 'POST /api/requests', request_data)
+    replay = idempotency.lookup()
+    if replay:
+        return replay
+
     # Validate dates
     if not validate_date_range(request_data.pickup_date, request_data.return_date):
         raise HTTPException(
@@ -151,9 +325,15 @@ async def create_request(
     if item['owner_id'] == current_user['id']:
         raise HTTPException(status_code=400, detail="Cannot request your own item")
 
-    if not item['is_available']:
+    # Items on loan can still be booked for other dates
+    if not item['is_available'] and not get_calendar(request_data.item_type, request_data.item_id):
         raise HTTPException(status_code=400, detail="Item is not available")
 
+    conflicts = find_conflicts(request_data.item_type, request_data.item_id,
+                               request_data.pickup_date, request_data.return_date)
+    if conflicts:
+        raise booked_error(conflicts)
+
     # Check for existing pending request
     existing_request = execute_one(
         """SELECT id FROM requests 
@@ -168,38 +348,289 @@ async def create_request(
             detail="You already have a pending request for this item"
         )
 
-    # Create request
-    request_id = execute_query(
-        """INSERT INTO requests (item_type, item_id, requester_id, owner_id, 
-           pickup_date, return_date, notes)
-           VALUES (%s, %s, %s, %s, %s, %s, %s)""",
-        (request_data.item_type, request_data.item_id, current_user['id'],
-         item['owner_id'], request_data.pickup_date, request_data.return_date,
-         request_data.notes)
-    )
+    with transaction() as tx:
+        replay = idempotency.claim(tx)
+        if replay:
+            return replay
+
+        # Create request, re-checking availability, loans and duplicates in
+        # the same statement so concurrent requests cannot slip past the checks above
+        table = ITEM_TABLES[request_data.item_type]
+        request_id = tx.execute(
+            f"""INSERT INTO requests (item_type, item_id, requester_id, owner_id,
+                pickup_date, return_date, notes, item_title, item_creator, item_image)
+                SELECT %s, %s, %s, %s, %s, %s, %s, {summary_select(request_data.item_type)}
+                FROM {table}
+                WHERE id = %s AND {bookable_condition(request_data.item_type, table)}
+                AND NOT EXISTS (
+                    SELECT 1 FROM requests
+                    WHERE item_type = %s AND item_id = %s
+                    AND requester_id = %s AND status = 'pending'
+                )
+                AND NOT EXISTS (SELECT 1 FROM requests WHERE {CONFLICT_CONDITION})""",
+            (request_data.item_type, request_data.item_id, current_user['id'],
+             item['owner_id'], request_data.pickup_date, request_data.return_date,
+             request_data.notes, request_data.item_id,
+             request_data.item_type, request_data.item_id, current_user['id'],
+             request_data.item_type, request_data.item_id,
+             request_data.return_date, request_data.pickup_date)
+        )
 
-    # Create notification for owner
-    execute_query(
-        """INSERT INTO notifications (user_id, title, message, type)
-           VALUES (%s, %s, %s, %s)""",
-        (item['owner_id'], 'New Request',
-         f'{current_user["username"]} has requested "{item["title"]}"', 'info')
-    )
+        if tx.cursor.rowcount != 1:
+            raise HTTPException(
+                status_code=409,
+                detail="Item is no longer available for these dates or you already requested it"
+            )
+
+        adjust_request_counters(tx, [(current_user['id'], item['owner_id'], None, 'pending')])
 
-    # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (current_user['id'], 'requested', request_data.item_type, request_data.item_id,
-         json.dumps({"title": item["title"], "request_id": request_id}))
+        # Create notification for owner
+        add_notification(tx, item['owner_id'], 'New Request',
+                         f'{current_user["username"]} has requested "{item["title"]}"', 'info', email=True)
+
+        # Log activity
+        add_activity(tx, current_user['id'], 'requested', request_data.item_type, request_data.item_id,
+                     {"title": item["title"], "request_id": request_id})
+
+        publish_request_events(tx, [request_id], 'created', current_user['id'])
+
+        result = {"success": True, "data": {"id": request_id, "message": "Request created successfully"}}
+        idempotency.save(tx, result)
+
+    return result
+
+
+@router.get("/calendar")
+async def get_item_calendar(
+        item_type: str = Query(..., pattern="^(book|boardgame)$"),
+        item_id: int = Query(..., gt=0),
+        start: Optional[str] = Query(None, description="Format: YYYY-MM-DD"),
+        end: Optional[str] = Query(None, description="Format: YYYY-MM-DD"),
+        current_user: dict = Depends(get_current_user)
+):
+    """Get an item's booked date ranges and whether it is free between start and end"""
+    if start and end and not validate_date_range(start, end):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid date range. End date must be after start date."
+        )
+
+    item = execute_one(
+        f"SELECT id, is_available FROM {ITEM_TABLES[item_type]} WHERE id = %s",
+        (item_id,)
     )
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    booked = [
+        {"pickup_date": safe_format_datetime(loan['pickup_date']),
+         "return_date": safe_format_datetime(loan['return_date'])}
+        for loan in get_calendar(item_type, item_id, start, end)
+    ]
+
+    data = {"item_type": item_type, "item_id": item_id, "booked": booked}
+    if start and end:
+        # Unlisted items (unavailable without any loan) are never free
+        data['available'] = not booked and bool(item['is_available'] or get_calendar(item_type, item_id))
+    return {"success": True, "data": data}
+
+
+@router.put("/bulk/approve")
+async def bulk_approve_requests(
+        action: RequestBulkAction,
+        current_user: dict = Depends(get_current_user)
+):
+    """Approve several requests at once (owner only)"""
+    with transaction() as tx:
+        rows = bulk_requests(tx, action.ids, current_user['id'], 'pending',
+                             "Requests are not pending")
+
+        # Requests of the same batch cannot book the same item twice
+        by_item = {}
+        for row in rows:
+            by_item.setdefault((row['item_type'], row['item_id']), []).append(row)
+        for loans in by_item.values():
+            loans.sort(key=lambda row: str(row['pickup_date']))
+            for first, second in zip(loans, loans[1:]):
+                if str(second['pickup_date']) < str(first['return_date']):
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"Requests {first['id']} and {second['id']} book the same item for overlapping dates"
+                    )
+
+        ids = [row['id'] for row in rows]
+        placeholders = ', '.join(['%s'] * len(ids))
+        bulk_transition(tx, rows, current_user['id'], 'pending', 'approved')
+
+        # Lend the items that are still listed or already lent; the write locks
+        # the item rows, like a single approval. Loans starting later leave
+        # their item listed until the pickup day
+        today = date.today().isoformat()
+        for item_type, table in ITEM_TABLES.items():
+            item_ids = sorted({item_id for kind, item_id in by_item if kind == item_type})
+            if not item_ids:
+                continue
+            item_placeholders = ', '.join(['%s'] * len(item_ids))
+            lent = tx.execute(
+                f"""UPDATE {table}
+                    SET is_available = CASE WHEN {lent_condition(item_type, table)} THEN FALSE ELSE is_available END
+                    WHERE id IN ({item_placeholders})
+                    AND {bookable_condition(item_type, table, exclude_count=len(ids))}""",
+                [today] + item_ids + ids
+            )
+            if lent != len(item_ids):
+                raise HTTPException(status_code=409, detail="Some items are no longer available")
+
+        # Loans approved before this batch that overlap one of its requests
+        conflicts = tx.fetch_all(
+            f"""SELECT a.id, r.pickup_date, r.return_date
+                FROM requests a
+                JOIN requests r ON r.item_type = a.item_type AND r.item_id = a.item_id
+                    AND r.status = 'approved' AND r.pickup_date < a.return_date
+                    AND r.return_date > a.pickup_date
+                WHERE a.id IN ({placeholders}) AND r.id NOT IN ({placeholders})
+                ORDER BY a.id, r.pickup_date""",
+            ids + ids
+        )
+        if conflicts:
+            conflict = conflicts[0]
+            raise HTTPException(
+                status_code=409,
+                detail=(f"Request {conflict['id']}: item is already booked from "
+                        f"{safe_format_datetime(conflict['pickup_date'])} to "
+                        f"{safe_format_datetime(conflict['return_date'])}")
+            )
+
+        # Pending requests for overlapping dates of the same items are rejected
+        competing = tx.fetch_all(
+            f"""SELECT DISTINCT p.id, p.requester_id, p.owner_id, p.item_title
+                FROM requests a
+                JOIN requests p ON p.item_type = a.item_type AND p.item_id = a.item_id
+                    AND p.status = 'pending' AND p.pickup_date < a.return_date
+                    AND p.return_date > a.pickup_date
+                WHERE a.id IN ({placeholders})""",
+            ids
+        )
+        if competing:
+            competing_placeholders = ', '.join(['%s'] * len(competing))
+            tx.execute(
+                f"""UPDATE requests
+                    SET status = 'rejected', response_date = CURRENT_TIMESTAMP, version = version + 1
+                    WHERE id IN ({competing_placeholders}) AND status = 'pending'""",
+                [row['id'] for row in competing]
+            )
+            adjust_request_counters(
+                tx, [(row['requester_id'], row['owner_id'], 'pending', 'rejected') for row in competing]
+            )
+        record_loans(tx, ids)
+
+        add_events(
+            tx,
+            [notification_event(row['requester_id'], 'Request Approved',
+                                f'Your request for "{row["item_title"]}" has been approved!',
+                                'success', email=True)
+             for row in rows]
+            + [activity_event(current_user['id'], 'approved_request', 'request', row['id'],
+                              {"item_title": row["item_title"]})
+               for row in rows]
+        )
+
+        publish_request_events(tx, ids, 'approved', current_user['id'])
+        publish_request_events(tx, [row['id'] for row in competing], 'rejected', current_user['id'])
+
+    return {
+        "success": True,
+        "data": {"approved": ids, "rejected": [row['id'] for row in competing]}
+    }
+
+
+@router.put("/bulk/reject")
+async def bulk_reject_requests(
+        action: RequestBulkAction,
+        current_user: dict = Depends(get_current_user)
+):
+    """Reject several requests at once (owner only)"""
+    with transaction() as tx:
+        rows = bulk_requests(tx, action.ids, current_user['id'], 'pending',
+                             "Requests are not pending")
+        bulk_transition(tx, rows, current_user['id'], 'pending', 'rejected')
+
+        add_events(
+            tx,
+            [notification_event(row['requester_id'], 'Request Rejected',
+                                f'Your request for "{row["item_title"]}" has been rejected.',
+                                'error', email=True)
+             for row in rows]
+            + [activity_event(current_user['id'], 'rejected_request', 'request', row['id'],
+                              {"item_title": row["item_title"]})
+               for row in rows]
+        )
+
+        ids = [row['id'] for row in rows]
+        publish_request_events(tx, ids, 'rejected', current_user['id'])
+
+    return {"success": True, "data": {"rejected": ids}}
 
-    return {"success": True, "data": {"id": request_id, "message": "Request created successfully"}}
+
+@router.put("/bulk/return")
+async def bulk_return_items(
+        action: RequestBulkAction,
+        current_user: dict = Depends(get_current_user)
+):
+    """Mark several items as returned at once (owner only)"""
+    with transaction() as tx:
+        rows = bulk_requests(tx, action.ids, current_user['id'], 'approved',
+                             "Can only return approved items")
+        bulk_transition(tx, rows, current_user['id'], 'approved', 'returned')
+        record_returns(tx, [row['id'] for row in rows])
+
+        # Items are available again unless another loan has already started
+        freed = []
+        today = date.today().isoformat()
+        for item_type, table in ITEM_TABLES.items():
+            item_ids = sorted({row['item_id'] for row in rows if row['item_type'] == item_type})
+            if not item_ids:
+                continue
+            item_placeholders = ', '.join(['%s'] * len(item_ids))
+            available = tx.fetch_all(
+                f"""SELECT id FROM {table}
+                    WHERE id IN ({item_placeholders}) AND NOT {lent_condition(item_type, table)}""",
+                item_ids + [today]
+            )
+            if not available:
+                continue
+            available_ids = [item['id'] for item in available]
+            tx.execute(
+                f"""UPDATE {table} SET is_available = TRUE
+                    WHERE id IN ({', '.join(['%s'] * len(available_ids))})""",
+                available_ids
+            )
+            freed.extend((item_type, item_id) for item_id in available_ids)
+
+        add_events(
+            tx,
+            [notification_event(row['requester_id'], 'Item Returned',
+                                f'Thank you for returning "{row["item_title"]}"!', 'success')
+             for row in rows]
+            + [activity_event(current_user['id'], 'returned_item', row['item_type'], row['item_id'],
+                              {"title": row["item_title"], "request_id": row['id']})
+               for row in rows]
+        )
+
+        ids = [row['id'] for row in rows]
+        publish_request_events(tx, ids, 'returned', current_user['id'])
+
+        # Hand each freed item to the next user on its waitlist
+        for item_type, item_id in freed:
+            promote_next(tx, item_type, item_id, current_user['id'])
+
+    return {"success": True, "data": {"returned": ids}}
 
 
 @router.get("/{request_id}")
 async def get_request(
         request_id: int,
+        response: Response,
         current_user: dict = Depends(get_current_user)
 ):
     """Get request details"""
@@ -208,28 +639,10 @@ async def get_request(
                   u1.username as requester_name, u1.email as requester_email,
                   u1.phone_number as requester_phone, u1.preferred_contact as requester_contact,
                   u2.username as owner_name, u2.email as owner_email,
-                  u2.phone_number as owner_phone, u2.preferred_contact as owner_contact,
-                  CASE 
-                      WHEN r.item_type = 'book' THEN b.title
-                      WHEN r.item_type = 'boardgame' THEN bg.title
-                  END as item_title,
-                  CASE 
-                      WHEN r.item_type = 'book' THEN b.author
-                      WHEN r.item_type = 'boardgame' THEN bg.designer
-                  END as item_creator,
-                  CASE 
-                      WHEN r.item_type = 'book' THEN b.description
-                      WHEN r.item_type = 'boardgame' THEN bg.description
-                  END as item_description,
-                  CASE 
-                      WHEN r.item_type = 'book' THEN b.cover_url
-                      WHEN r.item_type = 'boardgame' THEN bg.image_url
-                  END as item_image
+                  u2.phone_number as owner_phone, u2.preferred_contact as owner_contact
            FROM requests r
            JOIN users u1 ON r.requester_id = u1.id
            JOIN users u2 ON r.owner_id = u2.id
-           LEFT JOIN books b ON r.item_type = 'book' AND r.item_id = b.id
-           LEFT JOIN board_games bg ON r.item_type = 'boardgame' AND r.item_id = bg.id
            WHERE r.id = %s""",
         (request_id,)
     )
@@ -243,11 +656,18 @@ async def get_request(
             not current_user['is_admin']):
         raise HTTPException(status_code=403, detail="Not authorized to view this request")
 
+    # The description is only shown here, so it is not copied onto requests
+    item = execute_one(
+        f"SELECT description FROM {ITEM_TABLES[request['item_type']]} WHERE id = %s",
+        (request['item_id'],)
+    )
+    request['item_description'] = item['description'] if item else None
+
     # Format dates
-    request['request_date'] = request['request_date'].isoformat() if request['request_date'] else None
-    request['response_date'] = request['response_date'].isoformat() if request['response_date'] else None
-    request['pickup_date'] = request['pickup_date'].isoformat() if request['pickup_date'] else None
-    request['return_date'] = request['return_date'].isoformat() if request['return_date'] else None
+    request['request_date'] = safe_format_datetime(request['request_date'])
+    request['response_date'] = safe_format_datetime(request['response_date'])
+    request['pickup_date'] = safe_format_datetime(request['pickup_date'])
+    request['return_date'] = safe_format_datetime(request['return_date'])
 
     # Add flags for current user
     request['is_owner'] = request['owner_id'] == current_user['id']
@@ -265,6 +685,7 @@ async def get_request(
             request.pop('owner_phone', None)
             request.pop('owner_email', None)
 
+    response.headers['ETag'] = etag(request['version'])
     return {"success": True, "data": request}
 
 
@@ -272,9 +693,12 @@ async def get_request(
 async def update_request(
         request_id: int,
         update_data: RequestUpdate,
+        response: Response,
+        if_match: Optional[str] = Header(None, alias="If-Match"),
         current_user: dict = Depends(get_current_user)
 ):
     """Update request (requester only, pending requests only)"""
+    version = expected_version(if_match, update_data.expected_version)
     request = execute_one(
         "SELECT * FROM requests WHERE id = %s",
         (request_id,)
@@ -292,14 +716,24 @@ async def update_request(
             detail="Can only update pending requests"
         )
 
-    # Validate dates if provided
-    if update_data.pickup_date and update_data.return_date:
-        if not validate_date_range(update_data.pickup_date, update_data.return_date):
+    if version is not None and request['version'] != version:
+        raise version_conflict(request['version'])
+
+    # Validate dates if provided, against the unchanged one if only one moves
+    if update_data.pickup_date or update_data.return_date:
+        pickup_date = update_data.pickup_date or safe_format_datetime(request['pickup_date'])
+        return_date = update_data.return_date or safe_format_datetime(request['return_date'])
+        if not validate_date_range(pickup_date, return_date):
             raise HTTPException(
                 status_code=400,
                 detail="Invalid date range. Return date must be after pickup date."
             )
 
+        conflicts = find_conflicts(request['item_type'], request['item_id'],
+                                   pickup_date, return_date, exclude_id=request_id)
+        if conflicts:
+            raise booked_error(conflicts)
+
     # Build update query
     update_fields = []
     params = []
@@ -316,19 +750,35 @@ async def update_request(
         update_fields.append("notes = %s")
         params.append(update_data.notes)
 
+    new_version = request['version']
     if update_fields:
-        params.append(request_id)
-        query = f"UPDATE requests SET {', '.join(update_fields)} WHERE id = %s"
-        execute_query(query, params)
+        # Compare and swap against the version the dates were checked on, so
+        # an edit or transition committed meanwhile is not overwritten
+        update_fields.append("version = version + 1")
+        params.extend([request_id, current_user['id'], request['version']])
+        with transaction() as tx:
+            updated = tx.execute(
+                f"""UPDATE requests SET {', '.join(update_fields)}
+                    WHERE id = %s AND requester_id = %s AND status = 'pending' AND version = %s""",
+                params
+            )
+            if not updated:
+                current = tx.fetch_one("SELECT status, version FROM requests WHERE id = %s", (request_id,))
+                if current and current['status'] == 'pending':
+                    raise version_conflict(current['version'])
+                transition_failed(tx, request_id, 'requester_id', current_user['id'],
+                                  "Can only update pending requests")
+        new_version += 1
 
         # Log activity
-        execute_query(
-            """INSERT INTO activity_log (user_id, action, item_type, item_id)
-               VALUES (%s, %s, %s, %s)""",
-            (current_user['id'], 'updated_request', 'request', request_id)
-        )
+        await log_activity_async(current_user['id'], 'updated_request', 'request', request_id)
 
-    return {"success": True, "message": "Request updated successfully"}
+    response.headers['ETag'] = etag(new_version)
+    return {
+        "success": True,
+        "message": "Request updated successfully",
+        "data": {"version": new_version}
+    }
 
 
 @router.put("/{request_id}/approve")
@@ -337,67 +787,78 @@ async def approve_request(
         current_user: dict = Depends(get_current_user)
 ):
     """Approve request (owner only)"""
-    request = execute_one(
-        "SELECT * FROM requests WHERE id = %s AND owner_id = %s",
-        (request_id, current_user['id'])
-    )
-
-    if not request:
-        raise HTTPException(status_code=404, detail="Request not found or unauthorized")
-
-    if request['status'] != 'pending':
-        raise HTTPException(status_code=400, detail="Request is not pending")
-
-    # Get item title for notification
-    if request['item_type'] == 'book':
-        item = execute_one("SELECT title FROM books WHERE id = %s", (request['item_id'],))
-    else:
-        item = execute_one("SELECT title FROM board_games WHERE id = %s", (request['item_id'],))
+    with transaction() as tx:
+        # Only a pending request changes state, so of two concurrent approvals
+        # or an approval racing a cancel exactly one matches
+        updated = tx.execute(
+            """UPDATE requests
+               SET status = 'approved', response_date = CURRENT_TIMESTAMP, version = version + 1
+               WHERE id = %s AND owner_id = %s AND status = 'pending'""",
+            (request_id, current_user['id'])
+        )
+        if not updated:
+            transition_failed(tx, request_id, 'owner_id', current_user['id'],
+                              "Request is not pending")
+
+        request = tx.fetch_one("SELECT * FROM requests WHERE id = %s", (request_id,))
+        table = ITEM_TABLES[request['item_type']]
+
+        # Lend the item only if it is still listed and no loan approved in the
+        # meantime overlaps these dates; the write locks the item row, so
+        # approvals of the same item are checked one after the other. A loan
+        # starting later leaves the item listed until the pickup day
+        lent = tx.execute(
+            f"""UPDATE {table}
+                SET is_available = CASE WHEN {lent_condition(request['item_type'], table)} THEN FALSE ELSE is_available END
+                WHERE id = %s AND {bookable_condition(request['item_type'], table, exclude_count=1)}
+                AND NOT EXISTS (SELECT 1 FROM requests WHERE {CONFLICT_CONDITION} AND id != %s)""",
+            (date.today().isoformat(), request['item_id'], request_id,
+             request['item_type'], request['item_id'],
+             request['return_date'], request['pickup_date'], request_id)
+        )
+        if not lent:
+            conflicts = find_conflicts(request['item_type'], request['item_id'],
+                                       request['pickup_date'], request['return_date'],
+                                       exclude_id=request_id, tx=tx)
+            if conflicts:
+                raise booked_error(conflicts)
+            raise HTTPException(status_code=409, detail="Item is no longer available")
+
+        # Other pending requests for overlapping dates are rejected below
+        competing = tx.fetch_all(
+            f"""SELECT id, requester_id FROM requests
+                WHERE {OVERLAP_CONDITION} AND status = 'pending' AND id != %s""",
+            (request['item_type'], request['item_id'],
+             request['return_date'], request['pickup_date'], request_id)
+        )
 
-    # Update request
-    execute_query(
-        """UPDATE requests 
-           SET status = 'approved', response_date = CURRENT_TIMESTAMP 
-           WHERE id = %s""",
-        (request_id,)
-    )
+        # Reject them by id: requests for other dates stay pending
+        if competing:
+            placeholders = ', '.join(['%s'] * len(competing))
+            tx.execute(
+                f"""UPDATE requests
+                    SET status = 'rejected', response_date = CURRENT_TIMESTAMP, version = version + 1
+                    WHERE id IN ({placeholders}) AND status = 'pending'""",
+                [row['id'] for row in competing]
+            )
 
-    # Update item availability
-    if request['item_type'] == 'book':
-        execute_query(
-            "UPDATE books SET is_available = FALSE WHERE id = %s",
-            (request['item_id'],)
-        )
-    else:
-        execute_query(
-            "UPDATE board_games SET is_available = FALSE WHERE id = %s",
-            (request['item_id'],)
+        adjust_request_counters(
+            tx,
+            [(request['requester_id'], request['owner_id'], 'pending', 'approved')]
+            + [(row['requester_id'], request['owner_id'], 'pending', 'rejected') for row in competing]
         )
+        record_loans(tx, [request_id])
 
-    # Create notification for requester
-    execute_query(
-        """INSERT INTO notifications (user_id, title, message, type)
-           VALUES (%s, %s, %s, %s)""",
-        (request['requester_id'], 'Request Approved',
-         f'Your request for "{item["title"]}" has been approved!', 'success')
-    )
+        # Create notification for requester
+        add_notification(tx, request['requester_id'], 'Request Approved',
+                         f'Your request for "{request["item_title"]}" has been approved!', 'success', email=True)
 
-    # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (current_user['id'], 'approved_request', 'request', request_id,
-         json.dumps({"item_title": item["title"]}))
-    )
+        # Log activity
+        add_activity(tx, current_user['id'], 'approved_request', 'request', request_id,
+                     {"item_title": request["item_title"]})
 
-    # Cancel other pending requests for the same item
-    execute_query(
-        """UPDATE requests 
-           SET status = 'rejected', response_date = CURRENT_TIMESTAMP 
-           WHERE item_type = %s AND item_id = %s 
-           AND status = 'pending' AND id != %s""",
-        (request['item_type'], request['item_id'], request_id)
-    )
+        publish_request_events(tx, [request_id], 'approved', current_user['id'])
+        publish_request_events(tx, [row['id'] for row in competing], 'rejected', current_user['id'])
 
     return {"success": True, "message": "Request approved successfully"}
 
@@ -408,46 +869,30 @@ async def reject_request(
         current_user: dict = Depends(get_current_user)
 ):
     """Reject request (owner only)"""
-    request = execute_one(
-        "SELECT * FROM requests WHERE id = %s AND owner_id = %s",
-        (request_id, current_user['id'])
-    )
-
-    if not request:
-        raise HTTPException(status_code=404, detail="Request not found or unauthorized")
+    with transaction() as tx:
+        # Update request if it is still pending
+        updated = tx.execute(
+            """UPDATE requests
+               SET status = 'rejected', response_date = CURRENT_TIMESTAMP, version = version + 1
+               WHERE id = %s AND owner_id = %s AND status = 'pending'""",
+            (request_id, current_user['id'])
+        )
+        if not updated:
+            transition_failed(tx, request_id, 'owner_id', current_user['id'],
+                              "Request is not pending")
 
-    if request['status'] != 'pending':
-        raise HTTPException(status_code=400, detail="Request is not pending")
+        request = tx.fetch_one("SELECT * FROM requests WHERE id = %s", (request_id,))
+        adjust_request_counters(tx, [(request['requester_id'], request['owner_id'], 'pending', 'rejected')])
 
-    # Get item title for notification
-    if request['item_type'] == 'book':
-        item = execute_one("SELECT title FROM books WHERE id = %s", (request['item_id'],))
-    else:
-        item = execute_one("SELECT title FROM board_games WHERE id = %s", (request['item_id'],))
+        # Create notification for requester
+        add_notification(tx, request['requester_id'], 'Request Rejected',
+                         f'Your request for "{request["item_title"]}" has been rejected.', 'error', email=True)
 
-    # Update request
-    execute_query(
-        """UPDATE requests 
-           SET status = 'rejected', response_date = CURRENT_TIMESTAMP 
-           WHERE id = %s""",
-        (request_id,)
-    )
-
-    # Create notification for requester
-    execute_query(
-        """INSERT INTO notifications (user_id, title, message, type)
-           VALUES (%s, %s, %s, %s)""",
-        (request['requester_id'], 'Request Rejected',
-         f'Your request for "{item["title"]}" has been rejected.', 'error')
-    )
+        # Log activity
+        add_activity(tx, current_user['id'], 'rejected_request', 'request', request_id,
+                     {"item_title": request["item_title"]})
 
-    # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (current_user['id'], 'rejected_request', 'request', request_id,
-         json.dumps({"item_title": item["title"]}))
-    )
+        publish_request_events(tx, [request_id], 'rejected', current_user['id'])
 
     return {"success": True, "message": "Request rejected successfully"}
 
@@ -458,45 +903,29 @@ async def cancel_request(
         current_user: dict = Depends(get_current_user)
 ):
     """Cancel request (requester only, pending requests only)"""
-    request = execute_one(
-        "SELECT * FROM requests WHERE id = %s AND requester_id = %s",
-        (request_id, current_user['id'])
-    )
-
-    if not request:
-        raise HTTPException(status_code=404, detail="Request not found or unauthorized")
+    with transaction() as tx:
+        # Update request if it is still pending
+        updated = tx.execute(
+            """UPDATE requests
+               SET status = 'rejected', response_date = CURRENT_TIMESTAMP, version = version + 1
+               WHERE id = %s AND requester_id = %s AND status = 'pending'""",
+            (request_id, current_user['id'])
+        )
+        if not updated:
+            transition_failed(tx, request_id, 'requester_id', current_user['id'],
+                              "Can only cancel pending requests")
 
-    if request['status'] != 'pending':
-        raise HTTPException(status_code=400, detail="Can only cancel pending requests")
+        request = tx.fetch_one("SELECT * FROM requests WHERE id = %s", (request_id,))
+        adjust_request_counters(tx, [(request['requester_id'], request['owner_id'], 'pending', 'rejected')])
 
-    # Update request
-    execute_query(
-        """UPDATE requests 
-           SET status = 'rejected', response_date = CURRENT_TIMESTAMP 
-           WHERE id = %s""",
-        (request_id,)
-    )
+        # Create notification for owner
+        add_notification(tx, request['owner_id'], 'Request Cancelled',
+                         f'{current_user["username"]} has cancelled their request for "{request["item_title"]}"', 'info')
 
-    # Get item title for notification
-    if request['item_type'] == 'book':
-        item = execute_one("SELECT title FROM books WHERE id = %s", (request['item_id'],))
-    else:
-        item = execute_one("SELECT title FROM board_games WHERE id = %s", (request['item_id'],))
-
-    # Create notification for owner
-    execute_query(
-        """INSERT INTO notifications (user_id, title, message, type)
-           VALUES (%s, %s, %s, %s)""",
-        (request['owner_id'], 'Request Cancelled',
-         f'{current_user["username"]} has cancelled their request for "{item["title"]}"', 'info')
-    )
+        # Log activity
+        add_activity(tx, current_user['id'], 'cancelled_request', 'request', request_id)
 
-    # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id)
-           VALUES (%s, %s, %s, %s)""",
-        (current_user['id'], 'cancelled_request', 'request', request_id)
-    )
+        publish_request_events(tx, [request_id], 'cancelled', current_user['id'])
 
     return {"success": True, "message": "Request cancelled successfully"}
 
@@ -507,54 +936,43 @@ async def return_item(
         current_user: dict = Depends(get_current_user)
 ):
     """Mark item as returned (owner only)"""
-    request = execute_one(
-        "SELECT * FROM requests WHERE id = %s AND owner_id = %s",
-        (request_id, current_user['id'])
-    )
-
-    if not request:
-        raise HTTPException(status_code=404, detail="Request not found or unauthorized")
+    with transaction() as tx:
+        # Update request if it is still on loan
+        updated = tx.execute(
+            """UPDATE requests
+               SET status = 'returned', version = version + 1
+               WHERE id = %s AND owner_id = %s AND status = 'approved'""",
+            (request_id, current_user['id'])
+        )
+        if not updated:
+            transition_failed(tx, request_id, 'owner_id', current_user['id'],
+                              "Can only return approved items")
+
+        request = tx.fetch_one("SELECT * FROM requests WHERE id = %s", (request_id,))
+        adjust_request_counters(tx, [(request['requester_id'], request['owner_id'], 'approved', 'returned')])
+        record_returns(tx, [request_id])
+        table = ITEM_TABLES[request['item_type']]
+
+        # The item is available again unless another loan has already started
+        available = tx.execute(
+            f"""UPDATE {table} SET is_available = TRUE
+                WHERE id = %s AND NOT {lent_condition(request['item_type'], table)}""",
+            (request['item_id'], date.today().isoformat())
+        )
 
-    if request['status'] != 'approved':
-        raise HTTPException(status_code=400, detail="Can only return approved items")
+        # Create notification for requester
+        add_notification(tx, request['requester_id'], 'Item Returned',
+                         f'Thank you for returning "{request["item_title"]}"!', 'success')
 
-    # Update request
-    execute_query(
-        """UPDATE requests 
-           SET status = 'returned' 
-           WHERE id = %s""",
-        (request_id,)
-    )
+        # Log activity
+        add_activity(tx, current_user['id'], 'returned_item', request['item_type'], request['item_id'],
+                     {"title": request["item_title"], "request_id": request_id})
 
-    # Update item availability
-    if request['item_type'] == 'book':
-        execute_query(
-            "UPDATE books SET is_available = TRUE WHERE id = %s",
-            (request['item_id'],)
-        )
-        item = execute_one("SELECT title FROM books WHERE id = %s", (request['item_id'],))
-    else:
-        execute_query(
-            "UPDATE board_games SET is_available = TRUE WHERE id = %s",
-            (request['item_id'],)
-        )
-        item = execute_one("SELECT title FROM board_games WHERE id = %s", (request['item_id'],))
-
-    # Create notification for requester
-    execute_query(
-        """INSERT INTO notifications (user_id, title, message, type)
-           VALUES (%s, %s, %s, %s)""",
-        (request['requester_id'], 'Item Returned',
-         f'Thank you for returning "{item["title"]}"!', 'success')
-    )
+        publish_request_events(tx, [request_id], 'returned', current_user['id'])
 
-    # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (current_user['id'], 'returned_item', request['item_type'], request['item_id'],
-         json.dumps({"title": item["title"], "request_id": request_id}))
-    )
+        # Hand the item to the next user on its waitlist
+        if available:
+            promote_next(tx, request['item_type'], request['item_id'], current_user['id'])
 
     return {"success": True, "message": "Item marked as returned successfully"}
 
@@ -562,51 +980,4 @@ async def return_item(
 @router.get("/stats/summary")
 async def get_request_stats(current_user: dict = Depends(get_current_user)):
     """Get request statistics for current user"""
-    stats = {
-        'sent': {
-            'total': execute_one(
-                "SELECT COUNT(*) as count FROM requests WHERE requester_id = %s",
-                (current_user['id'],)
-            )['count'],
-            'pending': execute_one(
-                "SELECT COUNT(*) as count FROM requests WHERE requester_id = %s AND status = 'pending'",
-                (current_user['id'],)
-            )['count'],
-            'approved': execute_one(
-                "SELECT COUNT(*) as count FROM requests WHERE requester_id = %s AND status = 'approved'",
-                (current_user['id'],)
-            )['count'],
-            'rejected': execute_one(
-                "SELECT COUNT(*) as count FROM requests WHERE requester_id = %s AND status = 'rejected'",
-                (current_user['id'],)
-            )['count'],
-            'returned': execute_one(
-                "SELECT COUNT(*) as count FROM requests WHERE requester_id = %s AND status = 'returned'",
-                (current_user['id'],)
-            )['count']
-        },
-        'received': {
-            'total': execute_one(
-                "SELECT COUNT(*) as count FROM requests WHERE owner_id = %s",
-                (current_user['id'],)
-            )['count'],
-            'pending': execute_one(
-                "SELECT COUNT(*) as count FROM requests WHERE owner_id = %s AND status = 'pending'",
-                (current_user['id'],)
-            )['count'],
-            'approved': execute_one(
-                "SELECT COUNT(*) as count FROM requests WHERE owner_id = %s AND status = 'approved'",
-                (current_user['id'],)
-            )['count'],
-            'rejected': execute_one(
-                "SELECT COUNT(*) as count FROM requests WHERE owner_id = %s AND status = 'rejected'",
-                (current_user['id'],)
-            )['count'],
-            'returned': execute_one(
-                "SELECT COUNT(*) as count FROM requests WHERE owner_id = %s AND status = 'returned'",
-                (current_user['id'],)
-            )['count']
-        }
-    }
-
-    return {"success": True, "data": stats}
\ No newline at end of file
+    return {"success": True, "data": get_request_counts(current_user['id'])}
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Depends, status
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 import json
@@ -6,8 +7,13 @@ from datetime import datetime
 
 from auth import AuthService
 from database import execute_query, execute_one
-from utils.jwt_handler import get_current_user
+from utils.jwt_handler import get_current_user, get_current_user_record, decode_token, security
+from utils.token_epoch import token_epochs
+from utils.token_revocation import revoked_tokens
+from utils.cache import user_cache
+from fastapi.security import HTTPAuthorizationCredentials
 from utils.validators import validate_email, validate_phone
+from services.activity_logger import log_activity_async
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
@@ -44,6 +50,14 @@ class PasswordUpdate(BaseModel):
     new_password: str
 
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
+
 # Auth endpoints
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register(user: UserRegister):
@@ -56,7 +70,10 @@ async def register(user: UserRegister):
     if user.phone_number and not validate_phone(user.phone_number):
         raise HTTPException(status_code=400, detail="Invalid phone number format")
 
-    result, error = AuthService.register_user(
+    # AuthService is synchronous (password hashing, activity logging that may
+    # wait for queue room), so it runs in a worker thread off the event loop
+    result, error = await run_in_threadpool(
+        AuthService.register_user,
         user.username, user.email, user.password,
         full_name=user.full_name,
         flat_number=user.flat_number,
@@ -75,7 +92,18 @@ async def register(user: UserRegister):
 @router.post("/login")
 async def login(user: UserLogin):
     """Login user"""
-    result, error = AuthService.login_user(user.email, user.password)
+    result, error = await run_in_threadpool(AuthService.login_user, user.email, user.password)
+
+    if error:
+        raise HTTPException(status_code=401, detail=error)
+
+    return {"success": True, "data": result}
+
+
+@router.post("/refresh")
+async def refresh(request: RefreshRequest):
+    """Exchange a refresh token for a new access/refresh token pair"""
+    result, error = AuthService.refresh_session(request.refresh_token)
 
     if error:
         raise HTTPException(status_code=401, detail=error)
@@ -83,8 +111,25 @@ async def login(user: UserLogin):
     return {"success": True, "data": result}
 
 
+@router.post("/logout")
+async def logout(
+        request: LogoutRequest,
+        credentials: HTTPAuthorizationCredentials = Depends(security),
+        current_user: dict = Depends(get_current_user)
+):
+    """Revoke the current access token and, if given, the refresh token"""
+    payload = decode_token(credentials.credentials)
+    if payload:
+        revoked_tokens.revoke(payload.get('jti'), current_user['id'], payload['exp'])
+
+    if request.refresh_token:
+        AuthService.revoke_refresh_token(request.refresh_token)
+
+    return {"success": True, "message": "Logged out successfully"}
+
+
 @router.get("/me")
-async def get_me(current_user: dict = Depends(get_current_user)):
+async def get_me(current_user: dict = Depends(get_current_user_record)):
     """Get current user information"""
     return {"success": True, "data": {
         "id": current_user["id"],
@@ -142,13 +187,10 @@ async def update_profile(
         params.append(current_user["id"])
         query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s"
         execute_query(query, params)
+        user_cache.invalidate(current_user["id"])
 
         # Log activity
-        execute_query(
-            """INSERT INTO activity_log (user_id, action, item_type)
-               VALUES (%s, %s, %s)""",
-            (current_user['id'], 'profile_updated', 'user')
-        )
+        await log_activity_async(current_user['id'], 'profile_updated', 'user')
 
     return {"success": True, "message": "Profile updated successfully"}
 
@@ -159,7 +201,8 @@ async def update_password(
         current_user: dict = Depends(get_current_user)
 ):
     """Update user password"""
-    success, message = AuthService.update_password(
+    success, message = await run_in_threadpool(
+        AuthService.update_password,
         current_user['id'],
         password_data.old_password,
         password_data.new_password
@@ -168,7 +211,13 @@ async def update_password(
     if not success:
         raise HTTPException(status_code=400, detail=message)
 
-    return {"success": True, "message": message}
+    # Existing tokens were revoked, hand back a fresh pair for this session
+    session = AuthService.create_session(
+        current_user['id'], current_user['username'],
+        current_user['is_admin'], token_epochs.get(current_user['id'])
+    )
+
+    return {"success": True, "message": message, "data": session}
 
 
 @router.get("/users/{user_id}")
@@ -223,12 +272,11 @@ async def delete_account(
         "UPDATE users SET is_active = FALSE WHERE id = %s",
         (current_user['id'],)
     )
+    token_epochs.bump(current_user['id'])
+    user_cache.invalidate(current_user['id'])
+    AuthService.revoke_user_refresh_tokens(current_user['id'])
 
     # Log activity
-    execute_query(
-        """INSERT INTO activity_log (user_id, action, item_type)
-           VALUES (%s, %s, %s)""",
-        (current_user['id'], 'account_deleted', 'user')
-    )
+    await log_activity_async(current_user['id'], 'account_deleted', 'user')
 
     return {"success": True, "message": "Account deleted successfully"}
\ No newline at end of file
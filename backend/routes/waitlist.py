@@ -0,0 +1,158 @@
+from fastapi import APIRouter, HTTPException, Depends, status, Query
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import datetime, date
+
+from database import execute_query, execute_one, transaction, INSERT_IGNORE
+from utils.jwt_handler import get_current_user
+from services.reservations import lent_condition
+from services.waitlists import POSITION_SUBQUERY
+
+router = APIRouter(prefix="/api/waitlist", tags=["waitlist"])
+
+
+class WaitlistJoin(BaseModel):
+    item_type: str = Field(..., pattern="^(book|boardgame)$")
+    item_id: int = Field(..., gt=0)
+    loan_days: int = Field(14, ge=1, le=90, description="Length of the loan once promoted")
+    notes: Optional[str] = Field(None, max_length=500)
+
+
+# Table holding each item type
+ITEM_TABLES = {'book': 'books', 'boardgame': 'board_games'}
+
+
+def safe_format_datetime(dt_value):
+    """Safely format datetime values to ISO format"""
+    if dt_value is None:
+        return None
+    if isinstance(dt_value, str):
+        return dt_value  # Already a string
+    if isinstance(dt_value, datetime):
+        return dt_value.isoformat()
+    return str(dt_value)
+
+
+@router.get("/")
+async def get_my_waitlist(current_user: dict = Depends(get_current_user)):
+    """Get the current user's waitlist entries and their place in line"""
+    entries = execute_query(
+        f"""SELECT w.id, w.item_type, w.item_id, w.loan_days, w.notes, w.created_at,
+                   COALESCE(b.title, g.title) as item_title,
+                   {POSITION_SUBQUERY} as position
+            FROM waitlist_entries w
+            LEFT JOIN books b ON w.item_type = 'book' AND b.id = w.item_id
+            LEFT JOIN board_games g ON w.item_type = 'boardgame' AND g.id = w.item_id
+            WHERE w.user_id = %s
+            ORDER BY w.created_at""",
+        (current_user['id'],),
+        fetch=True
+    )
+
+    for entry in entries:
+        entry['created_at'] = safe_format_datetime(entry['created_at'])
+
+    return {"success": True, "data": entries}
+
+
+@router.get("/item")
+async def get_item_waitlist(
+        item_type: str = Query(..., pattern="^(book|boardgame)$"),
+        item_id: int = Query(..., gt=0),
+        current_user: dict = Depends(get_current_user)
+):
+    """Get the length of an item's waitlist and the current user's place in it"""
+    length = execute_one(
+        "SELECT COUNT(*) as count FROM waitlist_entries WHERE item_type = %s AND item_id = %s",
+        (item_type, item_id)
+    )['count']
+
+    entry = execute_one(
+        f"""SELECT w.id, {POSITION_SUBQUERY} as position
+            FROM waitlist_entries w
+            WHERE w.item_type = %s AND w.item_id = %s AND w.user_id = %s""",
+        (item_type, item_id, current_user['id'])
+    )
+
+    return {
+        "success": True,
+        "data": {
+            "item_type": item_type,
+            "item_id": item_id,
+            "length": length,
+            "entry_id": entry['id'] if entry else None,
+            "position": entry['position'] if entry else None
+        }
+    }
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED)
+async def join_waitlist(
+        entry_data: WaitlistJoin,
+        current_user: dict = Depends(get_current_user)
+):
+    """Join the waitlist of an item that is out on loan"""
+    table = ITEM_TABLES[entry_data.item_type]
+    today = date.today().isoformat()
+    item = execute_one(
+        f"""SELECT owner_id, is_available, {lent_condition(entry_data.item_type, table)} as lent
+            FROM {table} WHERE id = %s""",
+        (today, entry_data.item_id)
+    )
+
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    if item['owner_id'] == current_user['id']:
+        raise HTTPException(status_code=400, detail="Cannot join the waitlist of your own item")
+
+    if item['is_available']:
+        raise HTTPException(status_code=400, detail="Item is available, request it directly")
+
+    # Only a return hands the item on, so unlisted items have no queue
+    if not item['lent']:
+        raise HTTPException(status_code=400, detail="Item is not listed")
+
+    # Re-check the loan in the same statement, so a return committed
+    # meanwhile cannot leave the user waiting for an item that is free
+    with transaction() as tx:
+        tx.execute(
+            f"""{INSERT_IGNORE} INTO waitlist_entries (item_type, item_id, user_id, loan_days, notes)
+                SELECT %s, %s, %s, %s, %s FROM {table}
+                WHERE id = %s AND is_available = FALSE AND {lent_condition(entry_data.item_type, table)}""",
+            (entry_data.item_type, entry_data.item_id, current_user['id'],
+             entry_data.loan_days, entry_data.notes, entry_data.item_id, today)
+        )
+        joined = tx.cursor.rowcount == 1
+
+        entry = tx.fetch_one(
+            f"""SELECT w.id, {POSITION_SUBQUERY} as position
+                FROM waitlist_entries w
+                WHERE w.item_type = %s AND w.item_id = %s AND w.user_id = %s""",
+            (entry_data.item_type, entry_data.item_id, current_user['id'])
+        )
+
+    if entry and not joined:
+        raise HTTPException(status_code=400, detail="You are already on the waitlist for this item")
+
+    if not entry:
+        raise HTTPException(status_code=400, detail="Item is no longer on loan, request it directly")
+
+    return {"success": True, "data": {"id": entry['id'], "position": entry['position']}}
+
+
+@router.delete("/{entry_id}")
+async def leave_waitlist(
+        entry_id: int,
+        current_user: dict = Depends(get_current_user)
+):
+    """Leave a waitlist"""
+    deleted = execute_query(
+        "DELETE FROM waitlist_entries WHERE id = %s AND user_id = %s",
+        (entry_id, current_user['id'])
+    )
+
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Waitlist entry not found")
+
+    return {"success": True, "message": "Left the waitlist"}
@@ -0,0 +1,69 @@
+"""
+Services package initialization
+"""
+
+from .buffered_writer import BufferedWriter
+from .scheduler import scheduler
+from .activity_logger import activity_logger, log_activity, log_activity_async
+from .notification_counters import get_counts, adjust_counters, reconcile_counters
+from .item_summaries import refresh_item_summaries
+from .request_counters import get_request_counts, adjust_request_counters, reconcile_request_counters
+from .email_worker import email_worker, enqueue_emails
+from .digests import digest_batcher
+from .notifications import notification_dispatcher, notify, notify_async, push_sink
+from .retention import notification_retention
+from .loan_reminders import loan_reminders
+from .waitlists import promote_next
+from .loan_history import record_loans, record_returns, get_lending_stats, backfill_loan_history
+from .idempotency import IdempotentRequest, purge_idempotency_keys
+from .event_bus import event_bus
+from .stream_hub import StreamHub
+from .notification_stream import notification_hub
+from .request_events import request_event_hub, publish_request_events
+from .outbox import (
+    outbox_relay, add_event, add_events, add_notification, add_activity,
+    notification_event, activity_event
+)
+
+__all__ = [
+    'BufferedWriter',
+    'scheduler',
+    'activity_logger',
+    'log_activity',
+    'log_activity_async',
+    'get_counts',
+    'adjust_counters',
+    'reconcile_counters',
+    'refresh_item_summaries',
+    'get_request_counts',
+    'adjust_request_counters',
+    'reconcile_request_counters',
+    'email_worker',
+    'enqueue_emails',
+    'digest_batcher',
+    'notification_dispatcher',
+    'notify',
+    'notify_async',
+    'push_sink',
+    'notification_retention',
+    'loan_reminders',
+    'promote_next',
+    'record_loans',
+    'record_returns',
+    'get_lending_stats',
+    'backfill_loan_history',
+    'IdempotentRequest',
+    'purge_idempotency_keys',
+    'event_bus',
+    'StreamHub',
+    'notification_hub',
+    'request_event_hub',
+    'publish_request_events',
+    'outbox_relay',
+    'add_event',
+    'add_events',
+    'add_notification',
+    'add_activity',
+    'notification_event',
+    'activity_event'
+]
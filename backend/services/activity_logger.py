@@ -0,0 +1,119 @@
+"""
+Activity logging service
+
+Handlers record activity through log_activity(), which only queues the row;
+async handlers await log_activity_async(), which waits for room in a full
+queue without blocking the event loop.
+Rows are inserted into activity_log in batches by a BufferedWriter, keeping
+the insert and its commit off the user-visible write path.
+"""
+
+import json
+import logging
+
+from config import settings
+from database import execute_many, INSERT_IGNORE
+from services.buffered_writer import BufferedWriter
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class ActivityLogger:
+    """Queues activity_log rows for batched insertion"""
+
+    def __init__(self):
+        self.enabled = settings.ENABLE_ACTIVITY_LOG
+        self.writer = BufferedWriter(
+            """INSERT INTO activity_log (user_id, action, item_type, item_id, details)
+               VALUES (%s, %s, %s, %s, %s)""",
+            max_batch=settings.ACTIVITY_LOG_BATCH_SIZE,
+            flush_interval=settings.ACTIVITY_LOG_FLUSH_INTERVAL,
+            max_queue=settings.ACTIVITY_LOG_MAX_QUEUE,
+            block_timeout=settings.ACTIVITY_LOG_BLOCK_TIMEOUT,
+            name='activity-log'
+        )
+
+    def log(self, user_id, action, item_type=None, item_id=None, details=None):
+        """
+        Queue an activity log entry.
+
+        Args:
+            user_id: User performing the action
+            action: Action name (e.g. 'added', 'approved_request')
+            item_type: Type of the affected item
+            item_id: ID of the affected item
+            details: Optional dict stored as JSON
+
+        Returns:
+            bool: False if the entry was dropped
+        """
+        if not self.enabled:
+            return True
+        return self.writer.write(self._row(user_id, action, item_type, item_id, details))
+
+    async def log_async(self, user_id, action, item_type=None, item_id=None, details=None):
+        """Queue an activity log entry from a coroutine (see log())"""
+        if not self.enabled:
+            return True
+        return await self.writer.write_async(
+            self._row(user_id, action, item_type, item_id, details)
+        )
+
+    def _row(self, user_id, action, item_type, item_id, details):
+        if details is not None and not isinstance(details, str):
+            details = json.dumps(details)
+        return (user_id, action, item_type, item_id, details)
+
+    def record(self, entries):
+        """
+        Insert entries synchronously, skipping event_keys already logged.
+
+        Used by the outbox relay; raises on failure so the events are retried.
+
+        Args:
+            entries: List of dicts (user_id, action, item_type, item_id,
+                details, event_key)
+        """
+        if not self.enabled or not entries:
+            return
+
+        rows = []
+        for entry in entries:
+            details = entry.get('details')
+            if details is not None and not isinstance(details, str):
+                details = json.dumps(details)
+            rows.append((entry['user_id'], entry['action'], entry.get('item_type'),
+                         entry.get('item_id'), details, entry['event_key']))
+
+        execute_many(
+            f"""{INSERT_IGNORE} INTO activity_log (user_id, action, item_type, item_id, details, event_key)
+               VALUES (%s, %s, %s, %s, %s, %s)""",
+            rows
+        )
+
+    def flush(self):
+        """Write all queued entries now"""
+        return self.writer.flush()
+
+    def shutdown(self):
+        """Stop the background writer after a final flush"""
+        self.writer.stop()
+
+    def stats(self):
+        """Queue and delivery counters"""
+        return self.writer.stats()
+
+
+# Shared activity logger instance
+activity_logger = ActivityLogger()
+
+
+def log_activity(user_id, action, item_type=None, item_id=None, details=None):
+    """Queue an activity log entry on the shared activity logger"""
+    return activity_logger.log(user_id, action, item_type, item_id, details)
+
+
+async def log_activity_async(user_id, action, item_type=None, item_id=None, details=None):
+    """Queue an activity log entry on the shared activity logger from a coroutine"""
+    return await activity_logger.log_async(user_id, action, item_type, item_id, details)
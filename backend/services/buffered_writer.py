@@ -0,0 +1,197 @@
+"""
+Write-behind buffer for append-only inserts
+
+Rows are queued in memory and written by a background thread with a single
+executemany per batch, so request handlers never wait on the insert or its
+commit. The buffer is flushed when it reaches max_batch rows, every
+flush_interval seconds, and on shutdown.
+
+The queue is bounded by max_queue. When it is full, writers wait up to
+block_timeout seconds for the flusher to make room (backpressure) and the
+row is dropped and counted if it is still full after that. Async handlers
+use write_async(), which does that wait in a worker thread so the event loop
+keeps serving other requests. A plain write() made on the event loop thread
+cannot wait without stalling the loop, so its row is dropped right away.
+"""
+
+import asyncio
+import atexit
+import logging
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+from database import execute_many
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def on_event_loop():
+    """Check whether the calling thread is running an asyncio event loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class BufferedWriter:
+    """Batches INSERT parameter tuples and writes them in the background"""
+
+    def __init__(self, query, max_batch=100, flush_interval=1.0, name=None,
+                 max_queue=10000, block_timeout=0.05):
+        self.query = query
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.name = name or 'buffered-writer'
+        self.max_queue = max_queue
+        self.block_timeout = block_timeout
+        self._buffer = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.blocked = 0
+        atexit.register(self.stop)
+
+    def write(self, params):
+        """
+        Queue one row of parameters.
+
+        Returns:
+            bool: False if the row was dropped because the queue stayed full
+        """
+        return self._enqueue(tuple(params))
+
+    async def write_async(self, params):
+        """
+        Queue one row of parameters from a coroutine, waiting for room
+        without blocking the event loop.
+
+        Returns:
+            bool: False if the row was dropped because the queue stayed full
+        """
+        return await self._enqueue_async(tuple(params))
+
+    def _enqueue(self, item):
+        self._ensure_started()
+        with self._condition:
+            if len(self._buffer) >= self.max_queue:
+                self._condition.notify_all()
+                if not on_event_loop():
+                    self.blocked += 1
+                    self._condition.wait_for(
+                        lambda: len(self._buffer) < self.max_queue,
+                        timeout=self.block_timeout
+                    )
+                if len(self._buffer) >= self.max_queue:
+                    self.dropped += 1
+                    if self.dropped % 1000 == 1:
+                        logger.warning(f"{self.name}: queue full, {self.dropped} rows dropped so far")
+                    return False
+
+            self._append(item)
+        return True
+
+    async def _enqueue_async(self, item):
+        if self._offer(item):
+            return True
+        # Full: wait for the flusher in a worker thread, off the event loop
+        return await run_in_threadpool(self._enqueue, item)
+
+    def _offer(self, item):
+        """Queue item if there is room right now, without waiting"""
+        self._ensure_started()
+        with self._condition:
+            if len(self._buffer) >= self.max_queue:
+                self._condition.notify_all()
+                return False
+            self._append(item)
+        return True
+
+    def _append(self, item):
+        # Caller holds the condition
+        self._buffer.append(item)
+        if len(self._buffer) >= self.max_batch:
+            self._condition.notify_all()
+
+    def stats(self):
+        """Counters for monitoring"""
+        with self._condition:
+            queued = len(self._buffer)
+        return {
+            "queued": queued,
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "blocked": self.blocked
+        }
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._condition:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stopping = False
+                    self._thread = threading.Thread(
+                        target=self._run, name=self.name, daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopping and len(self._buffer) < self.max_batch:
+                    self._condition.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def _take(self):
+        with self._condition:
+            batch, self._buffer = self._buffer, []
+            # Wake writers waiting for room
+            self._condition.notify_all()
+        return batch
+
+    def flush(self):
+        """Write everything buffered so far (safe to call from any thread)"""
+        with self._flush_lock:
+            batch = self._take()
+            if not batch:
+                return 0
+
+            for start in range(0, len(batch), self.max_batch):
+                self._write_batch(batch[start:start + self.max_batch])
+            return len(batch)
+
+    def _write_batch(self, rows):
+        try:
+            execute_many(self.query, rows)
+            self.written += len(rows)
+            return
+        except Exception as e:
+            logger.warning(f"{self.name}: batch of {len(rows)} failed, retrying rows: {e}")
+
+        # Isolate the bad rows so one failure does not drop the whole batch
+        for row in rows:
+            try:
+                execute_many(self.query, [row])
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"{self.name}: dropping row {row}: {e}")
+
+    def stop(self):
+        """Stop the background thread after a final flush"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            with self._condition:
+                self._stopping = True
+                self._condition.notify_all()
+            thread.join(timeout=10)
+        self.flush()
@@ -0,0 +1,179 @@
+"""
+Notification digests
+
+Users can ask for an hourly or daily digest instead of one notification per
+event. The dispatcher stages their events in digest_events rather than
+delivering them, and a scheduled job turns each user's staged events into a
+single summary notification once their period has elapsed, using one
+grouped query for all due users.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from config import settings
+from database import execute_query, execute_many, transaction, db_timestamp, INSERT_IGNORE
+from services.scheduler import scheduler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DIGEST_MODES = ('off', 'hourly', 'daily')
+
+DIGEST_PERIODS = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1),
+}
+
+# Staged events per user and title for every user whose digest is due;
+# users who switched digests off are flushed at the next run
+DUE_QUERY = """
+    SELECT d.user_id, p.digest_mode, d.title, COUNT(*) as event_count,
+           MIN(d.created_at) as first_at, MAX(d.id) as last_id,
+           MAX(CASE WHEN d.email = TRUE THEN 1 ELSE 0 END) as email
+    FROM digest_events d
+    JOIN notification_preferences p ON p.user_id = d.user_id
+    WHERE p.digest_mode = 'off'
+       OR (p.digest_mode = 'hourly' AND (p.last_digest_at IS NULL OR p.last_digest_at <= %s))
+       OR (p.digest_mode = 'daily' AND (p.last_digest_at IS NULL OR p.last_digest_at <= %s))
+    GROUP BY d.user_id, p.digest_mode, d.title
+"""
+
+
+def get_digest_modes(user_ids):
+    """
+    Look up the users that currently receive digests.
+
+    Returns:
+        dict: user_id -> 'hourly' or 'daily'
+    """
+    if not user_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    rows = execute_query(
+        f"""SELECT user_id, digest_mode FROM notification_preferences
+            WHERE user_id IN ({placeholders}) AND digest_mode <> 'off'""",
+        list(user_ids),
+        fetch=True
+    )
+    return {row['user_id']: row['digest_mode'] for row in rows}
+
+
+def stage_digest_events(notifications):
+    """
+    Stage the notifications of digest users instead of delivering them.
+
+    Digest summaries themselves (digest=True) are never staged.
+
+    Args:
+        notifications: Notification dicts from the dispatcher
+
+    Returns:
+        list: The notifications to deliver right away
+    """
+    candidates = {n['user_id'] for n in notifications if not n.get('digest')}
+    modes = get_digest_modes(sorted(candidates))
+    if not modes:
+        return notifications
+
+    staged = [n for n in notifications if n['user_id'] in modes and not n.get('digest')]
+    execute_many(
+        f"""{INSERT_IGNORE} INTO digest_events
+            (user_id, title, message, type, email, event_key, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+        [(n['user_id'], n['title'], n['message'], n['type'], bool(n.get('email')),
+          n['event_key'], n['created_at']) for n in staged]
+    )
+    digest_batcher.staged += len(staged)
+    return [n for n in notifications if n['user_id'] not in modes or n.get('digest')]
+
+
+def format_digest(mode, groups):
+    """Build the summary title and message for one user's staged events"""
+    total = sum(group['event_count'] for group in groups)
+    groups = sorted(groups, key=lambda group: -group['event_count'])
+    lines = [f"{group['event_count']} x {group['title']}" for group in groups]
+    label = mode if mode in DIGEST_PERIODS else 'notification'
+    title = f"Your {label} digest: {total} update{'s' if total != 1 else ''}"
+    return title, "; ".join(lines)
+
+
+class DigestBatcher:
+    """Scheduled job turning staged events into summary notifications"""
+
+    def __init__(self):
+        self.staged = 0
+        self.digests_sent = 0
+        self.events_coalesced = 0
+
+    def run(self):
+        """
+        Deliver every due digest.
+
+        Returns:
+            int: Number of digests delivered
+        """
+        # Imported here: the dispatcher stages events through this module
+        from services.notifications import notification_dispatcher
+
+        now = datetime.utcnow()
+        rows = execute_query(
+            DUE_QUERY,
+            (db_timestamp(now - DIGEST_PERIODS['hourly']), db_timestamp(now - DIGEST_PERIODS['daily'])),
+            fetch=True
+        )
+        if not rows:
+            return 0
+
+        by_user = {}
+        for row in rows:
+            by_user.setdefault(row['user_id'], []).append(row)
+
+        summaries = []
+        cutoffs = {}
+        for user_id, groups in by_user.items():
+            last_id = max(group['last_id'] for group in groups)
+            title, message = format_digest(groups[0]['digest_mode'], groups)
+            summaries.append({
+                "user_id": user_id,
+                "title": title,
+                "message": message,
+                "type": 'info',
+                "email": any(group['email'] for group in groups),
+                "created_at": db_timestamp(now),
+                # Same key if a run is repeated before the staged rows are cleared
+                "event_key": f"digest-{user_id}-{last_id}",
+                "digest": True
+            })
+            cutoffs[user_id] = last_id
+
+        # Durable sinks raise, leaving the staged events for the next run
+        notification_dispatcher.deliver(summaries)
+
+        with transaction() as tx:
+            for user_id, last_id in cutoffs.items():
+                tx.execute(
+                    "DELETE FROM digest_events WHERE user_id = %s AND id <= %s",
+                    (user_id, last_id)
+                )
+            placeholders = ', '.join(['%s'] * len(cutoffs))
+            tx.execute(
+                f"UPDATE notification_preferences SET last_digest_at = %s WHERE user_id IN ({placeholders})",
+                [db_timestamp(now)] + list(cutoffs)
+            )
+
+        self.digests_sent += len(summaries)
+        self.events_coalesced += sum(row['event_count'] for row in rows)
+        return len(summaries)
+
+    def stats(self):
+        return {
+            "staged": self.staged,
+            "digests_sent": self.digests_sent,
+            "events_coalesced": self.events_coalesced
+        }
+
+
+# Shared digest job
+digest_batcher = DigestBatcher()
+scheduler.add_job('notification-digests', digest_batcher.run, settings.DIGEST_CHECK_INTERVAL)
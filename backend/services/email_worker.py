@@ -0,0 +1,337 @@
+"""
+Email delivery worker
+
+The email notification sink only queues messages in the email_deliveries
+table, so sending never adds latency to an API request or to the other
+sinks. EmailWorker threads claim ready deliveries in batches and send them
+over a persistent SMTP connection each, reopened when the server drops it
+or it sits idle. Temporary failures are retried with exponential backoff;
+every delivery records its status, attempts and last error.
+
+For local testing point SMTP_HOST/SMTP_PORT at a stand-in server, e.g.
+python -m smtpd -n -c DebuggingServer localhost:1025 with SMTP_USE_TLS=false.
+"""
+
+import logging
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from config import settings
+from database import execute_query, execute_one, execute_many, db_timestamp, INSERT_IGNORE
+from services.scheduler import scheduler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Upper bound for the retry backoff (seconds)
+MAX_BACKOFF = 6 * 3600
+
+
+class SMTPUnavailable(Exception):
+    """The SMTP session could not be opened (connect, TLS or login failed)"""
+
+
+def enqueue_emails(notifications):
+    """
+    Queue emails for notifications (idempotent on event_key).
+
+    Args:
+        notifications: Notification dicts with user_id, title, message, event_key
+
+    Returns:
+        int: Number of emails queued
+    """
+    if not notifications:
+        return 0
+
+    # Resolve all recipients with one query
+    user_ids = sorted({n['user_id'] for n in notifications})
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    rows = execute_query(
+        f"SELECT id, email FROM users WHERE id IN ({placeholders}) AND is_active = TRUE",
+        user_ids,
+        fetch=True
+    )
+    emails = {row['id']: row['email'] for row in rows}
+
+    now = db_timestamp()
+    deliveries = [
+        (n['event_key'], n['user_id'], emails[n['user_id']],
+         f"[Share-IT] {n['title']}"[:255], n['message'], now)
+        for n in notifications if n['user_id'] in emails
+    ]
+    if not deliveries:
+        return 0
+
+    execute_many(
+        f"""{INSERT_IGNORE} INTO email_deliveries
+            (event_key, user_id, recipient, subject, body, available_at)
+            VALUES (%s, %s, %s, %s, %s, %s)""",
+        deliveries
+    )
+    email_worker.wake()
+    return len(deliveries)
+
+
+class SMTPConnection:
+    """SMTP session kept open between batches"""
+
+    def __init__(self, host=None, port=None, timeout=None, idle_timeout=None):
+        self.host = host or settings.SMTP_HOST
+        self.port = port or settings.SMTP_PORT
+        self.timeout = timeout or settings.SMTP_TIMEOUT
+        self.idle_timeout = idle_timeout or settings.SMTP_IDLE_TIMEOUT
+        self._smtp = None
+        self._last_used = 0
+        self.opened = 0
+
+    def _open(self):
+        try:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        except (smtplib.SMTPException, OSError) as e:
+            raise SMTPUnavailable(f"Cannot connect to {self.host}:{self.port}: {e}") from e
+        try:
+            if settings.SMTP_USE_TLS:
+                smtp.starttls()
+            if settings.SMTP_USER:
+                smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        except (smtplib.SMTPException, OSError) as e:
+            smtp.close()
+            raise SMTPUnavailable(f"SMTP session setup failed: {e}") from e
+        self._smtp = smtp
+        self.opened += 1
+
+    def send(self, message):
+        """Send a message, reconnecting once if a reused session was dropped"""
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+
+        reused = self._smtp is not None
+        if not reused:
+            self._open()
+        try:
+            self._smtp.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            self._reconnect(reused)
+            self._smtp.send_message(message)
+        except smtplib.SMTPException:
+            # The server answered; the session is still usable
+            raise
+        except OSError:
+            self._reconnect(reused)
+            self._smtp.send_message(message)
+        self._last_used = time.monotonic()
+
+    def _reconnect(self, reused):
+        self.close()
+        if not reused:
+            raise
+        self._open()
+
+    def close_if_idle(self):
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+
+    def close(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+
+class EmailWorker:
+    """Background threads sending queued emails"""
+
+    def __init__(self, workers=None, batch_size=None, poll_interval=None,
+                 lease_seconds=None, max_attempts=None, retry_base=None):
+        self.workers = workers or settings.EMAIL_WORKERS
+        self.batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        self.poll_interval = poll_interval or settings.EMAIL_POLL_INTERVAL
+        self.lease_seconds = lease_seconds or settings.EMAIL_LEASE_SECONDS
+        self.max_attempts = max_attempts or settings.EMAIL_MAX_ATTEMPTS
+        self.retry_base = retry_base or settings.EMAIL_RETRY_BASE
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._connections = []
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the worker threads (only when EMAIL_ENABLED)"""
+        if not settings.EMAIL_ENABLED or any(t.is_alive() for t in self._threads):
+            return
+        self._stopping.clear()
+        self._threads = []
+        self._connections = []
+        for number in range(self.workers):
+            connection = SMTPConnection()
+            thread = threading.Thread(
+                target=self._run, args=(connection,), name=f'email-worker-{number}', daemon=True
+            )
+            self._connections.append(connection)
+            self._threads.append(thread)
+            thread.start()
+
+    def wake(self):
+        """Send newly queued emails now instead of at the next poll"""
+        self._wake.set()
+
+    def stop(self):
+        """Stop the worker threads after their current batch"""
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=30)
+
+    def _run(self, connection):
+        try:
+            while not self._stopping.is_set():
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                try:
+                    while not self._stopping.is_set() and self.send_batch(connection) == self.batch_size:
+                        pass
+                except Exception as e:
+                    logger.error(f"Email worker error: {e}")
+                connection.close_if_idle()
+        finally:
+            connection.close()
+
+    def _claim(self):
+        now = datetime.utcnow()
+        ready = execute_query(
+            """SELECT id FROM email_deliveries
+               WHERE status = 'pending' AND available_at <= %s
+               ORDER BY id LIMIT %s""",
+            (db_timestamp(now), self.batch_size),
+            fetch=True
+        )
+        if not ready:
+            return 0, []
+
+        # Claim the rows so other workers skip them until the lease expires
+        claim_token = uuid.uuid4().hex
+        ids = [row['id'] for row in ready]
+        placeholders = ', '.join(['%s'] * len(ids))
+        execute_query(
+            f"""UPDATE email_deliveries
+                SET claim_token = %s, available_at = %s, attempts = attempts + 1
+                WHERE id IN ({placeholders}) AND status = 'pending' AND available_at <= %s""",
+            [claim_token, db_timestamp(now + timedelta(seconds=self.lease_seconds))]
+            + ids + [db_timestamp(now)]
+        )
+        rows = execute_query(
+            """SELECT id, recipient, subject, body, attempts FROM email_deliveries
+               WHERE claim_token = %s ORDER BY id""",
+            (claim_token,),
+            fetch=True
+        )
+        return len(ready), rows
+
+    def send_batch(self, connection):
+        """
+        Claim and send one batch of ready emails.
+
+        Returns:
+            int: Number of emails that were ready
+        """
+        ready, rows = self._claim()
+        sent = []
+
+        for index, row in enumerate(rows):
+            message = EmailMessage()
+            message['From'] = settings.EMAIL_FROM
+            message['To'] = row['recipient']
+            message['Subject'] = row['subject']
+            message.set_content(row['body'])
+
+            try:
+                connection.send(message)
+                sent.append(row['id'])
+            except (SMTPUnavailable, smtplib.SMTPServerDisconnected) as e:
+                # Server unreachable: retry this and the rest of the batch later
+                for pending in rows[index:]:
+                    self._fail(pending, str(e))
+                break
+            except smtplib.SMTPRecipientsRefused as e:
+                self._fail(row, str(e), permanent=True)
+            except smtplib.SMTPResponseException as e:
+                # 5xx replies will not succeed on retry, 4xx may
+                self._fail(row, f"{e.smtp_code} {e.smtp_error.decode(errors='replace')}",
+                           permanent=e.smtp_code >= 500)
+            except smtplib.SMTPException as e:
+                self._fail(row, str(e))
+            except OSError as e:
+                # Lost the connection and could not resend
+                for pending in rows[index:]:
+                    self._fail(pending, str(e))
+                break
+
+        if sent:
+            placeholders = ', '.join(['%s'] * len(sent))
+            execute_query(
+                f"""UPDATE email_deliveries SET status = 'sent', sent_at = %s, claim_token = NULL
+                    WHERE id IN ({placeholders})""",
+                [db_timestamp()] + sent
+            )
+            self.sent += len(sent)
+        return ready
+
+    def _fail(self, row, error, permanent=False):
+        if permanent or row['attempts'] >= self.max_attempts:
+            execute_query(
+                """UPDATE email_deliveries SET status = 'failed', last_error = %s, claim_token = NULL
+                   WHERE id = %s""",
+                (error[:1000], row['id'])
+            )
+            self.failed += 1
+            logger.error(f"Email {row['id']} to {row['recipient']} failed permanently: {error}")
+        else:
+            backoff = min(self.retry_base * 2 ** (row['attempts'] - 1), MAX_BACKOFF)
+            execute_query(
+                """UPDATE email_deliveries SET available_at = %s, last_error = %s, claim_token = NULL
+                   WHERE id = %s""",
+                (db_timestamp(datetime.utcnow() + timedelta(seconds=backoff)), error[:1000], row['id'])
+            )
+            self.retried += 1
+
+    def purge(self):
+        """Delete sent and failed deliveries older than the retention period"""
+        cutoff = datetime.utcnow() - timedelta(days=settings.EMAIL_RETENTION_DAYS)
+        deleted = execute_query(
+            "DELETE FROM email_deliveries WHERE status IN ('sent', 'failed') AND created_at < %s",
+            (db_timestamp(cutoff),)
+        )
+        if deleted:
+            logger.info(f"Purged {deleted} email delivery records")
+
+    def stats(self):
+        """Delivery counters and the current backlog"""
+        try:
+            backlog = execute_one(
+                "SELECT COUNT(*) as count FROM email_deliveries WHERE status = 'pending'"
+            )['count']
+        except Exception:
+            backlog = None
+        return {
+            "enabled": settings.EMAIL_ENABLED,
+            "pending": backlog,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "connections_opened": sum(c.opened for c in self._connections)
+        }
+
+
+# Shared worker, started in the app lifespan
+email_worker = EmailWorker()
+scheduler.add_job('email-purge', email_worker.purge, 24 * 3600)
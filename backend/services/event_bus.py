@@ -0,0 +1,184 @@
+"""
+Cross-worker event bus
+
+Events are delivered to the subscribers in the publishing process right
+away and appended to a log in a SQLite file shared by every worker on the
+host. Each worker tails the log from a background thread and delivers the
+events published by the other workers, so a connection held by any worker
+sees every event. The log is ephemeral: entries are trimmed after
+EVENT_BUS_RETENTION seconds.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Seconds between trims of the shared log
+PURGE_INTERVAL = 60
+
+
+class SharedEventLog:
+    """Append-only event log in a SQLite file shared by the workers"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            """CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, channel, origin, payload):
+        self._connection().execute(
+            "INSERT INTO events (channel, origin, payload, created_at) VALUES (?, ?, ?, ?)",
+            (channel, origin, json.dumps(payload, default=str), time.time())
+        )
+
+    def read_since(self, seq, limit=1000):
+        """Get up to limit (seq, channel, origin, payload) rows after seq"""
+        return self._connection().execute(
+            "SELECT seq, channel, origin, payload FROM events WHERE seq > ? ORDER BY seq LIMIT ?",
+            (seq, limit)
+        ).fetchall()
+
+    def last_seq(self):
+        row = self._connection().execute("SELECT MAX(seq) FROM events").fetchone()
+        return row[0] or 0
+
+    def purge(self, retention):
+        self._connection().execute(
+            "DELETE FROM events WHERE created_at < ?",
+            (time.time() - retention,)
+        )
+
+
+class EventBus:
+    """Channel based pub/sub spanning every worker on the host"""
+
+    def __init__(self, path=None, poll_interval=None, retention=None):
+        self.path = path or settings.EVENT_BUS_PATH
+        self.poll_interval = poll_interval or settings.EVENT_BUS_POLL_INTERVAL
+        self.retention = retention or settings.EVENT_BUS_RETENTION
+        self.origin = uuid.uuid4().hex
+        self._log = None
+        self._subscribers = {}
+        self._last_seq = 0
+        self._stopping = threading.Event()
+        self._thread = None
+        self.published = 0
+        self.relayed = 0
+
+    @property
+    def log(self):
+        """Shared log, or None if it could not be opened"""
+        if self._log is None:
+            try:
+                self._log = SharedEventLog(self.path)
+            except sqlite3.Error as e:
+                logger.error(f"Event bus log unavailable, delivering locally only: {e}")
+                self._log = False
+        return self._log or None
+
+    def subscribe(self, channel, callback):
+        """Register callback(payload) for a channel; it runs on the publishing or relay thread"""
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def publish(self, channel, payload):
+        """
+        Publish an event to every worker.
+
+        Args:
+            channel: Channel name
+            payload: JSON-serializable event
+        """
+        self._deliver(channel, payload)
+        self.published += 1
+
+        log = self.log
+        if log is None:
+            return
+        try:
+            log.append(channel, self.origin, payload)
+        except sqlite3.Error as e:
+            logger.error(f"Error publishing event on {channel}: {e}")
+
+    def _deliver(self, channel, payload):
+        for callback in self._subscribers.get(channel, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Event bus subscriber on {channel} failed: {e}")
+
+    def start(self):
+        """Start relaying events published by other workers"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        log = self.log
+        if log is None:
+            return
+        try:
+            self._last_seq = log.last_seq()
+        except sqlite3.Error as e:
+            logger.error(f"Event bus log unavailable: {e}")
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='event-bus', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the relay thread"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._stopping.set()
+            thread.join(timeout=5)
+
+    def _run(self):
+        last_purge = time.monotonic()
+        while not self._stopping.wait(self.poll_interval):
+            try:
+                self.poll()
+                if time.monotonic() - last_purge > PURGE_INTERVAL:
+                    last_purge = time.monotonic()
+                    self.log.purge(self.retention)
+            except sqlite3.Error as e:
+                logger.error(f"Error reading event bus log: {e}")
+
+    def poll(self):
+        """Deliver events published by other workers since the last poll"""
+        rows = self.log.read_since(self._last_seq)
+        for seq, channel, origin, payload in rows:
+            self._last_seq = seq
+            if origin == self.origin:
+                continue
+            self._deliver(channel, json.loads(payload))
+            self.relayed += 1
+        return len(rows)
+
+    def stats(self):
+        return {"published": self.published, "relayed": self.relayed}
+
+
+# Shared event bus instance
+event_bus = EventBus()
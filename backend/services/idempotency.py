@@ -0,0 +1,180 @@
+"""
+Idempotency keys for create endpoints
+
+Clients that retry a POST send the same Idempotency-Key header with every
+attempt. The first attempt claims the key in the same transaction as its
+insert and stores the response with it; retries within IDEMPOTENCY_KEY_TTL
+get that response back (marked Idempotent-Replayed) without inserting again
+or repeating notifications and activity logging. Keys are scoped to the user
+and bound to a hash of the endpoint and body, so reusing one for a different
+request is rejected. Expired keys are purged in the background.
+"""
+
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from config import settings
+from database import execute_query, execute_one, db_timestamp, INSERT_IGNORE
+from services.scheduler import scheduler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Printable ASCII without spaces, long enough for a UUID or ULID
+KEY_PATTERN = re.compile(r'^[\x21-\x7e]{1,64}$')
+
+REPLAY_HEADER = 'Idempotent-Replayed'
+
+STORED_QUERY = """
+    SELECT request_hash, status_code, response FROM idempotency_keys
+    WHERE user_id = %s AND idempotency_key = %s AND expires_at > %s
+"""
+
+
+def request_fingerprint(endpoint, payload):
+    """
+    Hash of an endpoint and its request body.
+
+    Args:
+        endpoint: Method and path, e.g. 'POST /api/books'
+        payload: Pydantic model or JSON-serializable body
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    if hasattr(payload, 'model_dump'):
+        payload = payload.model_dump()
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f"{endpoint}\n{body}".encode('utf-8')).hexdigest()
+
+
+class IdempotentRequest:
+    """A create call and its optional Idempotency-Key
+
+    Usage:
+        idempotency = IdempotentRequest(key, user_id, 'POST /api/books', body)
+        replay = idempotency.lookup()
+        if replay:
+            return replay
+        with transaction() as tx:
+            replay = idempotency.claim(tx)
+            if replay:
+                return replay
+            ...
+            idempotency.save(tx, result)
+
+    Every method is a no-op when the client sent no key.
+    """
+
+    def __init__(self, key, user_id, endpoint, payload, status_code=201):
+        if key is not None and not KEY_PATTERN.match(key):
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid Idempotency-Key header (1-64 printable characters)"
+            )
+        self.key = key
+        self.user_id = user_id
+        self.status_code = status_code
+        # Taken before the route normalizes the body, so retries hash the same
+        self.fingerprint = request_fingerprint(endpoint, payload) if key else None
+
+    def _replay(self, stored):
+        """Stored response for a retry, or an error if the key was reused"""
+        if stored is None or stored['response'] is None:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress"
+            )
+        if stored['request_hash'] != self.fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used for a different request"
+            )
+        return JSONResponse(
+            status_code=stored['status_code'],
+            content=json.loads(stored['response']),
+            headers={REPLAY_HEADER: 'true'}
+        )
+
+    def lookup(self):
+        """
+        Find the response of an earlier attempt.
+
+        Returns:
+            JSONResponse: The stored response, or None if this is the first attempt
+
+        Raises:
+            HTTPException: 422 if the key was used for a different request
+        """
+        if not self.key:
+            return None
+        stored = execute_one(STORED_QUERY, (self.user_id, self.key, db_timestamp()))
+        return self._replay(stored) if stored else None
+
+    def claim(self, tx):
+        """
+        Reserve the key in the transaction that performs the create.
+
+        A concurrent attempt with the same key waits on the key's row and,
+        once the first commits, gets its response instead of inserting again.
+
+        Args:
+            tx: Open Transaction from database.transaction()
+
+        Returns:
+            JSONResponse: The response of an attempt that committed meanwhile,
+                or None if this attempt owns the key
+        """
+        if not self.key:
+            return None
+        now = db_timestamp()
+        # An expired key that has not been purged yet is free again
+        tx.execute(
+            "DELETE FROM idempotency_keys WHERE user_id = %s AND idempotency_key = %s AND expires_at <= %s",
+            (self.user_id, self.key, now)
+        )
+        expires_at = datetime.utcnow() + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL)
+        tx.execute(
+            f"""{INSERT_IGNORE} INTO idempotency_keys
+                (user_id, idempotency_key, request_hash, expires_at)
+                VALUES (%s, %s, %s, %s)""",
+            (self.user_id, self.key, self.fingerprint, db_timestamp(expires_at))
+        )
+        if tx.cursor.rowcount == 1:
+            return None
+        return self._replay(tx.fetch_one(STORED_QUERY, (self.user_id, self.key, now)))
+
+    def save(self, tx, body):
+        """
+        Store the response with the claimed key, committed with the create.
+
+        Args:
+            tx: Transaction that claimed the key
+            body: JSON-serializable response body
+        """
+        if not self.key:
+            return
+        tx.execute(
+            """UPDATE idempotency_keys SET status_code = %s, response = %s
+               WHERE user_id = %s AND idempotency_key = %s""",
+            (self.status_code, json.dumps(body, default=str), self.user_id, self.key)
+        )
+
+
+def purge_idempotency_keys():
+    """Delete keys past their TTL"""
+    deleted = execute_query(
+        "DELETE FROM idempotency_keys WHERE expires_at <= %s",
+        (db_timestamp(),)
+    )
+    if deleted:
+        logger.info(f"Purged {deleted} expired idempotency keys")
+
+
+scheduler.add_job('idempotency-purge', purge_idempotency_keys, settings.IDEMPOTENCY_PURGE_INTERVAL)
@@ -0,0 +1,51 @@
+"""
+Item summaries on requests
+
+Requests carry a copy of their item's title, creator and image
+(item_title, item_creator, item_image), written when the request is created
+and refreshed whenever the item is edited, so request lists and events read
+a single table instead of joining books and board_games on every row.
+"""
+
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Item type -> (table, title column, creator column, image column)
+ITEM_SUMMARY_COLUMNS = {
+    'book': ('books', 'title', 'author', 'cover_url'),
+    'boardgame': ('board_games', 'title', 'designer', 'image_url'),
+}
+
+
+def summary_select(item_type):
+    """Select list of an item row in request column order (title, creator, image)"""
+    _, title, creator, image = ITEM_SUMMARY_COLUMNS[item_type]
+    return f"{title}, {creator}, {image}"
+
+
+def refresh_item_summaries(tx, item_type, item_id):
+    """
+    Copy an item's current title, creator and image onto its requests.
+
+    Args:
+        tx: Open Transaction that updated the item
+        item_type: 'book' or 'boardgame'
+        item_id: Edited item
+
+    Returns:
+        int: Number of requests updated
+    """
+    table, title, creator, image = ITEM_SUMMARY_COLUMNS[item_type]
+    item = tx.fetch_one(
+        f"SELECT {title} as title, {creator} as creator, {image} as image FROM {table} WHERE id = %s",
+        (item_id,)
+    )
+    if not item:
+        return 0
+    return tx.execute(
+        """UPDATE requests SET item_title = %s, item_creator = %s, item_image = %s
+           WHERE item_type = %s AND item_id = %s""",
+        (item['title'], item['creator'], item['image'], item_type, item_id)
+    )
@@ -0,0 +1,90 @@
+"""
+Job coordination across workers
+
+Every worker process runs its own scheduler. Jobs that must run on a single
+worker at a time take a lease in job_leases: the holder renews it on every
+run, and another worker takes over once it expires. Jobs that work
+incrementally keep their progress (e.g. the last day processed) in
+job_state, so a restart or a new leader picks up where the last run stopped.
+"""
+
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from database import INSERT_IGNORE, execute_one, execute_query, transaction, db_timestamp
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Identifies this worker process as a lease holder
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire_lease(name, ttl):
+    """
+    Take or renew the lease of a job.
+
+    Args:
+        name: Job name
+        ttl: Seconds the lease stays valid without renewal
+
+    Returns:
+        bool: True if this worker holds the lease
+    """
+    now = datetime.utcnow()
+    expires_at = db_timestamp(now + timedelta(seconds=ttl))
+
+    with transaction() as tx:
+        # Renew our own lease or take over an expired one
+        tx.execute(
+            """UPDATE job_leases SET holder = %s, expires_at = %s
+               WHERE name = %s AND (holder = %s OR expires_at < %s)""",
+            (WORKER_ID, expires_at, name, WORKER_ID, db_timestamp(now))
+        )
+        if tx.cursor.rowcount == 1:
+            return True
+
+        # First run anywhere: the insert is ignored if another worker got there first
+        tx.execute(
+            f"{INSERT_IGNORE} INTO job_leases (name, holder, expires_at) VALUES (%s, %s, %s)",
+            (name, WORKER_ID, expires_at)
+        )
+        # MySQL counts only changed rows, so a renewal within the same
+        # second reports no update; read the holder back
+        lease = tx.fetch_one("SELECT holder FROM job_leases WHERE name = %s", (name,))
+        return lease is not None and lease['holder'] == WORKER_ID
+
+
+def release_lease(name):
+    """Give up a lease so another worker can take it right away"""
+    execute_query(
+        "DELETE FROM job_leases WHERE name = %s AND holder = %s",
+        (name, WORKER_ID)
+    )
+
+
+def load_state(name):
+    """
+    Get the saved progress of a job.
+
+    Returns:
+        dict: State saved by the last run (empty before the first one)
+    """
+    row = execute_one("SELECT state FROM job_state WHERE name = %s", (name,))
+    if not row or not row['state']:
+        return {}
+    return json.loads(row['state'])
+
+
+def save_state(name, state):
+    """Save the progress of a job"""
+    with transaction() as tx:
+        tx.execute(f"{INSERT_IGNORE} INTO job_state (name) VALUES (%s)", (name,))
+        tx.execute(
+            "UPDATE job_state SET state = %s, updated_at = %s WHERE name = %s",
+            (json.dumps(state, default=str), db_timestamp(), name)
+        )
@@ -0,0 +1,457 @@
+"""
+Loan history and lending statistics
+
+Every approved request becomes a row of loan_history when it is approved and
+is completed when the item comes back, with its durations computed once:
+how long the owner took to answer, how long the loan lasted and how late it
+came back. The same transaction adds the loan to per-user
+(user_lending_stats) and per-item (item_loan_stats) totals, so lending
+reports, top lenders and borrowers, and item popularity read a few
+pre-aggregated rows instead of scanning requests.
+
+Loans approved before the table existed are copied in by a scheduled
+backfill, which adds them to the totals the same way.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime
+
+from config import settings
+from database import DB_TYPE, INSERT_IGNORE, execute_query, execute_one, transaction, db_timestamp
+from services.scheduler import scheduler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+USER_COLUMNS = (
+    'lent_count', 'lent_returned', 'lent_days', 'response_minutes',
+    'borrowed_count', 'borrowed_returned', 'borrowed_days', 'late_returns'
+)
+
+ITEM_COLUMNS = ('loan_count', 'returned_count', 'loan_days', 'late_returns')
+
+FACT_COLUMNS = (
+    'request_id', 'item_type', 'item_id', 'item_title', 'owner_id', 'borrower_id',
+    'requested_at', 'approved_at', 'pickup_date', 'return_date', 'returned_on',
+    'status', 'response_minutes', 'planned_days', 'loan_days', 'late_days'
+)
+
+_fact_insert = (
+    f"INTO loan_history ({', '.join(FACT_COLUMNS)}) "
+    f"VALUES ({', '.join(['%s'] * len(FACT_COLUMNS))})"
+)
+INSERT_FACT_QUERY = f"INSERT {_fact_insert}"
+BACKFILL_FACT_QUERY = f"{INSERT_IGNORE} {_fact_insert}"
+
+# Request columns a loan is built from
+REQUEST_COLUMNS = """id, item_type, item_id, item_title, owner_id, requester_id, status,
+                     request_date, response_date, pickup_date, return_date"""
+
+
+def _upsert_query(table, keys, counters, extra=()):
+    """Insert a row of increments for keys, or add them to the existing row;
+    extra columns are overwritten when the new value is not NULL"""
+    columns = list(keys) + list(extra) + list(counters)
+    values = ', '.join(['%s'] * len(columns))
+
+    if DB_TYPE == 'sqlite':
+        updates = [f"{c} = {c} + excluded.{c}" for c in counters]
+        updates += [f"{c} = COALESCE(excluded.{c}, {table}.{c})" for c in extra]
+        return f"""
+            INSERT INTO {table} ({', '.join(columns)}, updated_at)
+            VALUES ({values}, CURRENT_TIMESTAMP)
+            ON CONFLICT({', '.join(keys)}) DO UPDATE SET
+                {', '.join(updates)},
+                updated_at = CURRENT_TIMESTAMP
+        """
+
+    updates = [f"{c} = {c} + VALUES({c})" for c in counters]
+    updates += [f"{c} = COALESCE(VALUES({c}), {c})" for c in extra]
+    return f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        VALUES ({values})
+        ON DUPLICATE KEY UPDATE {', '.join(updates)}
+    """
+
+
+USER_UPSERT_QUERY = _upsert_query('user_lending_stats', ('user_id',), USER_COLUMNS)
+ITEM_UPSERT_QUERY = _upsert_query(
+    'item_loan_stats', ('item_type', 'item_id'), ITEM_COLUMNS,
+    ('owner_id', 'item_title', 'last_loan_at')
+)
+
+
+def _as_datetime(value):
+    """Timestamp column value as a datetime (SQLite returns strings)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    return datetime.fromisoformat(str(value))
+
+
+def _as_date(value):
+    """Date column value as a date (SQLite returns strings)"""
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(str(value)[:10])
+
+
+def _sql_value(value):
+    """Parameter for a TIMESTAMP or DATE column"""
+    if isinstance(value, datetime):
+        return db_timestamp(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _fact_row(fact):
+    return tuple(_sql_value(fact[c]) for c in FACT_COLUMNS)
+
+
+def _days(start, end):
+    return max((end - start).days, 0)
+
+
+def _loan_fact(request):
+    """loan_history row of an approved request"""
+    requested_at = _as_datetime(request['request_date'])
+    approved_at = _as_datetime(request['response_date']) or requested_at
+    pickup_date = _as_date(request['pickup_date'])
+    return_date = _as_date(request['return_date'])
+    response_minutes = None
+    if requested_at and approved_at:
+        response_minutes = max(int((approved_at - requested_at).total_seconds() // 60), 0)
+
+    return {
+        "request_id": request['id'],
+        "item_type": request['item_type'],
+        "item_id": request['item_id'],
+        "item_title": request['item_title'],
+        "owner_id": request['owner_id'],
+        "borrower_id": request['requester_id'],
+        "requested_at": requested_at,
+        "approved_at": approved_at,
+        "pickup_date": pickup_date,
+        "return_date": return_date,
+        "returned_on": None,
+        "status": 'active',
+        "response_minutes": response_minutes,
+        "planned_days": _days(pickup_date, return_date),
+        "loan_days": None,
+        "late_days": None
+    }
+
+
+def _apply_totals(tx, facts, approved=True, returned=True, sign=1):
+    """
+    Add loans to the per-user and per-item totals.
+
+    Args:
+        tx: Open Transaction
+        facts: loan_history rows
+        approved: Count the loans themselves (and the owners' response times)
+        returned: Count the durations of the returned ones
+        sign: -1 to take the loans out of the totals again
+    """
+    users = defaultdict(lambda: dict.fromkeys(USER_COLUMNS, 0))
+    items = {}
+
+    for fact in facts:
+        owner = users[fact['owner_id']]
+        borrower = users[fact['borrower_id']]
+        key = (fact['item_type'], fact['item_id'])
+        if key not in items:
+            items[key] = {"owner_id": fact['owner_id'], "item_title": fact['item_title'],
+                          "last_loan_at": None, **dict.fromkeys(ITEM_COLUMNS, 0)}
+        item = items[key]
+
+        if approved:
+            owner['lent_count'] += sign
+            owner['response_minutes'] += sign * (fact['response_minutes'] or 0)
+            borrower['borrowed_count'] += sign
+            item['loan_count'] += sign
+            approved_at = _as_datetime(fact['approved_at'])
+            if sign > 0 and (item['last_loan_at'] is None or approved_at > item['last_loan_at']):
+                item['last_loan_at'] = approved_at
+
+        if returned and fact['status'] == 'returned':
+            loan_days = fact['loan_days'] or 0
+            late = 1 if (fact['late_days'] or 0) > 0 else 0
+            owner['lent_returned'] += sign
+            owner['lent_days'] += sign * loan_days
+            borrower['borrowed_returned'] += sign
+            borrower['borrowed_days'] += sign * loan_days
+            borrower['late_returns'] += sign * late
+            item['returned_count'] += sign
+            item['loan_days'] += sign * loan_days
+            item['late_returns'] += sign * late
+
+    user_rows = [
+        (user_id, *(columns[c] for c in USER_COLUMNS))
+        for user_id, columns in users.items()
+        if user_id is not None and any(columns.values())
+    ]
+    if user_rows:
+        tx.execute_many(USER_UPSERT_QUERY, user_rows)
+
+    item_rows = [
+        (item_type, item_id, item['owner_id'], item['item_title'], _sql_value(item['last_loan_at']),
+         *(item[c] for c in ITEM_COLUMNS))
+        for (item_type, item_id), item in items.items()
+        if any(item[c] for c in ITEM_COLUMNS)
+    ]
+    if item_rows:
+        tx.execute_many(ITEM_UPSERT_QUERY, item_rows)
+
+
+def _fetch_requests(tx, request_ids):
+    placeholders = ', '.join(['%s'] * len(request_ids))
+    return tx.fetch_all(
+        f"SELECT {REQUEST_COLUMNS} FROM requests WHERE id IN ({placeholders})",
+        list(request_ids)
+    )
+
+
+def record_loans(tx, request_ids):
+    """
+    Add just approved requests to the loan history and the lending totals.
+
+    Args:
+        tx: Open Transaction that approved the requests
+        request_ids: IDs of the approved requests
+    """
+    if not settings.LOAN_HISTORY_ENABLED or not request_ids:
+        return
+
+    facts = [_loan_fact(request) for request in _fetch_requests(tx, request_ids)]
+    tx.execute_many(INSERT_FACT_QUERY, [_fact_row(fact) for fact in facts])
+    _apply_totals(tx, facts, returned=False)
+
+
+def record_returns(tx, request_ids, returned_on=None):
+    """
+    Complete the loans of just returned requests and add their durations to the totals.
+
+    Args:
+        tx: Open Transaction that marked the requests returned
+        request_ids: IDs of the returned requests
+        returned_on: Day the items came back (defaults to today)
+    """
+    if not settings.LOAN_HISTORY_ENABLED or not request_ids:
+        return
+
+    returned_on = returned_on or date.today()
+    placeholders = ', '.join(['%s'] * len(request_ids))
+    # Loans approved before the history existed are left to the backfill,
+    # which copies them in as returned
+    facts = tx.fetch_all(
+        f"SELECT * FROM loan_history WHERE request_id IN ({placeholders}) AND status = 'active'",
+        list(request_ids)
+    )
+    if not facts:
+        return
+
+    for fact in facts:
+        fact['loan_days'] = _days(_as_date(fact['pickup_date']), returned_on)
+        fact['late_days'] = _days(_as_date(fact['return_date']), returned_on)
+    _complete_loans(tx, facts, returned_on)
+
+
+def _complete_loans(tx, facts, returned_on):
+    """Mark active loans returned with their loan_days and late_days, and count them"""
+    for fact in facts:
+        fact['status'] = 'returned'
+        fact['returned_on'] = returned_on
+    tx.execute_many(
+        """UPDATE loan_history SET status = 'returned', returned_on = %s, loan_days = %s, late_days = %s
+           WHERE request_id = %s AND status = 'active'""",
+        [(_sql_value(returned_on), fact['loan_days'], fact['late_days'], fact['request_id'])
+         for fact in facts]
+    )
+    _apply_totals(tx, facts, approved=False)
+
+
+def forget_user_loans(tx, user_id):
+    """
+    Remove a deleted user's loans from the history and from the other parties' totals.
+
+    Args:
+        tx: Open Transaction deleting the user
+        user_id: User being deleted
+    """
+    facts = tx.fetch_all(
+        "SELECT * FROM loan_history WHERE owner_id = %s OR borrower_id = %s",
+        (user_id, user_id)
+    )
+    _apply_totals(tx, facts, sign=-1)
+    tx.execute("DELETE FROM loan_history WHERE owner_id = %s OR borrower_id = %s", (user_id, user_id))
+    tx.execute("DELETE FROM user_lending_stats WHERE user_id = %s", (user_id,))
+    tx.execute("DELETE FROM item_loan_stats WHERE owner_id = %s", (user_id,))
+
+
+def backfill_loan_history(batch_size=None):
+    """
+    Copy approved and returned requests missing from the loan history, and
+    complete the loans whose return was not recorded.
+
+    Requests returned before the history existed have no return day on
+    record; their planned length stands in for the actual one.
+
+    Returns:
+        int: Number of loans copied or completed
+    """
+    batch_size = batch_size or settings.LOAN_HISTORY_BATCH_SIZE
+    copied = 0
+    while True:
+        requests = execute_query(
+            f"""SELECT {REQUEST_COLUMNS} FROM requests r
+                WHERE status IN ('approved', 'returned')
+                AND NOT EXISTS (SELECT 1 FROM loan_history h WHERE h.request_id = r.id)
+                ORDER BY id LIMIT %s""",
+            (batch_size,),
+            fetch=True
+        )
+        if not requests:
+            break
+
+        with transaction() as tx:
+            facts = []
+            for request in requests:
+                fact = _loan_fact(request)
+                if request['status'] == 'returned':
+                    fact.update(status='returned', loan_days=fact['planned_days'], late_days=0)
+                # Ignored if the loan was recorded meanwhile
+                tx.execute(BACKFILL_FACT_QUERY, _fact_row(fact))
+                if tx.cursor.rowcount == 1:
+                    facts.append(fact)
+            _apply_totals(tx, facts)
+
+        copied += len(facts)
+        if len(requests) < batch_size:
+            break
+
+    # A return committed while its loan was being copied in finds no active
+    # loan to complete; the scan only covers loans that are still active
+    with transaction() as tx:
+        stale = tx.fetch_all(
+            """SELECT h.* FROM loan_history h
+               JOIN requests r ON r.id = h.request_id
+               WHERE h.status = 'active' AND r.status = 'returned'"""
+        )
+        for fact in stale:
+            fact['loan_days'] = fact['planned_days']
+            fact['late_days'] = 0
+        if stale:
+            _complete_loans(tx, stale, None)
+    copied += len(stale)
+
+    if copied:
+        logger.info(f"Loan history backfilled with {copied} loans")
+    return copied
+
+
+def _average(total, count, scale=1):
+    return round(total / count / scale, 1) if count else None
+
+
+def summarize_lending(row):
+    """
+    Turn a row of lending totals into counts and averages.
+
+    Args:
+        row: user_lending_stats row or sums over it (None for no loans)
+
+    Returns:
+        dict: {"lent": {...}, "borrowed": {...}}
+    """
+    row = {c: int((row or {}).get(c) or 0) for c in USER_COLUMNS}
+    return {
+        "lent": {
+            "loans": row['lent_count'],
+            "returned": row['lent_returned'],
+            "avg_loan_days": _average(row['lent_days'], row['lent_returned']),
+            "avg_response_hours": _average(row['response_minutes'], row['lent_count'], 60)
+        },
+        "borrowed": {
+            "loans": row['borrowed_count'],
+            "returned": row['borrowed_returned'],
+            "avg_loan_days": _average(row['borrowed_days'], row['borrowed_returned']),
+            "late_returns": row['late_returns']
+        }
+    }
+
+
+def get_lending_stats(user_id):
+    """Get a user's lending and borrowing totals with averages"""
+    row = execute_one(
+        f"SELECT {', '.join(USER_COLUMNS)} FROM user_lending_stats WHERE user_id = %s",
+        (user_id,)
+    )
+    return summarize_lending(row)
+
+
+def get_top_users(role, limit=5):
+    """
+    Get the users who lent or borrowed the most, from the lending totals.
+
+    Args:
+        role: 'lent' or 'borrowed'
+        limit: Number of users
+
+    Returns:
+        list: Users (id, username, loans_count or borrows_count), top first
+    """
+    column, alias = ('lent_count', 'loans_count') if role == 'lent' else ('borrowed_count', 'borrows_count')
+    return execute_query(
+        f"""SELECT u.id, u.username, s.{column} as {alias}
+            FROM user_lending_stats s
+            JOIN users u ON u.id = s.user_id
+            WHERE s.{column} > 0
+            ORDER BY s.{column} DESC
+            LIMIT %s""",
+        (limit,),
+        fetch=True
+    )
+
+
+def get_popular_items(item_type=None, limit=10):
+    """
+    Get the most borrowed items, from the per-item totals.
+
+    Args:
+        item_type: Only 'book' or 'boardgame' items, if given
+        limit: Number of items
+
+    Returns:
+        list: Items with loan count, average loan length and last loan time
+    """
+    query = f"""SELECT item_type, item_id, item_title, owner_id, last_loan_at,
+                       {', '.join(ITEM_COLUMNS)}
+                FROM item_loan_stats WHERE loan_count > 0"""
+    params = []
+    if item_type:
+        query += " AND item_type = %s"
+        params.append(item_type)
+    query += " ORDER BY loan_count DESC LIMIT %s"
+    params.append(limit)
+
+    items = execute_query(query, params, fetch=True)
+    for item in items:
+        item['avg_loan_days'] = _average(item['loan_days'], item['returned_count'])
+        item['last_loan_at'] = _sql_value(_as_datetime(item['last_loan_at']))
+    return items
+
+
+if settings.LOAN_HISTORY_ENABLED:
+    scheduler.add_job(
+        'loan-history',
+        backfill_loan_history,
+        settings.LOAN_HISTORY_BACKFILL_INTERVAL,
+        run_at_start=True,
+        exclusive=True
+    )
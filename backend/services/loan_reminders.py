@@ -0,0 +1,176 @@
+"""
+Loan reminders
+
+A scheduled job, run on one worker at a time, reminds borrowers of loans due
+back within LOAN_REMINDER_DAYS and tells both parties once a loan is
+overdue. Loans are read in batches with range scans of the
+(status, return_date) index on requests. The last return date covered by
+each kind of reminder is kept in job_state, so a run only looks at the days
+that came into range since the previous one, plus loans approved since then
+that are already due soon. Reminders are delivered in bulk and carry one
+event key per loan, so a repeated run never notifies twice.
+"""
+
+import logging
+from datetime import date, timedelta
+
+from config import settings
+from database import execute_query, db_timestamp
+from services.job_state import load_state, save_state
+from services.notifications import notification_dispatcher
+from services.scheduler import scheduler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'loan-reminders'
+
+# Lower bound for the first run, so every loan already overdue is covered
+EPOCH = '1970-01-01'
+
+
+def due_soon_notifications(loan):
+    """Reminder for the borrower of a loan due back soon"""
+    return [{
+        "user_id": loan['requester_id'],
+        "title": 'Return Reminder',
+        "message": f'"{loan["item_title"]}" is due back on {loan["return_date"]}.',
+        "type": 'info',
+        "email": True,
+        "created_at": db_timestamp(),
+        "event_key": f"loan-due-{loan['id']}"
+    }]
+
+
+def overdue_notifications(loan):
+    """Notices for the borrower and the owner of an overdue loan"""
+    return [{
+        "user_id": loan['requester_id'],
+        "title": 'Loan Overdue',
+        "message": f'"{loan["item_title"]}" was due back on {loan["return_date"]}. '
+                   f'Please return it to its owner.',
+        "type": 'warning',
+        "email": True,
+        "created_at": db_timestamp(),
+        "event_key": f"loan-overdue-{loan['id']}"
+    }, {
+        "user_id": loan['owner_id'],
+        "title": 'Loan Overdue',
+        "message": f'"{loan["item_title"]}" was due back on {loan["return_date"]} '
+                   f'and has not been marked as returned.',
+        "type": 'warning',
+        "email": False,
+        "created_at": db_timestamp(),
+        "event_key": f"loan-overdue-owner-{loan['id']}"
+    }]
+
+
+class LoanReminders:
+    """Scheduled job sending due-soon and overdue notifications"""
+
+    def __init__(self, days_ahead=None, batch_size=None):
+        self.days_ahead = settings.LOAN_REMINDER_DAYS if days_ahead is None else days_ahead
+        self.batch_size = batch_size or settings.LOAN_REMINDER_BATCH_SIZE
+        self.due_soon = 0
+        self.overdue = 0
+        self.last_state = {}
+
+    def _batches(self, start, through, condition, params):
+        """Approved loans with start <= return_date <= through matching condition, in batches"""
+        last = None
+        while True:
+            if last is None:
+                position, cursor = "1 = 1", []
+            else:
+                # Continue after the last loan of the previous batch
+                position = "(return_date > %s OR (return_date = %s AND id > %s))"
+                cursor = [last['return_date'], last['return_date'], last['id']]
+
+            rows = execute_query(
+                f"""SELECT id, requester_id, owner_id, item_title, return_date
+                    FROM requests
+                    WHERE status = 'approved' AND return_date >= %s AND return_date <= %s
+                    AND ({condition}) AND {position}
+                    ORDER BY return_date, id LIMIT %s""",
+                [start, through] + list(params) + cursor + [self.batch_size],
+                fetch=True
+            )
+            if not rows:
+                return
+            yield rows
+            if len(rows) < self.batch_size:
+                return
+            last = rows[-1]
+
+    def _remind(self, build, *query):
+        sent = 0
+        for loans in self._batches(*query):
+            notifications = []
+            for loan in loans:
+                loan['return_date'] = str(loan['return_date'])
+                loan['item_title'] = loan['item_title'] or 'Your borrowed item'
+                notifications.extend(build(loan))
+            # Durable sinks raise, so the state below is not advanced and the
+            # next run retries (the event keys keep it from notifying twice)
+            notification_dispatcher.deliver(notifications)
+            sent += len(loans)
+        return sent
+
+    def run(self):
+        """
+        Send the reminders for the days that came into range since the last run.
+
+        Returns:
+            int: Number of loans reminded about
+        """
+        started_at = db_timestamp()
+        today = date.today()
+        yesterday = (today - timedelta(days=1)).isoformat()
+        horizon = (today + timedelta(days=self.days_ahead)).isoformat()
+        state = load_state(JOB_NAME)
+
+        # Loans whose return date passed since the last run
+        overdue_through = state.get('overdue_through') or EPOCH
+        overdue = 0
+        if overdue_through < yesterday:
+            overdue = self._remind(overdue_notifications, overdue_through, yesterday,
+                                   "return_date > %s", [overdue_through])
+            state['overdue_through'] = yesterday
+
+        # Loans due back between today and the horizon: the days that came
+        # into range and the loans approved since the last run
+        due_through = state.get('due_through') or yesterday
+        approved_since = state.get('approved_since') or started_at
+        due_soon = 0
+        if self.days_ahead:
+            due_soon = self._remind(due_soon_notifications, today.isoformat(), horizon,
+                                    "return_date > %s OR response_date >= %s",
+                                    [due_through, approved_since])
+            state['due_through'] = horizon
+        state['approved_since'] = started_at
+        save_state(JOB_NAME, state)
+
+        self.overdue += overdue
+        self.due_soon += due_soon
+        self.last_state = state
+        if overdue or due_soon:
+            logger.info(f"Loan reminders: {due_soon} due soon, {overdue} overdue")
+        return overdue + due_soon
+
+    def stats(self):
+        return {
+            "due_soon": self.due_soon,
+            "overdue": self.overdue,
+            "state": self.last_state
+        }
+
+
+# Shared reminder job, run by one worker at a time
+loan_reminders = LoanReminders()
+scheduler.add_job(
+    JOB_NAME,
+    loan_reminders.run,
+    settings.LOAN_REMINDER_INTERVAL,
+    run_at_start=True,
+    exclusive=True
+)
@@ -0,0 +1,139 @@
+"""
+Per-user notification counters
+
+The notification badge reads total/unread counts from notification_counters
+instead of counting the inbox on every page load. Every write to the inbox
+adjusts the counters in the same transaction; a periodic reconciliation job
+recounts the users whose counters drifted (e.g. rows changed by hand).
+"""
+
+import logging
+
+from config import settings
+from database import DB_TYPE, INSERT_IGNORE, execute_query, execute_one, transaction
+from services.scheduler import scheduler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+if DB_TYPE == 'sqlite':
+    UPSERT_QUERY = """
+        INSERT INTO notification_counters (user_id, total, unread, updated_at)
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id) DO UPDATE SET
+            total = total + excluded.total,
+            unread = unread + excluded.unread,
+            updated_at = CURRENT_TIMESTAMP
+    """
+else:
+    UPSERT_QUERY = """
+        INSERT INTO notification_counters (user_id, total, unread)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            total = total + VALUES(total),
+            unread = unread + VALUES(unread)
+    """
+
+# Users with notifications but no counter row
+SEED_QUERY = f"""
+    {INSERT_IGNORE} INTO notification_counters (user_id, total, unread)
+    SELECT user_id, COUNT(*), SUM(CASE WHEN is_read = FALSE THEN 1 ELSE 0 END)
+    FROM notifications
+    WHERE user_id IS NOT NULL
+      AND user_id NOT IN (SELECT user_id FROM notification_counters)
+    GROUP BY user_id
+"""
+
+# Counter rows that disagree with the inbox
+DRIFT_QUERY = """
+    SELECT c.user_id
+    FROM notification_counters c
+    LEFT JOIN (
+        SELECT user_id, COUNT(*) as total,
+               SUM(CASE WHEN is_read = FALSE THEN 1 ELSE 0 END) as unread
+        FROM notifications
+        GROUP BY user_id
+    ) n ON n.user_id = c.user_id
+    WHERE c.total <> COALESCE(n.total, 0) OR c.unread <> COALESCE(n.unread, 0)
+"""
+
+RECOUNT_QUERY = """
+    UPDATE notification_counters SET
+        total = (SELECT COUNT(*) FROM notifications WHERE user_id = %s),
+        unread = (SELECT COUNT(*) FROM notifications WHERE user_id = %s AND is_read = FALSE)
+    WHERE user_id = %s
+"""
+
+
+def adjust_counters(tx, deltas):
+    """
+    Apply counter changes as part of the transaction that changed the inbox.
+
+    Args:
+        tx: Open Transaction from database.transaction()
+        deltas: Dict of user_id -> (total delta, unread delta)
+    """
+    rows = [
+        (user_id, total, unread)
+        for user_id, (total, unread) in deltas.items()
+        if user_id is not None and (total or unread)
+    ]
+    if rows:
+        tx.execute_many(UPSERT_QUERY, rows)
+
+
+def reset_counters(tx, user_id):
+    """Zero a user's counters after their whole inbox was deleted"""
+    tx.execute(
+        "UPDATE notification_counters SET total = 0, unread = 0 WHERE user_id = %s",
+        (user_id,)
+    )
+
+
+def get_counts(user_id):
+    """
+    Get a user's notification counts (one primary key lookup).
+
+    Returns:
+        dict: {"total": int, "unread": int}
+    """
+    row = execute_one(
+        "SELECT total, unread FROM notification_counters WHERE user_id = %s",
+        (user_id,)
+    )
+    if not row:
+        return {"total": 0, "unread": 0}
+    return {"total": max(row['total'], 0), "unread": max(row['unread'], 0)}
+
+
+def reconcile_counters():
+    """
+    Recount the counters that drifted from the inbox.
+
+    Returns:
+        int: Number of users whose counters were seeded or repaired
+    """
+    with transaction() as tx:
+        tx.execute(SEED_QUERY)
+        seeded = max(tx.cursor.rowcount, 0)
+
+    drifted = execute_query(DRIFT_QUERY, fetch=True)
+    for row in drifted:
+        user_id = row['user_id']
+        # Recount in a single statement so concurrent increments are not lost
+        execute_query(RECOUNT_QUERY, (user_id, user_id, user_id))
+
+    if seeded or drifted:
+        logger.warning(
+            f"Notification counters reconciled: {seeded} seeded, {len(drifted)} repaired"
+        )
+    return seeded + len(drifted)
+
+
+# Full-table scan, so only one worker reconciles per interval
+scheduler.add_job(
+    'notification-counters',
+    reconcile_counters,
+    settings.NOTIFICATION_COUNTER_RECONCILE_INTERVAL,
+    exclusive=True
+)
@@ -0,0 +1,47 @@
+"""
+Live notification streams
+
+Notifications delivered by the dispatcher's push sink are published on the
+event bus, so every worker hears about them, and each worker hands them to
+the recipient's open /api/notifications/stream connections through a
+StreamHub.
+"""
+
+import logging
+
+from config import settings
+from services.event_bus import event_bus
+from services.notifications import push_sink
+from services.stream_hub import StreamHub, RESYNC, CLOSE
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'notifications'
+
+# Fields of a notification sent to clients
+STREAM_FIELDS = ('id', 'title', 'message', 'type', 'created_at')
+
+
+class NotificationHub(StreamHub):
+    """StreamHub carrying notifications to their recipients"""
+
+    def __init__(self, max_queue=None, max_per_user=None):
+        super().__init__(
+            max_queue or settings.SSE_QUEUE_SIZE,
+            max_per_user or settings.SSE_MAX_CONNECTIONS_PER_USER,
+            name='notification-hub'
+        )
+
+    def publish(self, notifications):
+        """Fan notifications out to their recipients' streams (thread-safe)"""
+        for notification in notifications:
+            event = {field: notification.get(field) for field in STREAM_FIELDS}
+            event['is_read'] = False
+            self.send([notification['user_id']], event)
+
+
+# Shared hub, fed through the event bus by the notification dispatcher
+notification_hub = NotificationHub()
+push_sink.subscribe(lambda notifications: event_bus.publish(CHANNEL, notifications))
+event_bus.subscribe(CHANNEL, notification_hub.publish)
@@ -0,0 +1,329 @@
+"""
+Notification dispatch service
+
+Handlers call notify(), which deduplicates the event and queues it (async
+handlers await notify_async(), which waits for room in a full queue without
+blocking the event loop). A
+background dispatcher drains the queue in batches and fans each batch out
+to the registered sinks:
+
+- DatabaseInboxSink: batched insert into the notifications table (the inbox),
+  keeping the per-user unread/total counters in step
+- PushSink: in-process subscribers, e.g. live streams to connected clients
+- EmailSink: queues email for events flagged with email=True (when
+  EMAIL_ENABLED), sent by the background email worker
+
+Events for users who chose an hourly or daily digest are staged instead and
+summarized by the digest job (services.digests). A failing sink never
+blocks the others.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+
+from config import settings
+from database import transaction, db_timestamp, INSERT_IGNORE
+from services.buffered_writer import BufferedWriter
+from services.email_worker import enqueue_emails
+from services.digests import stage_digest_events
+from services.notification_counters import adjust_counters
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_TYPES = ('info', 'success', 'warning', 'error')
+
+
+class NotificationSink:
+    """Base class for notification delivery channels"""
+
+    name = 'sink'
+
+    # Retry a failed batch one notification at a time
+    retry_individually = True
+
+    # Failures are raised to outbox deliveries so the event is retried
+    durable = False
+
+    def deliver(self, notifications):
+        """
+        Deliver a batch of notifications.
+
+        Args:
+            notifications: List of notification dicts (user_id, title,
+                message, type, email, created_at, event_key; the inbox sink
+                adds the notification id)
+
+        Returns:
+            int: Number delivered, or None for all of them
+        """
+        raise NotImplementedError
+
+
+class DatabaseInboxSink(NotificationSink):
+    """Stores notifications in the user's inbox (notifications table)"""
+
+    name = 'inbox'
+    durable = True
+
+    def deliver(self, notifications):
+        keys = [n['event_key'] for n in notifications]
+        placeholders = ', '.join(['%s'] * len(keys))
+
+        with transaction() as tx:
+            # Events already in the inbox (redelivered outbox events) are
+            # skipped so they neither show up twice nor count twice
+            existing = {
+                row['event_key'] for row in tx.fetch_all(
+                    f"SELECT event_key FROM notifications WHERE event_key IN ({placeholders})",
+                    keys
+                )
+            }
+            new = [n for n in notifications if n['event_key'] not in existing]
+
+            if new:
+                tx.execute_many(
+                    f"""{INSERT_IGNORE} INTO notifications (user_id, title, message, type, created_at, event_key)
+                       VALUES (%s, %s, %s, %s, %s, %s)""",
+                    [(n['user_id'], n['title'], n['message'], n['type'], n['created_at'],
+                      n['event_key']) for n in new]
+                )
+                added = Counter(n['user_id'] for n in new)
+                adjust_counters(tx, {user_id: (count, count) for user_id, count in added.items()})
+
+            # Attach the inbox ids for the sinks that follow (stream event ids)
+            rows = tx.fetch_all(
+                f"SELECT id, event_key FROM notifications WHERE event_key IN ({placeholders})",
+                keys
+            )
+
+        ids = {row['event_key']: row['id'] for row in rows}
+        for n in notifications:
+            n['id'] = ids.get(n['event_key'])
+
+
+class PushSink(NotificationSink):
+    """Hands notifications to in-process subscribers"""
+
+    name = 'push'
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Register callback(notifications), called from the dispatcher thread"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def deliver(self, notifications):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(notifications)
+            except Exception as e:
+                logger.error(f"Push subscriber failed: {e}")
+
+
+class EmailSink(NotificationSink):
+    """Queues email for notifications flagged with email=True"""
+
+    name = 'email'
+
+    # Queueing is idempotent on event_key, so failed events are retried
+    durable = True
+
+    def __init__(self):
+        self.enabled = settings.EMAIL_ENABLED
+
+    def deliver(self, notifications):
+        pending = [n for n in notifications if n.get('email')]
+        if not self.enabled or not pending:
+            return 0
+        # The email worker sends them in the background
+        return enqueue_emails(pending)
+
+
+class NotificationDispatcher(BufferedWriter):
+    """
+    Deduplicating, batching fan-out of notification events to sinks.
+
+    Reuses the BufferedWriter queue (bounded, with backpressure) and replaces
+    the single INSERT with delivery to every sink.
+    """
+
+    # Trim the dedup map once it grows beyond this many keys
+    MAX_RECENT = 10000
+
+    def __init__(self, sinks=None, dedup_window=None, **kwargs):
+        kwargs.setdefault('max_batch', settings.NOTIFICATION_BATCH_SIZE)
+        kwargs.setdefault('flush_interval', settings.NOTIFICATION_FLUSH_INTERVAL)
+        kwargs.setdefault('max_queue', settings.NOTIFICATION_MAX_QUEUE)
+        kwargs.setdefault('name', 'notification-dispatcher')
+        super().__init__(None, **kwargs)
+        self.enabled = settings.ENABLE_NOTIFICATIONS
+        self.sinks = list(sinks or [])
+        self.dedup_window = (
+            settings.NOTIFICATION_DEDUP_WINDOW if dedup_window is None else dedup_window
+        )
+        self.deduplicated = 0
+        self._recent = {}
+        self._recent_lock = threading.Lock()
+        self._sink_stats = {sink.name: {"delivered": 0, "failed": 0} for sink in self.sinks}
+
+    def add_sink(self, sink):
+        """Register an additional delivery channel"""
+        self.sinks.append(sink)
+        self._sink_stats[sink.name] = {"delivered": 0, "failed": 0}
+
+    def _is_duplicate(self, key):
+        now = time.monotonic()
+        with self._recent_lock:
+            seen = self._recent.get(key)
+            if seen is not None and now - seen < self.dedup_window:
+                self.deduplicated += 1
+                return True
+            self._recent[key] = now
+            if len(self._recent) > self.MAX_RECENT:
+                cutoff = now - self.dedup_window
+                self._recent = {k: t for k, t in self._recent.items() if t >= cutoff}
+        return False
+
+    def notify(self, user_id, title, message, type='info', email=False):
+        """
+        Queue a notification for a user.
+
+        Identical events (same user, title, message and type) within the
+        dedup window are collapsed into one.
+
+        Args:
+            user_id: Recipient
+            title: Notification title
+            message: Notification body
+            type: One of info, success, warning, error
+            email: Also deliver through the email sink
+
+        Returns:
+            bool: False if the event was dropped (duplicate or queue full)
+        """
+        event = self._event(user_id, title, message, type, email)
+        return self._enqueue(event) if event else False
+
+    async def notify_async(self, user_id, title, message, type='info', email=False):
+        """Queue a notification for a user from a coroutine (see notify())"""
+        event = self._event(user_id, title, message, type, email)
+        return await self._enqueue_async(event) if event else False
+
+    def _event(self, user_id, title, message, type, email):
+        """Build the queued event, or None if it is disabled or a duplicate"""
+        if not self.enabled or not user_id:
+            return None
+
+        if type not in NOTIFICATION_TYPES:
+            type = 'info'
+
+        if self.dedup_window and self._is_duplicate((user_id, title, message, type)):
+            return None
+
+        return {
+            "user_id": user_id,
+            "title": title,
+            "message": message,
+            "type": type,
+            "email": email,
+            "created_at": db_timestamp(),
+            "event_key": uuid.uuid4().hex
+        }
+
+    def _write_batch(self, rows):
+        try:
+            rows = stage_digest_events(rows)
+        except Exception as e:
+            logger.error(f"Digest staging failed, delivering {len(rows)} notifications now: {e}")
+        if not rows:
+            return
+
+        for sink in self.sinks:
+            stats = self._sink_stats[sink.name]
+            try:
+                delivered = sink.deliver(rows)
+                stats["delivered"] += len(rows) if delivered is None else delivered
+                continue
+            except Exception as e:
+                if not sink.retry_individually:
+                    stats["failed"] += len(rows)
+                    logger.error(f"{sink.name} sink: batch of {len(rows)} failed: {e}")
+                    continue
+                logger.warning(f"{sink.name} sink: batch of {len(rows)} failed, retrying one by one: {e}")
+
+            # Isolate the bad events so one failure does not drop the batch
+            for row in rows:
+                try:
+                    delivered = sink.deliver([row])
+                    stats["delivered"] += 1 if delivered is None else delivered
+                except Exception as e:
+                    stats["failed"] += 1
+                    logger.error(f"{sink.name} sink: dropping notification for user {row['user_id']}: {e}")
+
+        self.written += len(rows)
+
+    def deliver(self, events):
+        """
+        Deliver events synchronously, bypassing the queue and dedup window.
+
+        Used by the outbox relay: durable sinks raise so the events are
+        retried (they are idempotent on event_key), the others are best effort.
+        """
+        if not self.enabled:
+            return
+
+        events = stage_digest_events(events)
+        if not events:
+            return
+
+        for sink in self.sinks:
+            stats = self._sink_stats[sink.name]
+            try:
+                delivered = sink.deliver(events)
+                stats["delivered"] += len(events) if delivered is None else delivered
+            except Exception as e:
+                stats["failed"] += len(events)
+                if sink.durable:
+                    raise
+                logger.error(f"{sink.name} sink: batch of {len(events)} failed: {e}")
+
+    def stats(self):
+        stats = super().stats()
+        stats["deduplicated"] = self.deduplicated
+        stats["sinks"] = {name: dict(counts) for name, counts in self._sink_stats.items()}
+        return stats
+
+    def shutdown(self):
+        """Stop the dispatcher after delivering everything queued"""
+        self.stop()
+
+
+# Shared sinks and dispatcher
+push_sink = PushSink()
+notification_dispatcher = NotificationDispatcher(
+    sinks=[DatabaseInboxSink(), push_sink, EmailSink()]
+)
+
+
+def notify(user_id, title, message, type='info', email=False):
+    """Queue a notification on the shared dispatcher"""
+    return notification_dispatcher.notify(user_id, title, message, type, email)
+
+
+async def notify_async(user_id, title, message, type='info', email=False):
+    """Queue a notification on the shared dispatcher from a coroutine"""
+    return await notification_dispatcher.notify_async(user_id, title, message, type, email)
@@ -0,0 +1,292 @@
+"""
+Transactional outbox
+
+Side effects of a business write (notifications, activity log entries) are
+stored as outbox rows in the same database transaction as the write, so they
+are committed or rolled back together with it. OutboxRelay drains the table
+in batches in the background and hands each event to the consumer registered
+for its type.
+
+Delivery is at least once: if a worker dies after delivering a batch but
+before marking it done, the claim expires and the batch is replayed. Consumers
+are idempotent on the event_key stored with each row.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from config import settings
+from database import execute_query, execute_one, db_timestamp
+from services.activity_logger import activity_logger
+from services.notifications import notification_dispatcher, NOTIFICATION_TYPES
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+EVENT_NOTIFICATION = 'notification'
+EVENT_ACTIVITY = 'activity'
+
+# Upper bound for the retry backoff (seconds)
+MAX_BACKOFF = 300
+
+# Seconds between purges of delivered events
+PURGE_INTERVAL = 3600
+
+
+def add_events(tx, events):
+    """
+    Record events in the outbox as part of a transaction, in one batched insert.
+
+    Args:
+        tx: Open Transaction from database.transaction()
+        events: Iterable of (event_type, payload); event_type is the consumer
+            to deliver to (EVENT_NOTIFICATION, EVENT_ACTIVITY), payload a
+            JSON-serializable dict
+
+    Returns:
+        list: The event keys consumers use to skip duplicates
+    """
+    now = db_timestamp()
+    rows = [
+        (uuid.uuid4().hex, event_type, json.dumps(payload, default=str), now)
+        for event_type, payload in events
+    ]
+    if not rows:
+        return []
+    tx.execute_many(
+        """INSERT INTO outbox (event_key, event_type, payload, available_at)
+           VALUES (%s, %s, %s, %s)""",
+        rows
+    )
+    tx.on_commit(outbox_relay.wake)
+    return [row[0] for row in rows]
+
+
+def add_event(tx, event_type, payload):
+    """Record one event in the outbox as part of a transaction"""
+    return add_events(tx, [(event_type, payload)])[0]
+
+
+def notification_event(user_id, title, message, type='info', email=False):
+    """Outbox event for a notification, for add_events()"""
+    return EVENT_NOTIFICATION, {
+        "user_id": user_id,
+        "title": title,
+        "message": message,
+        "type": type if type in NOTIFICATION_TYPES else 'info',
+        "email": email,
+        "created_at": db_timestamp()
+    }
+
+
+def activity_event(user_id, action, item_type=None, item_id=None, details=None):
+    """Outbox event for an activity log entry, for add_events()"""
+    return EVENT_ACTIVITY, {
+        "user_id": user_id,
+        "action": action,
+        "item_type": item_type,
+        "item_id": item_id,
+        "details": details
+    }
+
+
+def add_notification(tx, user_id, title, message, type='info', email=False):
+    """Record a notification for delivery once the transaction commits"""
+    return add_event(tx, *notification_event(user_id, title, message, type, email))
+
+
+def add_activity(tx, user_id, action, item_type=None, item_id=None, details=None):
+    """Record an activity log entry for delivery once the transaction commits"""
+    return add_event(tx, *activity_event(user_id, action, item_type, item_id, details))
+
+
+class OutboxRelay:
+    """Background worker delivering outbox events to their consumers"""
+
+    def __init__(self, batch_size=None, poll_interval=None, lease_seconds=None,
+                 max_attempts=None):
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.poll_interval = poll_interval or settings.OUTBOX_POLL_INTERVAL
+        self.lease_seconds = lease_seconds or settings.OUTBOX_LEASE_SECONDS
+        self.max_attempts = max_attempts or settings.OUTBOX_MAX_ATTEMPTS
+        self._handlers = {}
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._last_purge = time.monotonic()
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+
+    def register(self, event_type, handler):
+        """Register handler(events) for an event type; it must raise on failure"""
+        self._handlers[event_type] = handler
+
+    def start(self):
+        """Start the relay thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='outbox-relay', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        """Deliver new events now instead of at the next poll"""
+        self._wake.set()
+
+    def stop(self):
+        """Stop the relay thread after delivering what is ready"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._stopping.set()
+            self._wake.set()
+            thread.join(timeout=10)
+        self.drain()
+
+    def drain(self):
+        """Relay batches until no ready events are left"""
+        while self.relay_batch() == self.batch_size:
+            pass
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                self.drain()
+                if time.monotonic() - self._last_purge > PURGE_INTERVAL:
+                    self._last_purge = time.monotonic()
+                    self.purge()
+            except Exception as e:
+                logger.error(f"Outbox relay error: {e}")
+
+    def relay_batch(self):
+        """
+        Claim and deliver one batch of ready events.
+
+        Returns:
+            int: Number of events that were ready
+        """
+        now = datetime.utcnow()
+        ready = execute_query(
+            """SELECT id FROM outbox
+               WHERE status = 'pending' AND available_at <= %s
+               ORDER BY id LIMIT %s""",
+            (db_timestamp(now), self.batch_size),
+            fetch=True
+        )
+        if not ready:
+            return 0
+
+        # Claim the rows so other workers skip them until the lease expires
+        claim_token = uuid.uuid4().hex
+        ids = [row['id'] for row in ready]
+        placeholders = ', '.join(['%s'] * len(ids))
+        execute_query(
+            f"""UPDATE outbox
+                SET claim_token = %s, available_at = %s, attempts = attempts + 1
+                WHERE id IN ({placeholders}) AND status = 'pending' AND available_at <= %s""",
+            [claim_token, db_timestamp(now + timedelta(seconds=self.lease_seconds))]
+            + ids + [db_timestamp(now)]
+        )
+        rows = execute_query(
+            """SELECT id, event_key, event_type, payload, attempts FROM outbox
+               WHERE claim_token = %s ORDER BY id""",
+            (claim_token,),
+            fetch=True
+        )
+
+        by_type = {}
+        for row in rows:
+            by_type.setdefault(row['event_type'], []).append(row)
+
+        for event_type, group in by_type.items():
+            handler = self._handlers.get(event_type)
+            if handler is None:
+                self._fail(group, f"No consumer for event type {event_type}", permanent=True)
+                continue
+
+            events = []
+            for row in group:
+                payload = row['payload']
+                event = json.loads(payload) if isinstance(payload, str) else dict(payload)
+                event['event_key'] = row['event_key']
+                events.append(event)
+
+            try:
+                handler(events)
+            except Exception as e:
+                logger.warning(f"Outbox delivery of {len(group)} {event_type} events failed: {e}")
+                self._fail(group, str(e))
+                continue
+
+            self._complete(group)
+
+        return len(ready)
+
+    def _complete(self, rows):
+        ids = [row['id'] for row in rows]
+        placeholders = ', '.join(['%s'] * len(ids))
+        execute_query(
+            f"""UPDATE outbox SET status = 'done', processed_at = %s, claim_token = NULL
+                WHERE id IN ({placeholders})""",
+            [db_timestamp()] + ids
+        )
+        self.delivered += len(rows)
+
+    def _fail(self, rows, error, permanent=False):
+        now = datetime.utcnow()
+        for row in rows:
+            if permanent or row['attempts'] >= self.max_attempts:
+                execute_query(
+                    """UPDATE outbox SET status = 'failed', last_error = %s, claim_token = NULL
+                       WHERE id = %s""",
+                    (error[:1000], row['id'])
+                )
+                self.failed += 1
+                logger.error(f"Outbox event {row['event_key']} failed permanently: {error}")
+            else:
+                backoff = min(2 ** row['attempts'], MAX_BACKOFF)
+                execute_query(
+                    """UPDATE outbox SET available_at = %s, last_error = %s, claim_token = NULL
+                       WHERE id = %s""",
+                    (db_timestamp(now + timedelta(seconds=backoff)), error[:1000], row['id'])
+                )
+                self.retried += 1
+
+    def purge(self):
+        """Delete delivered events older than the retention period"""
+        cutoff = datetime.utcnow() - timedelta(hours=settings.OUTBOX_RETENTION_HOURS)
+        deleted = execute_query(
+            "DELETE FROM outbox WHERE status = 'done' AND processed_at < %s",
+            (db_timestamp(cutoff),)
+        )
+        if deleted:
+            logger.info(f"Purged {deleted} delivered outbox events")
+
+    def stats(self):
+        """Delivery counters and the current backlog"""
+        try:
+            backlog = execute_one(
+                "SELECT COUNT(*) as count FROM outbox WHERE status = 'pending'"
+            )['count']
+        except Exception:
+            backlog = None
+        return {
+            "pending": backlog,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+
+
+# Shared relay instance with the built-in consumers
+outbox_relay = OutboxRelay()
+outbox_relay.register(EVENT_NOTIFICATION, notification_dispatcher.deliver)
+outbox_relay.register(EVENT_ACTIVITY, activity_logger.record)
@@ -0,0 +1,198 @@
+"""
+Per-user request counters
+
+The request statistics on the dashboard read one row of request_counters
+(sent/received counts per status) instead of counting the requests table.
+Every status transition adjusts the counters of the requester and the owner
+in the same transaction. A reconciliation job, run at startup and then
+periodically, seeds missing rows and recounts drifted ones. Without a
+counter row (or with REQUEST_COUNTERS_ENABLED=false) the statistics come
+from a single conditional-aggregation query instead.
+"""
+
+import logging
+from collections import defaultdict
+
+from config import settings
+from database import DB_TYPE, INSERT_IGNORE, execute_query, execute_one, transaction
+from services.scheduler import scheduler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+STATUSES = ('pending', 'approved', 'rejected', 'returned')
+
+# Counter column -> (column matching the user, status)
+COLUMNS = {
+    f"{role}_{status}": (user_column, status)
+    for role, user_column in (('sent', 'requester_id'), ('received', 'owner_id'))
+    for status in STATUSES
+}
+
+_names = ', '.join(COLUMNS)
+_values = ', '.join(['%s'] * len(COLUMNS))
+
+
+def _tally(user_column):
+    """Select list counting one request per matching counter column"""
+    return ', '.join(
+        f"CASE WHEN status = '{status}' THEN 1 ELSE 0 END as {column}"
+        if column_user == user_column else f"0 as {column}"
+        for column, (column_user, status) in COLUMNS.items()
+    )
+
+
+if DB_TYPE == 'sqlite':
+    _increments = ', '.join(f"{c} = {c} + excluded.{c}" for c in COLUMNS)
+    UPSERT_QUERY = f"""
+        INSERT INTO request_counters (user_id, {_names}, updated_at)
+        VALUES (%s, {_values}, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id) DO UPDATE SET
+            {_increments},
+            updated_at = CURRENT_TIMESTAMP
+    """
+else:
+    _increments = ', '.join(f"{c} = {c} + VALUES({c})" for c in COLUMNS)
+    UPSERT_QUERY = f"""
+        INSERT INTO request_counters (user_id, {_names})
+        VALUES (%s, {_values})
+        ON DUPLICATE KEY UPDATE {_increments}
+    """
+
+# Counts per status for one user, answered from the (requester_id, status)
+# and (owner_id, status) indexes; takes the user id once per counter column
+# and twice for the WHERE clause
+STATS_QUERY = "SELECT " + ', '.join(
+    f"SUM(CASE WHEN {user_column} = %s AND status = '{status}' THEN 1 ELSE 0 END) as {column}"
+    for column, (user_column, status) in COLUMNS.items()
+) + " FROM requests WHERE requester_id = %s OR owner_id = %s"
+
+# Counts per user and column for everyone who sent or received a request
+TALLY_QUERY = f"""
+    SELECT user_id, {', '.join(f"SUM({c}) as {c}" for c in COLUMNS)}
+    FROM (
+        SELECT requester_id as user_id, {_tally('requester_id')} FROM requests
+        UNION ALL
+        SELECT owner_id as user_id, {_tally('owner_id')} FROM requests
+    ) t
+    GROUP BY user_id
+"""
+
+# Users with requests but no counter row
+MISSING_QUERY = """
+    SELECT user_id FROM (
+        SELECT requester_id as user_id FROM requests
+        UNION
+        SELECT owner_id as user_id FROM requests
+    ) u
+    WHERE user_id NOT IN (SELECT user_id FROM request_counters)
+"""
+
+# Counter rows that disagree with the requests table
+DRIFT_QUERY = f"""
+    SELECT c.user_id
+    FROM request_counters c
+    LEFT JOIN ({TALLY_QUERY}) n ON n.user_id = c.user_id
+    WHERE {' OR '.join(f"c.{c} <> COALESCE(n.{c}, 0)" for c in COLUMNS)}
+"""
+
+# One statement, so increments committed meanwhile are not lost; takes the
+# user id once per counter column and once for the WHERE clause
+RECOUNT_QUERY = "UPDATE request_counters SET " + ', '.join(
+    f"{column} = (SELECT COUNT(*) FROM requests WHERE {user_column} = %s AND status = '{status}')"
+    for column, (user_column, status) in COLUMNS.items()
+) + " WHERE user_id = %s"
+
+
+def adjust_request_counters(tx, transitions):
+    """
+    Apply request status changes to the counters of both parties.
+
+    Args:
+        tx: Open Transaction from database.transaction()
+        transitions: Iterable of (requester_id, owner_id, from_status, to_status);
+            from_status is None for a new request, to_status None for a deleted one
+    """
+    if not settings.REQUEST_COUNTERS_ENABLED:
+        return
+
+    deltas = defaultdict(lambda: dict.fromkeys(COLUMNS, 0))
+    for requester_id, owner_id, from_status, to_status in transitions:
+        for role, user_id in (('sent', requester_id), ('received', owner_id)):
+            if from_status:
+                deltas[user_id][f"{role}_{from_status}"] -= 1
+            if to_status:
+                deltas[user_id][f"{role}_{to_status}"] += 1
+
+    rows = [
+        (user_id, *columns.values())
+        for user_id, columns in deltas.items()
+        if user_id is not None and any(columns.values())
+    ]
+    if rows:
+        tx.execute_many(UPSERT_QUERY, rows)
+
+
+def _format_stats(row):
+    stats = {}
+    for role in ('sent', 'received'):
+        counts = {status: max(int(row[f"{role}_{status}"] or 0), 0) for status in STATUSES}
+        stats[role] = {"total": sum(counts.values()), **counts}
+    return stats
+
+
+def get_request_counts(user_id):
+    """
+    Get a user's sent and received request counts per status.
+
+    Returns:
+        dict: {"sent": {...}, "received": {...}}, each with total and per-status counts
+    """
+    if settings.REQUEST_COUNTERS_ENABLED:
+        row = execute_one(
+            f"SELECT {_names} FROM request_counters WHERE user_id = %s",
+            (user_id,)
+        )
+        if row:
+            return _format_stats(row)
+
+    row = execute_one(STATS_QUERY, [user_id] * (len(COLUMNS) + 2))
+    return _format_stats(row)
+
+
+def reconcile_request_counters():
+    """
+    Seed missing counter rows and recount the ones that drifted.
+
+    Returns:
+        int: Number of users whose counters were seeded or repaired
+    """
+    missing = execute_query(MISSING_QUERY, fetch=True)
+    if missing:
+        # Start from zero and recount below, like any drifted row
+        with transaction() as tx:
+            tx.execute_many(
+                f"{INSERT_IGNORE} INTO request_counters (user_id) VALUES (%s)",
+                [(row['user_id'],) for row in missing]
+            )
+
+    drifted = execute_query(DRIFT_QUERY, fetch=True)
+    for row in drifted:
+        user_id = row['user_id']
+        execute_query(RECOUNT_QUERY, [user_id] * (len(COLUMNS) + 1))
+
+    if drifted:
+        logger.warning(
+            f"Request counters reconciled: {len(missing)} seeded, {len(drifted)} recounted"
+        )
+    return len(drifted)
+
+
+if settings.REQUEST_COUNTERS_ENABLED:
+    scheduler.add_job(
+        'request-counters',
+        reconcile_request_counters,
+        settings.REQUEST_COUNTER_RECONCILE_INTERVAL,
+        run_at_start=True,
+        exclusive=True
+    )
@@ -0,0 +1,86 @@
+"""
+Request lifecycle events
+
+Handlers publish a snapshot of every request whose status changed once
+their transaction commits. The event bus carries it to every worker and the
+RequestEventHub pushes it to the WebSocket connections of the requester and
+the owner, so clients update the row in place instead of refetching lists.
+"""
+
+import logging
+
+from config import settings
+from services.event_bus import event_bus
+from services.stream_hub import StreamHub
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'requests'
+
+EVENT_TYPES = ('created', 'approved', 'rejected', 'cancelled', 'returned')
+
+# Same columns as the request list (minus contact details)
+SNAPSHOT_QUERY = """
+    SELECT r.id, r.item_type, r.item_id, r.requester_id, r.owner_id, r.status,
+           r.request_date, r.response_date, r.pickup_date, r.return_date, r.notes,
+           r.item_title, r.item_creator, r.item_image, r.version,
+           u1.username as requester_name,
+           u2.username as owner_name
+    FROM requests r
+    JOIN users u1 ON r.requester_id = u1.id
+    JOIN users u2 ON r.owner_id = u2.id
+    WHERE r.id IN ({placeholders})
+"""
+
+
+def _serialize(row):
+    """Make a request row JSON-safe (MySQL returns date objects, SQLite strings)"""
+    return {
+        key: value.isoformat() if hasattr(value, 'isoformat') else value
+        for key, value in row.items()
+    }
+
+
+def publish_request_events(tx, request_ids, event_type, actor_id):
+    """
+    Publish lifecycle events for requests once the transaction commits.
+
+    Args:
+        tx: Open Transaction that changed the requests
+        request_ids: IDs of the affected requests
+        event_type: One of EVENT_TYPES
+        actor_id: User who performed the action
+    """
+    if not request_ids:
+        return
+
+    placeholders = ', '.join(['%s'] * len(request_ids))
+    rows = tx.fetch_all(SNAPSHOT_QUERY.format(placeholders=placeholders), list(request_ids))
+    events = [
+        {"event": f"request.{event_type}", "actor_id": actor_id, "data": _serialize(row)}
+        for row in rows
+    ]
+    tx.on_commit(lambda: event_bus.publish(CHANNEL, events))
+
+
+class RequestEventHub(StreamHub):
+    """StreamHub carrying request events to the two users involved"""
+
+    def __init__(self, max_queue=None, max_per_user=None):
+        super().__init__(
+            max_queue or settings.WS_QUEUE_SIZE,
+            max_per_user or settings.WS_MAX_CONNECTIONS_PER_USER,
+            name='request-event-hub'
+        )
+
+    def publish(self, events):
+        """Fan events out to the requester's and owner's connections (thread-safe)"""
+        for event in events:
+            data = event['data']
+            self.send([data['requester_id'], data['owner_id']], event)
+
+
+# Shared hub, fed through the event bus
+request_event_hub = RequestEventHub()
+event_bus.subscribe(CHANNEL, request_event_hub.publish)
@@ -0,0 +1,186 @@
+"""
+Reservation calendar
+
+An item's calendar is the date ranges of its approved requests. Ranges are
+half-open, [pickup_date, return_date), so a loan may start on the day the
+previous one is returned. Returned requests drop out of the calendar.
+
+Overlap checks are answered from the (item_type, item_id, status) index on
+requests, which holds only the few current loans per item, so checking one
+item or filtering a catalog page by free dates costs one index lookup per
+item rather than a scan of the request history.
+
+is_available reflects today: an approved loan only makes its item
+unavailable once its pickup day arrives, so an item booked for later stays
+listed (and bookable for other dates) until then. Approvals and returns
+apply this for loans starting today; start_due_loans catches up items whose
+booked pickup day has come since.
+"""
+
+import logging
+from datetime import date
+
+from database import execute_query, transaction
+from services.scheduler import scheduler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Requests of an item overlapping a date range;
+# params: item_type, item_id, end, start
+OVERLAP_CONDITION = "item_type = %s AND item_id = %s AND pickup_date < %s AND return_date > %s"
+
+# Approved loans overlapping a date range (same params)
+CONFLICT_CONDITION = f"{OVERLAP_CONDITION} AND status = 'approved'"
+
+# Seconds between checks for loans whose pickup day has come
+PICKUP_CHECK_INTERVAL = 3600
+
+# Table holding each item type
+ITEM_TABLES = {'book': 'books', 'boardgame': 'board_games'}
+
+
+def find_conflicts(item_type, item_id, start, end, exclude_id=None, tx=None):
+    """
+    Find the approved loans of an item that overlap a date range.
+
+    Args:
+        item_type: 'book' or 'boardgame'
+        item_id: Item to check
+        start: First day of the range (YYYY-MM-DD)
+        end: Day the item comes back (YYYY-MM-DD, exclusive)
+        exclude_id: Request to leave out (the one being approved or edited)
+        tx: Open Transaction to read through, if any
+
+    Returns:
+        list: Conflicting requests (id, pickup_date, return_date)
+    """
+    query = f"SELECT id, pickup_date, return_date FROM requests WHERE {CONFLICT_CONDITION}"
+    params = [item_type, item_id, end, start]
+    if exclude_id is not None:
+        query += " AND id != %s"
+        params.append(exclude_id)
+    query += " ORDER BY pickup_date"
+
+    if tx is not None:
+        return tx.fetch_all(query, params)
+    return execute_query(query, params, fetch=True)
+
+
+def get_calendar(item_type, item_id, start=None, end=None):
+    """
+    Get an item's booked date ranges.
+
+    Args:
+        item_type: 'book' or 'boardgame'
+        item_id: Item to look up
+        start: Only ranges ending after this day
+        end: Only ranges starting before this day
+
+    Returns:
+        list: Approved requests (id, pickup_date, return_date), earliest first
+    """
+    query = """SELECT id, pickup_date, return_date FROM requests
+               WHERE item_type = %s AND item_id = %s AND status = 'approved'"""
+    params = [item_type, item_id]
+    if start:
+        query += " AND return_date > %s"
+        params.append(start)
+    if end:
+        query += " AND pickup_date < %s"
+        params.append(end)
+    query += " ORDER BY pickup_date"
+    return execute_query(query, params, fetch=True)
+
+
+def free_condition(item_type, alias):
+    """
+    SQL condition matching catalog rows with no loan in a date range.
+
+    Args:
+        item_type: 'book' or 'boardgame'
+        alias: Alias of the item table in the outer query
+
+    Returns:
+        str: Condition taking the range end and start as parameters
+    """
+    return f"""NOT EXISTS (
+        SELECT 1 FROM requests rv
+        WHERE rv.item_type = '{item_type}' AND rv.item_id = {alias}.id
+        AND rv.status = 'approved' AND rv.pickup_date < %s AND rv.return_date > %s
+    )"""
+
+
+def bookable_condition(item_type, alias, exclude_count=0):
+    """
+    SQL condition matching items that can take reservations.
+
+    An item is unavailable either because its owner unlisted it or because it
+    has approved loans; only the latter can still be booked for free dates.
+
+    Args:
+        item_type: 'book' or 'boardgame'
+        alias: Alias (or name) of the item table in the outer query
+        exclude_count: Number of request id parameters to ignore (the ones
+            being approved)
+
+    Returns:
+        str: SQL condition
+    """
+    exclude = f" AND rv.id NOT IN ({', '.join(['%s'] * exclude_count)})" if exclude_count else ""
+    return f"""({alias}.is_available = TRUE OR EXISTS (
+        SELECT 1 FROM requests rv
+        WHERE rv.item_type = '{item_type}' AND rv.item_id = {alias}.id
+        AND rv.status = 'approved'{exclude}
+    ))"""
+
+
+def lent_condition(item_type, alias):
+    """
+    SQL condition matching items out on a loan that has started.
+
+    Approved loans stay approved until the owner marks them returned, so an
+    overdue loan still counts.
+
+    Args:
+        item_type: 'book' or 'boardgame'
+        alias: Alias (or name) of the item table in the outer query
+
+    Returns:
+        str: Condition taking today (YYYY-MM-DD) as parameter
+    """
+    return f"""EXISTS (
+        SELECT 1 FROM requests rl
+        WHERE rl.item_type = '{item_type}' AND rl.item_id = {alias}.id
+        AND rl.status = 'approved' AND rl.pickup_date <= %s
+    )"""
+
+
+def start_due_loans():
+    """
+    Mark items unavailable once the pickup day of an approved loan arrives.
+
+    Returns:
+        int: Number of items lent out
+    """
+    today = date.today().isoformat()
+    lent = 0
+    with transaction() as tx:
+        for item_type, table in ITEM_TABLES.items():
+            lent += tx.execute(
+                f"""UPDATE {table} SET is_available = FALSE
+                    WHERE is_available = TRUE AND {lent_condition(item_type, table)}""",
+                (today,)
+            )
+    if lent:
+        logger.info(f"Lent out {lent} items whose pickup day has come")
+    return lent
+
+
+scheduler.add_job(
+    'loan-pickups',
+    start_due_loans,
+    PICKUP_CHECK_INTERVAL,
+    run_at_start=True,
+    exclusive=True
+)
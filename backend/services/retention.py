@@ -0,0 +1,157 @@
+"""
+Notification retention
+
+Read notifications older than NOTIFICATION_RETENTION_DAYS are appended to a
+gzipped NDJSON archive (one file per day) and deleted. Work is done in small
+batches, each in its own short transaction with a pause in between, so the
+job never holds the write lock for long. On SQLite the freed pages are then
+returned to the filesystem with an incremental vacuum. The job runs on one
+worker at a time, so workers never archive the same rows into the same file.
+"""
+
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from config import settings
+from database import execute_query, transaction, db_timestamp, incremental_vacuum
+from services.notification_counters import adjust_counters
+from services.scheduler import scheduler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLUMNS = 'id, user_id, title, message, type, is_read, created_at, event_key'
+
+
+class NotificationRetention:
+    """Archives and deletes read notifications past their TTL"""
+
+    def __init__(self, retention_days=None, batch_size=None, archive_dir=None, pause=None):
+        self.retention_days = (
+            settings.NOTIFICATION_RETENTION_DAYS if retention_days is None else retention_days
+        )
+        self.batch_size = batch_size or settings.NOTIFICATION_RETENTION_BATCH_SIZE
+        self.archive_dir = (
+            settings.NOTIFICATION_ARCHIVE_DIR if archive_dir is None else archive_dir
+        )
+        self.pause = settings.NOTIFICATION_RETENTION_PAUSE if pause is None else pause
+        self.archived = 0
+        self.deleted = 0
+        self.vacuumed_pages = 0
+
+    def archive_path(self, day=None):
+        """Archive file for a UTC day"""
+        day = day or datetime.utcnow()
+        return os.path.join(self.archive_dir, f"notifications-{day:%Y%m%d}.ndjson.gz")
+
+    def _archive(self, path, rows):
+        # Each batch is written as its own gzip member; concatenated members
+        # read back as one stream
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            for row in rows:
+                row['is_read'] = bool(row['is_read'])
+                archive.write(json.dumps(row, default=str) + '\n')
+
+    def _purge(self, ids, path):
+        """Delete the candidates that are still read and archive exactly those"""
+        placeholders = ', '.join(['%s'] * len(ids))
+
+        with transaction() as tx:
+            # Lock the rows first, so none is marked unread or removed between
+            # reading them back and deleting them
+            tx.execute(
+                f"""UPDATE notifications SET is_read = TRUE
+                    WHERE id IN ({placeholders}) AND is_read = TRUE""",
+                ids
+            )
+            rows = tx.fetch_all(
+                f"""SELECT {ARCHIVE_COLUMNS} FROM notifications
+                    WHERE id IN ({placeholders}) AND is_read = TRUE
+                    ORDER BY id""",
+                ids
+            )
+            if not rows:
+                return 0
+
+            deleted_ids = [row['id'] for row in rows]
+            tx.execute(
+                f"DELETE FROM notifications WHERE id IN ({', '.join(['%s'] * len(deleted_ids))})",
+                deleted_ids
+            )
+            by_user = defaultdict(int)
+            for row in rows:
+                by_user[row['user_id']] += 1
+            adjust_counters(tx, {user_id: (-count, 0) for user_id, count in by_user.items()})
+
+            # Written last, so a failed delete leaves nothing archived; only a
+            # failing commit can still leave rows to be archived again
+            if path:
+                self._archive(path, rows)
+
+        if path:
+            self.archived += len(rows)
+        self.deleted += len(rows)
+        return len(rows)
+
+    def run(self):
+        """
+        Archive and delete expired read notifications.
+
+        Returns:
+            int: Number of notifications deleted
+        """
+        if not self.retention_days:
+            return 0
+
+        cutoff = db_timestamp(datetime.utcnow() - timedelta(days=self.retention_days))
+        path = self.archive_path() if self.archive_dir else None
+        last_id = 0
+        deleted = 0
+
+        while True:
+            candidates = execute_query(
+                """SELECT id FROM notifications
+                   WHERE is_read = TRUE AND created_at < %s AND id > %s
+                   ORDER BY id LIMIT %s""",
+                (cutoff, last_id, self.batch_size),
+                fetch=True
+            )
+            if not candidates:
+                break
+
+            deleted += self._purge([row['id'] for row in candidates], path)
+            last_id = candidates[-1]['id']
+
+            if len(candidates) < self.batch_size:
+                break
+            # Let other writers in between batches
+            time.sleep(self.pause)
+
+        if deleted:
+            freed = incremental_vacuum(settings.SQLITE_VACUUM_PAGES)
+            self.vacuumed_pages += freed
+            logger.info(f"Notification retention removed {deleted} rows, released {freed} pages")
+        return deleted
+
+    def stats(self):
+        return {
+            "archived": self.archived,
+            "deleted": self.deleted,
+            "vacuumed_pages": self.vacuumed_pages
+        }
+
+
+# Shared retention job, run by one worker at a time
+notification_retention = NotificationRetention()
+scheduler.add_job(
+    'notification-retention',
+    notification_retention.run,
+    settings.NOTIFICATION_RETENTION_INTERVAL,
+    exclusive=True
+)
@@ -0,0 +1,146 @@
+"""
+Periodic background jobs
+
+Maintenance tasks (reconciliation, cleanup) register with the shared
+scheduler, which runs them one at a time on a single thread started and
+stopped with the app. A failing job is logged and retried at its next run.
+Exclusive jobs run on one worker at a time: the others skip them while a
+live worker holds the job's lease.
+"""
+
+import logging
+import threading
+import time
+
+from services.job_state import acquire_lease, release_lease
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A function run every interval seconds"""
+
+    def __init__(self, name, func, interval, run_at_start=False, exclusive=False):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.exclusive = exclusive
+        self.next_run = time.monotonic() + (0 if run_at_start else interval)
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_duration = None
+
+
+class Scheduler:
+    """Runs registered jobs on a background thread"""
+
+    def __init__(self, name='scheduler'):
+        self.name = name
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add_job(self, name, func, interval, run_at_start=False, exclusive=False):
+        """
+        Register func() to run every interval seconds.
+
+        Args:
+            name: Unique job name
+            func: Callable taking no arguments
+            interval: Seconds between runs; jobs with no interval are skipped
+            run_at_start: Run once as soon as the scheduler starts
+            exclusive: Run on only one worker at a time (leader election
+                through a lease renewed on every run)
+        """
+        if not interval or interval <= 0:
+            logger.info(f"Job {name} disabled")
+            return
+        with self._lock:
+            self._jobs[name] = Job(name, func, interval, run_at_start, exclusive)
+        self._wake.set()
+
+    def run_job(self, name):
+        """Run a job now, outside its schedule"""
+        job = self._jobs[name]
+        started = time.monotonic()
+        try:
+            # The lease outlives one interval so the leader keeps it between runs
+            if job.exclusive and not acquire_lease(name, job.interval * 2):
+                job.skipped += 1
+                return
+            job.runs += 1
+            job.func()
+            job.last_error = None
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            logger.error(f"Job {name} failed: {e}")
+        finally:
+            job.last_duration = round(time.monotonic() - started, 3)
+            job.next_run = time.monotonic() + job.interval
+
+    def start(self):
+        """Start the scheduler thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread once the running job (if any) returns"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._stopping.set()
+            self._wake.set()
+            thread.join(timeout=10)
+
+        # Hand exclusive jobs over to the other workers right away
+        with self._lock:
+            exclusive = [job.name for job in self._jobs.values() if job.exclusive]
+        for name in exclusive:
+            try:
+                release_lease(name)
+            except Exception as e:
+                logger.error(f"Could not release lease of job {name}: {e}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            with self._lock:
+                jobs = list(self._jobs.values())
+            now = time.monotonic()
+            for job in jobs:
+                if self._stopping.is_set():
+                    return
+                if job.next_run <= now:
+                    self.run_job(job.name)
+
+            with self._lock:
+                next_run = min((job.next_run for job in self._jobs.values()), default=None)
+            timeout = None if next_run is None else max(next_run - time.monotonic(), 0)
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def stats(self):
+        """Run counters per job"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            job.name: {
+                "runs": job.runs,
+                "skipped": job.skipped,
+                "failures": job.failures,
+                "last_error": job.last_error,
+                "last_duration": job.last_duration
+            }
+            for job in jobs
+        }
+
+
+# Shared scheduler, started in the app lifespan
+scheduler = Scheduler()
@@ -0,0 +1,121 @@
+"""
+Per-user fan-out hub for long-lived connections (SSE, WebSocket)
+
+Every open connection subscribes with a small bounded queue owned by its
+event loop. Publishers on any thread hand events to the recipients' queues
+with call_soon_threadsafe, so fan-out costs O(recipient connections) and no
+connection is ever written to from another thread. A connection that falls
+too far behind has its backlog dropped and receives RESYNC instead of
+growing without bound.
+"""
+
+import asyncio
+import logging
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Control messages placed on subscriber queues
+RESYNC = 'resync'
+CLOSE = 'close'
+
+
+class StreamSubscription:
+    """One open connection: a bounded queue owned by an event loop"""
+
+    def __init__(self, user_id, loop, max_queue):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.overflows = 0
+        self.closed = False
+
+    def _put(self, event):
+        """Queue an event (runs on the subscriber's loop)"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind: drop the backlog and let the client refetch
+            self.overflows += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    def close(self):
+        """Ask the connection to end (thread-safe)"""
+        self.closed = True
+
+        def _close():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(CLOSE)
+
+        try:
+            self.loop.call_soon_threadsafe(_close)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+
+class StreamHub:
+    """Routes events to the open connections of their recipients"""
+
+    def __init__(self, max_queue, max_per_user, name='stream-hub'):
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.name = name
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, user_id):
+        """
+        Open a subscription for a user (call from the event loop).
+
+        The oldest connection of the user is closed once max_per_user is reached.
+
+        Returns:
+            StreamSubscription: Subscription to read events from
+        """
+        subscription = StreamSubscription(user_id, asyncio.get_running_loop(), self.max_queue)
+        with self._lock:
+            streams = self._subscribers.setdefault(user_id, [])
+            while len(streams) >= self.max_per_user:
+                streams.pop(0).close()
+            streams.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscription"""
+        subscription.closed = True
+        with self._lock:
+            streams = self._subscribers.get(subscription.user_id, [])
+            if subscription in streams:
+                streams.remove(subscription)
+            if not streams:
+                self._subscribers.pop(subscription.user_id, None)
+
+    def send(self, user_ids, event):
+        """Queue an event on every connection of the given users (thread-safe)"""
+        with self._lock:
+            if not self._subscribers:
+                return
+            streams = [s for user_id in set(user_ids) for s in self._subscribers.get(user_id, ())]
+
+        for subscription in streams:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, event)
+                self.published += 1
+            except RuntimeError:
+                # Event loop already closed
+                self.unsubscribe(subscription)
+
+    def stats(self):
+        """Open connections and delivery counters"""
+        with self._lock:
+            connections = sum(len(streams) for streams in self._subscribers.values())
+            users = len(self._subscribers)
+        return {"connections": connections, "users": users, "published": self.published}
@@ -0,0 +1,100 @@
+"""
+Item waitlists
+
+Users queue for an item that is out on loan instead of polling its page.
+Entries live in waitlist_entries in join order; the
+(item_type, item_id, created_at, id) index makes the next in line a single
+index lookup. When a return leaves the item with no loan under way, or its
+owner lists it again, promote_next turns the first entry into a pending
+request starting that day, in the same transaction, and notifies the
+promoted user and the owner.
+"""
+
+import logging
+from datetime import date, timedelta
+
+from services.item_summaries import ITEM_SUMMARY_COLUMNS, summary_select
+from services.outbox import add_notification, add_activity
+from services.reservations import lent_condition
+from services.request_counters import adjust_request_counters
+from services.request_events import publish_request_events
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# First entry of an item's queue; users who already have a pending request
+# for the item keep their place but are not promoted twice
+NEXT_QUERY = """
+    SELECT w.id, w.user_id, w.loan_days, w.notes, u.username
+    FROM waitlist_entries w
+    JOIN users u ON u.id = w.user_id
+    WHERE w.item_type = %s AND w.item_id = %s
+    AND NOT EXISTS (
+        SELECT 1 FROM requests r
+        WHERE r.item_type = w.item_type AND r.item_id = w.item_id
+        AND r.requester_id = w.user_id AND r.status = 'pending'
+    )
+    ORDER BY w.created_at, w.id
+    LIMIT 1
+"""
+
+# Place of an entry in its queue (1 = next in line), counted on the index;
+# takes created_at, created_at, id
+POSITION_SUBQUERY = """(
+    SELECT COUNT(*) FROM waitlist_entries o
+    WHERE o.item_type = w.item_type AND o.item_id = w.item_id
+    AND (o.created_at < w.created_at OR (o.created_at = w.created_at AND o.id < w.id))
+) + 1"""
+
+
+def promote_next(tx, item_type, item_id, actor_id):
+    """
+    Turn the first waitlist entry of an item into a pending request.
+
+    Args:
+        tx: Open Transaction that made the item available
+        item_type: 'book' or 'boardgame'
+        item_id: Item that was returned or listed again
+        actor_id: User whose action freed the item (the owner)
+
+    Returns:
+        int: ID of the new request, or None if nobody is waiting or the
+            item is still out on loan
+    """
+    entry = tx.fetch_one(NEXT_QUERY, (item_type, item_id))
+    if not entry:
+        return None
+
+    pickup_date = date.today()
+    return_date = pickup_date + timedelta(days=entry['loan_days'])
+    table = ITEM_SUMMARY_COLUMNS[item_type][0]
+
+    request_id = tx.execute(
+        f"""INSERT INTO requests (item_type, item_id, requester_id, owner_id,
+            pickup_date, return_date, notes, item_title, item_creator, item_image)
+            SELECT %s, %s, %s, owner_id, %s, %s, %s, {summary_select(item_type)}
+            FROM {table} WHERE id = %s AND NOT {lent_condition(item_type, table)}""",
+        (item_type, item_id, entry['user_id'], pickup_date.isoformat(),
+         return_date.isoformat(), entry['notes'], item_id, pickup_date.isoformat())
+    )
+    if tx.cursor.rowcount != 1:
+        return None
+    tx.execute("DELETE FROM waitlist_entries WHERE id = %s", (entry['id'],))
+
+    request = tx.fetch_one("SELECT owner_id, item_title FROM requests WHERE id = %s", (request_id,))
+    adjust_request_counters(tx, [(entry['user_id'], request['owner_id'], None, 'pending')])
+
+    add_notification(tx, entry['user_id'], 'Your Turn',
+                     f'"{request["item_title"]}" is available again. We sent a request for '
+                     f'{pickup_date} to {return_date} to its owner; you can change the dates '
+                     f'while it is pending.', 'success', email=True)
+    add_notification(tx, request['owner_id'], 'New Request',
+                     f'{entry["username"]} has requested "{request["item_title"]}" from the waitlist',
+                     'info', email=True)
+
+    add_activity(tx, entry['user_id'], 'requested', item_type, item_id,
+                 {"title": request["item_title"], "request_id": request_id, "waitlist": True})
+
+    publish_request_events(tx, [request_id], 'created', actor_id)
+    logger.info(f"Promoted waitlist entry {entry['id']} to request {request_id}")
+    return request_id
@@ -2,7 +2,7 @@
 Utils package initialization
 """
 
-from .jwt_handler import get_current_user, require_admin
+from .jwt_handler import get_current_user, get_current_user_record, require_admin
 from .validators import (
     validate_email,
     validate_phone,
@@ -13,6 +13,7 @@ from .validators import (
 
 __all__ = [
     'get_current_user',
+    'get_current_user_record',
     'require_admin',
     'validate_email',
     'validate_phone',
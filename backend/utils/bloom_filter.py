@@ -0,0 +1,47 @@
+"""
+Compact Bloom filter used for fast negative membership checks
+"""
+
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Probabilistic set with no false negatives.
+
+    A miss is definitive; a hit must be confirmed against the source of
+    truth because of the configured false positive rate.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        """Derive hash_count bit positions using double hashing"""
+        digest = hashlib.blake2b(str(item).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        """Add an item to the filter"""
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def is_saturated(self):
+        """True once more items were added than the filter was sized for"""
+        return self.count > self.capacity
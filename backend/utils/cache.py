@@ -0,0 +1,391 @@
+"""
+Two-tier cache shared by all worker processes on a host
+
+Tier one is a small in-process LRU. Tier two is a SQLite file on the same
+host, so a value loaded by one uvicorn worker is a hit for every other
+worker. Writes publish invalidations to a log in the shared file; each
+worker polls the log (at most every CACHE_SYNC_INTERVAL seconds) and evicts
+the affected keys from its local tier.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Sentinel for cache misses (None is a valid cached value)
+MISS = object()
+
+# Invalidation log entries older than this are trimmed
+INVALIDATION_RETENTION = 600
+
+# Seconds between purges of expired shared entries
+PURGE_INTERVAL = 60
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with per-entry expiry"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISS
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return MISS
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SharedCacheBackend:
+    """SQLite-backed second tier and invalidation log"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS cache_invalidations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM cache_entries WHERE key = ?",
+            (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return MISS
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, default=str), time.time() + ttl)
+        )
+
+    def set_if_current(self, key, value, ttl, since_seq):
+        """Store a value unless the key was invalidated after since_seq
+
+        Returns:
+            bool: Whether the value was stored
+        """
+        cursor = self._connection().execute(
+            """INSERT OR REPLACE INTO cache_entries (key, value, expires_at)
+               SELECT ?, ?, ?
+               WHERE NOT EXISTS (
+                   SELECT 1 FROM cache_invalidations
+                   WHERE seq > ? AND (key = ? OR (
+                       substr(key, -1) = '*'
+                       AND substr(?, 1, length(key) - 1) = substr(key, 1, length(key) - 1)
+                   ))
+               )""",
+            (key, json.dumps(value, default=str), time.time() + ttl, since_seq, key, key)
+        )
+        return cursor.rowcount == 1
+
+    def invalidate(self, keys, delete=True):
+        """Delete keys and publish them to the other workers"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key in keys:
+                if not delete:
+                    pass
+                elif key.endswith('*'):
+                    conn.execute(
+                        "DELETE FROM cache_entries WHERE key LIKE ?",
+                        (key[:-1] + '%',)
+                    )
+                else:
+                    conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                conn.execute(
+                    "INSERT INTO cache_invalidations (key, created_at) VALUES (?, ?)",
+                    (key, now)
+                )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def invalidations_since(self, seq):
+        """Get (last_seq, keys) published after seq"""
+        rows = self._connection().execute(
+            "SELECT seq, key FROM cache_invalidations WHERE seq > ? ORDER BY seq",
+            (seq,)
+        ).fetchall()
+        if not rows:
+            return seq, []
+        return rows[-1][0], [row[1] for row in rows]
+
+    def last_seq(self):
+        row = self._connection().execute(
+            "SELECT MAX(seq) FROM cache_invalidations"
+        ).fetchone()
+        return row[0] or 0
+
+    def purge(self):
+        """Drop expired entries and old invalidations"""
+        conn = self._connection()
+        conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM cache_invalidations WHERE created_at < ?",
+            (time.time() - INVALIDATION_RETENTION,)
+        )
+
+
+class CacheManager:
+    """Owns the shared backend, the namespaces and the invalidation poller"""
+
+    def __init__(self, path=None, sync_interval=None):
+        self.path = path or settings.CACHE_SHARED_PATH
+        self.sync_interval = (
+            settings.CACHE_SYNC_INTERVAL if sync_interval is None else sync_interval
+        )
+        self._backend = None
+        self._namespaces = {}
+        self._listeners = {}
+        self._last_seq = None
+        self._last_sync = 0.0
+        self._last_purge = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        """Shared tier, or None if it could not be opened"""
+        if self._backend is None:
+            try:
+                self._backend = SharedCacheBackend(self.path)
+                self._last_seq = self._backend.last_seq()
+            except sqlite3.Error as e:
+                logger.error(f"Shared cache unavailable, using local tier only: {e}")
+                self._backend = False
+        return self._backend or None
+
+    def namespace(self, name, maxsize=None, ttl=300):
+        """Get or create a cache namespace"""
+        with self._lock:
+            if name not in self._namespaces:
+                self._namespaces[name] = TieredCache(
+                    self, name, maxsize or settings.CACHE_LOCAL_MAXSIZE, ttl
+                )
+            return self._namespaces[name]
+
+    def on_invalidate(self, namespace, callback):
+        """Register callback(key) for invalidations published in a namespace"""
+        self._listeners.setdefault(namespace, []).append(callback)
+
+    def publish(self, keys, delete=True):
+        """Publish invalidations, deleting the keys from the shared tier unless delete=False"""
+        backend = self.backend
+        if backend is None:
+            return
+        try:
+            backend.invalidate(keys, delete)
+        except sqlite3.Error as e:
+            logger.error(f"Error publishing cache invalidation: {e}")
+
+    def sync(self, force=False):
+        """Apply invalidations published by other workers since the last sync"""
+        now = time.monotonic()
+        if not force and now - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = now
+
+        backend = self.backend
+        if backend is None:
+            return
+
+        try:
+            self._last_seq, keys = backend.invalidations_since(self._last_seq or 0)
+            if now - self._last_purge > PURGE_INTERVAL:
+                self._last_purge = now
+                backend.purge()
+        except sqlite3.Error as e:
+            logger.error(f"Error reading cache invalidations: {e}")
+            return
+
+        for full_key in keys:
+            name, _, key = full_key.partition(':')
+            cache = self._namespaces.get(name)
+            if cache is not None:
+                cache.generation += 1
+                if key == '*':
+                    cache.local.clear()
+                else:
+                    cache.local.delete(key)
+            for callback in self._listeners.get(name, []):
+                try:
+                    callback(key)
+                except Exception as e:
+                    logger.error(f"Cache invalidation listener failed: {e}")
+
+
+class TieredCache:
+    """A cache namespace: local LRU in front of the shared tier"""
+
+    def __init__(self, manager, name, maxsize, ttl):
+        self.manager = manager
+        self.name = name
+        self.ttl = ttl
+        self.local = LRUCache(maxsize, ttl)
+        # Bumped on every invalidation seen by this worker, so a load that
+        # raced with one does not cache what it read
+        self.generation = 0
+
+    def _shared_key(self, key):
+        return f"{self.name}:{key}"
+
+    def get(self, key, default=None):
+        self.manager.sync()
+        key = str(key)
+
+        value = self.local.get(key)
+        if value is not MISS:
+            return value
+
+        backend = self.manager.backend
+        if backend is not None:
+            try:
+                value = backend.get(self._shared_key(key))
+            except sqlite3.Error as e:
+                logger.error(f"Shared cache read failed: {e}")
+                value = MISS
+            if value is not MISS:
+                self.local.set(key, value)
+                return value
+
+        return default
+
+    def set(self, key, value, ttl=None, publish=True):
+        """Store a value in both tiers
+
+        With publish=True other workers drop their local copy of the key;
+        cache fills after a miss skip that since no worker holds a copy.
+        """
+        key = str(key)
+        ttl = self.ttl if ttl is None else ttl
+        self.local.set(key, value, ttl)
+
+        backend = self.manager.backend
+        if backend is not None:
+            try:
+                backend.set(self._shared_key(key), value, ttl)
+            except sqlite3.Error as e:
+                logger.error(f"Shared cache write failed: {e}")
+
+        if publish:
+            self.manager.publish([self._shared_key(key)], delete=False)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """Get a value, calling loader() and caching the result on a miss
+
+        None results are not cached.
+        """
+        value = self.get(key, MISS)
+        if value is not MISS:
+            return value
+
+        # Note where the invalidation log stands before reading, so a value
+        # invalidated while loader() runs is returned but never cached
+        generation = self.generation
+        backend = self.manager.backend
+        since_seq = None
+        if backend is not None:
+            try:
+                since_seq = backend.last_seq()
+            except sqlite3.Error as e:
+                logger.error(f"Shared cache read failed: {e}")
+
+        value = loader()
+        if value is None:
+            return value
+
+        key = str(key)
+        ttl = self.ttl if ttl is None else ttl
+        if since_seq is not None:
+            try:
+                if not backend.set_if_current(self._shared_key(key), value, ttl, since_seq):
+                    return value
+            except sqlite3.Error as e:
+                logger.error(f"Shared cache write failed: {e}")
+                return value
+        elif backend is not None:
+            return value
+
+        if self.generation == generation:
+            self.local.set(key, value, ttl)
+        return value
+
+    def invalidate(self, *keys):
+        """Evict keys here, in the shared tier and in every other worker"""
+        keys = [str(key) for key in keys]
+        self.generation += 1
+        for key in keys:
+            self.local.delete(key)
+        self.manager.publish([self._shared_key(key) for key in keys])
+
+    def clear(self):
+        """Evict the whole namespace everywhere"""
+        self.generation += 1
+        self.local.clear()
+        self.manager.publish([self._shared_key('*')])
+
+
+# Shared cache manager instance
+cache_manager = CacheManager()
+
+# Namespaces used across the API
+user_cache = cache_manager.namespace('users', ttl=300)
+catalog_cache = cache_manager.namespace('catalog', maxsize=64, ttl=600)
@@ -1,30 +1,100 @@
-from fastapi import HTTPException, Depends, status
+from fastapi import HTTPException, Depends, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
 import os
 
 from auth import AuthService
 from database import execute_one
+from utils.token_epoch import token_epochs
+from utils.token_revocation import revoked_tokens
+from utils.cache import user_cache
 
 # Security scheme
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+
+def load_user(user_id: int) -> Optional[dict]:
+    """
+    Load a users row through the shared cache (without the password hash).
+
+    Args:
+        user_id: ID of the user
+
+    Returns:
+        dict: User information, or None if the user does not exist
+    """
+    def _load():
+        user = execute_one("SELECT * FROM users WHERE id = %s", (user_id,))
+        if user:
+            user.pop('password_hash', None)
+        return user
+
+    return user_cache.get_or_load(user_id, _load)
 
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     """
     Dependency to get the current authenticated user.
 
+    Tokens carrying a token_epoch claim are authorized from their claims and
+    the in-memory epoch map, without loading the user row. Older tokens fall
+    back to a database lookup.
+
     Args:
         credentials: Bearer token from Authorization header
 
     Returns:
-        dict: User information from database
+        dict: User id, username, is_admin and is_active
 
     Raises:
         HTTPException: If token is invalid or user not found
     """
-    token = credentials.credentials
+    return authenticate_token(credentials.credentials)
+
+
+async def get_stream_user(
+        token: Optional[str] = Query(None),
+        credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> dict:
+    """
+    Dependency for streaming endpoints.
+
+    Browsers cannot set headers on an EventSource, so the access token may
+    also be passed as the ?token= query parameter.
+
+    Returns:
+        dict: User id, username, is_admin and is_active
+
+    Raises:
+        HTTPException: If no valid token was provided
+    """
+    if credentials is not None:
+        token = credentials.credentials
+
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    return authenticate_token(token)
+
+
+def authenticate_token(token: str) -> dict:
+    """
+    Resolve an access token to the user it was issued to.
+
+    Args:
+        token: JWT access token
 
+    Returns:
+        dict: User id, username, is_admin and is_active
+
+    Raises:
+        HTTPException: If token is invalid or user not found
+    """
     # Verify token
     payload = AuthService.verify_token(token)
 
@@ -35,11 +105,30 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Get user from database
-    user = execute_one(
-        "SELECT * FROM users WHERE id = %s",
-        (payload['user_id'],)
-    )
+    if revoked_tokens.is_revoked(payload.get('jti')):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if 'token_epoch' in payload:
+        if not token_epochs.is_current(payload['user_id'], payload['token_epoch']):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        return {
+            'id': payload['user_id'],
+            'username': payload.get('username'),
+            'is_admin': bool(payload.get('is_admin')),
+            'is_active': True
+        }
+
+    # Legacy token without claims: get user from database
+    user = load_user(payload['user_id'])
 
     if not user:
         raise HTTPException(
@@ -56,6 +145,32 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     return user
 
 
+async def get_current_user_record(current_user: dict = Depends(get_current_user)) -> dict:
+    """
+    Dependency to load the full users row of the authenticated user.
+
+    Only needed by handlers that read profile fields beyond the token claims.
+
+    Args:
+        current_user: Current authenticated user
+
+    Returns:
+        dict: User information from database
+
+    Raises:
+        HTTPException: If user not found
+    """
+    user = load_user(current_user['id'])
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+
+    return user
+
+
 async def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
     """
     Dependency to require admin privileges.
@@ -88,7 +203,16 @@ def create_access_token(user_id: int) -> str:
     Returns:
         str: JWT token
     """
-    return AuthService.generate_token(user_id)
+    user = execute_one(
+        "SELECT username, is_admin, token_epoch FROM users WHERE id = %s",
+        (user_id,)
+    )
+    if not user:
+        return AuthService.generate_token(user_id)
+
+    return AuthService.generate_token(
+        user_id, user['username'], user['is_admin'], user['token_epoch']
+    )
 
 
 def decode_token(token: str) -> Optional[dict]:
@@ -0,0 +1,306 @@
+"""
+Sliding-window rate limiting for the Share-IT API
+
+Requests are keyed by the authenticated user id (taken from the JWT without
+touching the database) or by client IP for anonymous traffic. Each route has
+a cost weight so expensive endpoints (search, admin statistics) use up the
+budget faster than cheap ones.
+"""
+
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _sliding_window(prev_count, curr_count, cost, limit, window, elapsed):
+    """
+    Evaluate the sliding window counter for one request.
+
+    The previous fixed window is weighted by how much of it still overlaps
+    the sliding window, which approximates a true sliding log in O(1) memory.
+
+    Args:
+        prev_count: Cost consumed in the previous fixed window
+        curr_count: Cost consumed in the current fixed window
+        cost: Cost of the incoming request
+        limit: Maximum cost allowed per window
+        window: Window length in seconds
+        elapsed: Seconds elapsed in the current fixed window
+
+    Returns:
+        tuple: (allowed, used, retry_after) where used includes this request
+        when allowed and retry_after is in seconds (0 when allowed)
+    """
+    weight = 1 - (elapsed / window)
+    used = prev_count * weight + curr_count
+
+    if used + cost <= limit:
+        return True, used + cost, 0
+
+    # Wait until the previous window has decayed enough
+    if curr_count + cost <= limit and prev_count > 0:
+        needed = 1 - (limit - curr_count - cost) / prev_count
+        return False, used, max(needed * window - elapsed, 1)
+
+    # Otherwise the current window must start decaying first
+    retry_after = window - elapsed
+    if curr_count > 0:
+        retry_after += max(1 - (limit - cost) / curr_count, 0) * window
+    return False, used, max(retry_after, 1)
+
+
+class InMemoryRateLimitStorage:
+    """Per-process storage, suitable for a single worker"""
+
+    # Purge stale keys once the table grows beyond this size
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, cost, limit, window, now=None):
+        """Try to consume cost for key, returning (allowed, used, retry_after)"""
+        now = time.time() if now is None else now
+        current = int(now // window)
+        elapsed = now - current * window
+
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None or entry[0] < current - 1:
+                prev_count, curr_count = 0, 0
+            elif entry[0] == current - 1:
+                prev_count, curr_count = entry[2], 0
+            else:
+                prev_count, curr_count = entry[1], entry[2]
+
+            allowed, used, retry_after = _sliding_window(
+                prev_count, curr_count, cost, limit, window, elapsed
+            )
+            if allowed:
+                curr_count += cost
+            self._counters[key] = [current, prev_count, curr_count]
+
+            if len(self._counters) > self.MAX_KEYS:
+                self._purge(current)
+
+        return allowed, used, retry_after
+
+    def _purge(self, current):
+        """Drop keys that have not been seen in the last two windows"""
+        stale = [k for k, v in self._counters.items() if v[0] < current - 1]
+        for k in stale:
+            del self._counters[k]
+
+
+class SQLiteRateLimitStorage:
+    """
+    SQLite-backed storage shared by every worker on the same host.
+
+    Uses its own database file so rate limit bookkeeping never contends with
+    the application database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT NOT NULL,
+                window INTEGER NOT NULL,
+                count REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (key, window)
+            )"""
+        )
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def consume(self, key, cost, limit, window, now=None):
+        """Try to consume cost for key, returning (allowed, used, retry_after)"""
+        now = time.time() if now is None else now
+        current = int(now // window)
+        elapsed = now - current * window
+        conn = self._connection()
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = dict(conn.execute(
+                "SELECT window, count FROM rate_limits WHERE key = ? AND window >= ?",
+                (key, current - 1)
+            ).fetchall())
+
+            allowed, used, retry_after = _sliding_window(
+                rows.get(current - 1, 0), rows.get(current, 0),
+                cost, limit, window, elapsed
+            )
+
+            if allowed:
+                conn.execute(
+                    """INSERT INTO rate_limits (key, window, count) VALUES (?, ?, ?)
+                       ON CONFLICT(key, window) DO UPDATE SET count = count + excluded.count""",
+                    (key, current, cost)
+                )
+
+            # Opportunistically clean up expired windows
+            if current % 10 == 0:
+                conn.execute("DELETE FROM rate_limits WHERE window < ?", (current - 1,))
+
+            conn.execute("COMMIT")
+            return allowed, used, retry_after
+
+        except sqlite3.Error as err:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            # Fail open: never take the API down because of the limiter
+            logger.error(f"Rate limit storage error: {err}")
+            return True, 0, 0
+
+
+def create_storage(backend=None):
+    """Create the rate limit storage configured in settings"""
+    backend = (backend or settings.RATE_LIMIT_STORAGE).lower()
+    if backend == 'sqlite':
+        return SQLiteRateLimitStorage(settings.RATE_LIMIT_SQLITE_PATH)
+    return InMemoryRateLimitStorage()
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware enforcing settings.RATE_LIMIT_* on every HTTP request.
+
+    Adds X-RateLimit-* headers to responses and answers 429 with a
+    Retry-After header once a client exhausts its budget.
+    """
+
+    def __init__(self, app, storage=None, limit=None, window=None,
+                 route_costs=None, exempt_paths=None):
+        self.app = app
+        self.storage = storage or create_storage()
+        self.limit = limit or settings.RATE_LIMIT_REQUESTS
+        self.window = window or settings.RATE_LIMIT_WINDOW
+        self.route_costs = sorted(
+            (route_costs or settings.RATE_LIMIT_ROUTE_COSTS).items(),
+            key=lambda item: len(item[0]),
+            reverse=True
+        )
+        self.exempt_paths = tuple(exempt_paths or settings.RATE_LIMIT_EXEMPT_PATHS)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'OPTIONS':
+            await self.app(scope, receive, send)
+            return
+
+        path = scope['path']
+        if path.startswith(self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        # Token verification and the storage update are blocking (the SQLite
+        # backend may wait up to its busy timeout), so keep them off the loop
+        key, (allowed, used, retry_after) = await run_in_threadpool(self.consume, scope, path)
+
+        remaining = max(int(self.limit - used), 0)
+        reset = int(math.ceil(self.window - (time.time() % self.window)))
+        headers = [
+            (b'x-ratelimit-limit', str(self.limit).encode()),
+            (b'x-ratelimit-remaining', str(remaining).encode()),
+            (b'x-ratelimit-reset', str(reset).encode()),
+        ]
+
+        if not allowed:
+            retry_after = int(math.ceil(retry_after))
+            logger.warning(f"Rate limit exceeded for {key} on {path}")
+            body = json.dumps({
+                "success": False,
+                "detail": "Rate limit exceeded. Please try again later.",
+                "status_code": 429
+            }).encode()
+            await send({
+                'type': 'http.response.start',
+                'status': 429,
+                'headers': headers + [
+                    (b'retry-after', str(retry_after).encode()),
+                    (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode()),
+                ]
+            })
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        async def send_with_headers(message):
+            if message['type'] == 'http.response.start':
+                message.setdefault('headers', [])
+                message['headers'] = list(message['headers']) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    def consume(self, scope, path):
+        """Charge a request to its client
+
+        Returns:
+            tuple: (client key, (allowed, used, retry_after))
+        """
+        key = self.get_client_key(scope)
+        cost = min(self.get_cost(path), self.limit)
+        return key, self.storage.consume(key, cost, self.limit, self.window)
+
+    def get_cost(self, path):
+        """Get the cost weight of a route (longest matching prefix wins)"""
+        for prefix, cost in self.route_costs:
+            if path.startswith(prefix):
+                return cost
+        return 1
+
+    def get_client_key(self, scope):
+        """Key requests by JWT user id, falling back to the client IP"""
+        user_id = self._user_id_from_headers(scope)
+        if user_id is not None:
+            return f"user:{user_id}"
+
+        client_ip = None
+        if settings.RATE_LIMIT_TRUST_PROXY:
+            for name, value in scope.get('headers', []):
+                if name == b'x-forwarded-for':
+                    client_ip = value.decode('latin-1').split(',')[0].strip()
+                    break
+        if not client_ip and scope.get('client'):
+            client_ip = scope['client'][0]
+
+        return f"ip:{client_ip or 'unknown'}"
+
+    @staticmethod
+    def _user_id_from_headers(scope):
+        """Extract the user id from a bearer token without hitting the database"""
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                scheme, _, token = value.decode('latin-1').partition(' ')
+                if scheme.lower() != 'bearer' or not token:
+                    return None
+
+                # Imported lazily, auth pulls in the database module
+                from auth import AuthService
+                payload = AuthService.verify_token(token)
+                return payload.get('user_id') if payload else None
+        return None
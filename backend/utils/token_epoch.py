@@ -0,0 +1,81 @@
+"""
+Per-user token epochs
+
+Every JWT carries the user's token_epoch at issue time. Bumping the epoch in
+the users table invalidates all tokens issued before, which is how role
+changes, deactivation and password changes take effect without a per-request
+user lookup.
+"""
+
+import logging
+
+from database import execute_query, execute_one
+from utils.cache import cache_manager
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Epochs are invalidated explicitly on every bump, the TTL only bounds memory
+EPOCH_CACHE_TTL = 3600
+
+
+class TokenEpochRegistry:
+    """Cached map of user id -> (token_epoch, is_active), shared across workers"""
+
+    def __init__(self, ttl=EPOCH_CACHE_TTL):
+        self._cache = cache_manager.namespace('token_epochs', ttl=ttl)
+
+    def _load(self, user_id):
+        user = execute_one(
+            "SELECT token_epoch, is_active FROM users WHERE id = %s",
+            (user_id,)
+        )
+        if not user:
+            return None
+        return [user['token_epoch'] or 0, bool(user['is_active'])]
+
+    def get(self, user_id):
+        """
+        Get the current epoch for a user.
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            int: Current epoch, or None if the user is missing or inactive
+        """
+        entry = self._cache.get_or_load(user_id, lambda: self._load(user_id))
+        if not entry or not entry[1]:
+            return None
+        return entry[0]
+
+    def is_current(self, user_id, epoch):
+        """Check whether a token epoch is still valid for a user"""
+        current = self.get(user_id)
+        return current is not None and current == epoch
+
+    def bump(self, user_id):
+        """
+        Invalidate every token issued to a user so far.
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            int: The new epoch, or None if the user is gone or inactive
+        """
+        execute_query(
+            "UPDATE users SET token_epoch = COALESCE(token_epoch, 0) + 1 WHERE id = %s",
+            (user_id,)
+        )
+        self._cache.invalidate(user_id)
+        logger.info(f"Token epoch bumped for user ID: {user_id}")
+        return self.get(user_id)
+
+    def forget(self, user_id):
+        """Drop a user from the map (e.g. after deletion)"""
+        self._cache.invalidate(user_id)
+
+
+# Shared registry instance
+token_epochs = TokenEpochRegistry()
@@ -0,0 +1,127 @@
+"""
+Access token revocation list
+
+Revoked token ids (jti) are stored in the revoked_tokens table and mirrored
+in an in-memory Bloom filter. Almost every request misses the filter and is
+accepted without database I/O; the rare hit is confirmed against the table.
+Revocations are broadcast to the other workers through the shared cache
+invalidation log.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+from database import execute_query, execute_one, db_timestamp
+from utils.bloom_filter import BloomFilter
+from utils.cache import cache_manager
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Rebuild the filter from the table this often to drop expired entries (new
+# revocations from other workers arrive through the cache invalidation log)
+RELOAD_INTERVAL = 300
+
+CACHE_NAMESPACE = 'revoked_tokens'
+
+BLOOM_CAPACITY = 100000
+BLOOM_ERROR_RATE = 0.001
+
+
+class TokenRevocationList:
+    """Bloom filter front for the revoked_tokens table"""
+
+    def __init__(self, reload_interval=RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._filter = BloomFilter(BLOOM_CAPACITY, BLOOM_ERROR_RATE)
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        cache_manager.on_invalidate(CACHE_NAMESPACE, self._add)
+
+    def _add(self, jti):
+        with self._lock:
+            self._filter.add(jti)
+            return self._filter.is_saturated
+
+    def reload(self):
+        """Purge expired entries and rebuild the filter from the table"""
+        now = db_timestamp()
+        try:
+            execute_query("DELETE FROM revoked_tokens WHERE expires_at < %s", (now,))
+            rows = execute_query(
+                "SELECT jti FROM revoked_tokens WHERE expires_at >= %s",
+                (now,),
+                fetch=True
+            )
+        except Exception as e:
+            logger.error(f"Error loading revoked tokens: {e}")
+            return
+
+        bloom = BloomFilter(max(BLOOM_CAPACITY, len(rows) * 2), BLOOM_ERROR_RATE)
+        for row in rows:
+            bloom.add(row['jti'])
+
+        with self._lock:
+            self._filter = bloom
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_interval:
+            self.reload()
+
+    def is_revoked(self, jti):
+        """
+        Check whether a token id has been revoked.
+
+        Args:
+            jti: Token id claim
+
+        Returns:
+            bool: True if the token was revoked
+        """
+        if not jti:
+            return False
+
+        self._ensure_fresh()
+        cache_manager.sync()
+        if jti not in self._filter:
+            return False
+
+        # Possible false positive, confirm against the table
+        return execute_one(
+            "SELECT jti FROM revoked_tokens WHERE jti = %s",
+            (jti,)
+        ) is not None
+
+    def revoke(self, jti, user_id, expires_at):
+        """
+        Revoke a single access token until it expires.
+
+        Args:
+            jti: Token id claim
+            user_id: Owner of the token
+            expires_at: Token expiry (datetime or unix timestamp)
+        """
+        if not jti:
+            return
+
+        if not isinstance(expires_at, datetime):
+            expires_at = datetime.utcfromtimestamp(expires_at)
+
+        existing = execute_one("SELECT jti FROM revoked_tokens WHERE jti = %s", (jti,))
+        if not existing:
+            execute_query(
+                """INSERT INTO revoked_tokens (jti, user_id, expires_at)
+                   VALUES (%s, %s, %s)""",
+                (jti, user_id, db_timestamp(expires_at))
+            )
+
+        cache_manager.publish([f"{CACHE_NAMESPACE}:{jti}"])
+        if self._add(jti):
+            self.reload()
+
+
+# Shared revocation list instance
+revoked_tokens = TokenRevocationList()
@@ -0,0 +1,80 @@
+"""
+Optimistic concurrency for requests and catalog items
+
+Requests, books and board games carry a version that every edit increments.
+Clients send the version they read (If-Match header or expected_version
+field) with an update; the update only applies while the row still has that
+version, so a concurrent change is reported as 409 instead of being
+overwritten. Approvals and returns flip an item's is_available without
+touching its version: lending is not owner-edited content, and a loan cycle
+should not invalidate the owner's ETag.
+"""
+
+import re
+from typing import Optional
+
+from fastapi import HTTPException
+
+# "3", W/"3" or a bare 3
+ETAG_PATTERN = re.compile(r'^\s*(?:W/)?"?(\d+)"?\s*$')
+
+
+def etag(version) -> str:
+    """
+    Format a row version as an ETag.
+
+    Args:
+        version: Row version
+
+    Returns:
+        str: Quoted version, e.g. "3"
+    """
+    return f'"{version}"'
+
+
+def expected_version(if_match: Optional[str], body_version: Optional[int]) -> Optional[int]:
+    """
+    Get the version a client based its update on.
+
+    Args:
+        if_match: If-Match header, if any
+        body_version: expected_version field of the request body, if any
+
+    Returns:
+        Optional[int]: Expected version, or None if the client sent neither
+
+    Raises:
+        HTTPException: If the header is malformed or disagrees with the body
+    """
+    version = None
+    if if_match is not None and if_match.strip() != '*':
+        match = ETAG_PATTERN.match(if_match)
+        if not match:
+            raise HTTPException(status_code=400, detail="Invalid If-Match header")
+        version = int(match.group(1))
+
+    if body_version is not None:
+        if version is not None and version != body_version:
+            raise HTTPException(
+                status_code=400,
+                detail="If-Match header and expected_version do not match"
+            )
+        version = body_version
+
+    return version
+
+
+def version_conflict(current_version) -> HTTPException:
+    """
+    409 for an update based on an outdated version.
+
+    Args:
+        current_version: Version the row has now
+
+    Returns:
+        HTTPException: To be raised by the caller
+    """
+    return HTTPException(
+        status_code=409,
+        detail=f"Modified by someone else (now at version {current_version}); reload and try again"
+    )
@@ -15,6 +15,15 @@ const TopBar: React.FC = () => {
 
   useEffect(() => {
     fetchNotifications();
+
+    // New notifications are pushed instead of polled
+    return apiService.subscribeToNotifications({
+      onNotification: (notification) => {
+        setNotifications(prev => [notification, ...prev.filter(n => n.id !== notification.id)].slice(0, 5));
+        setUnreadCount(prev => prev + 1);
+      },
+      onResync: fetchNotifications,
+    });
   }, []);
 
   const fetchNotifications = async () => {
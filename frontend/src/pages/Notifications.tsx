@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Bell, CheckCircle, AlertCircle, Clock, XCircle, Loader } from 'lucide-react';
-import apiService from '../services/api';
+import apiService, { DigestMode } from '../services/api';
 
 interface Notification {
   id: number;
@@ -16,9 +16,33 @@ const Notifications: React.FC = () => {
   const [filter, setFilter] = useState<'all' | 'unread'>('all');
   const [loading, setLoading] = useState(true);
   const [unreadCount, setUnreadCount] = useState(0);
+  const [digestMode, setDigestMode] = useState<DigestMode>('off');
+
+  useEffect(() => {
+    apiService.getNotificationPreferences()
+      .then(response => setDigestMode(response.data?.digest_mode || 'off'))
+      .catch(err => console.error('Error fetching notification preferences:', err));
+  }, []);
+
+  const changeDigestMode = async (mode: DigestMode) => {
+    try {
+      await apiService.updateNotificationPreferences({ digest_mode: mode });
+      setDigestMode(mode);
+    } catch (err) {
+      console.error('Error updating notification preferences:', err);
+    }
+  };
 
   useEffect(() => {
     fetchNotifications();
+
+    return apiService.subscribeToNotifications({
+      onNotification: (notification) => {
+        setNotifications(prev => [notification, ...prev.filter(n => n.id !== notification.id)]);
+        setUnreadCount(prev => prev + 1);
+      },
+      onResync: fetchNotifications,
+    });
   }, [filter]);
 
   const fetchNotifications = async () => {
@@ -73,6 +97,17 @@ const Notifications: React.FC = () => {
     }
   };
 
+  const clearRead = async () => {
+    try {
+      await apiService.bulkDeleteNotifications({ is_read: true });
+      setNotifications(prevNotifications =>
+        prevNotifications.filter(notification => !notification.is_read)
+      );
+    } catch (err) {
+      console.error('Error clearing read notifications:', err);
+    }
+  };
+
   const formatTimeAgo = (dateString: string) => {
     const date = new Date(dateString);
     const now = new Date();
@@ -126,6 +161,16 @@ const Notifications: React.FC = () => {
             <option value="all">All</option>
             <option value="unread">Unread</option>
           </select>
+          <select
+            value={digestMode}
+            onChange={(e) => changeDigestMode(e.target.value as DigestMode)}
+            title="How often to receive notifications"
+            className="bg-white border border-gray-300 rounded-md px-3 py-2 text-sm focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-blue-500"
+          >
+            <option value="off">Notify immediately</option>
+            <option value="hourly">Hourly digest</option>
+            <option value="daily">Daily digest</option>
+          </select>
           {unreadCount > 0 && (
             <button
               onClick={markAllAsRead}
@@ -134,6 +179,14 @@ const Notifications: React.FC = () => {
               Mark all as read
             </button>
           )}
+          {notifications.some(notification => notification.is_read) && (
+            <button
+              onClick={clearRead}
+              className="px-4 py-2 bg-white border border-gray-300 rounded-md text-gray-700 hover:bg-gray-50 focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-blue-500 text-sm transition-colors"
+            >
+              Clear read
+            </button>
+          )}
         </div>
       </div>
 
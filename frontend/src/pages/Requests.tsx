@@ -37,6 +37,33 @@ const Requests: React.FC = () => {
     fetchRequests();
   }, [filter, statusFilter]);
 
+  // Apply pushed status changes in place instead of refetching the list
+  useEffect(() => {
+    return apiService.subscribeToRequestEvents({
+      onEvent: ({ data }) => {
+        const isOwner = String(data.owner_id) === String(user?.id);
+        const matches =
+          (filter === 'all' || (filter === 'received') === isOwner) &&
+          (statusFilter === 'all' || data.status === statusFilter);
+
+        setRequests(prev => {
+          const existing = prev.find(r => r.id === data.id);
+          if (!matches) {
+            return prev.filter(r => r.id !== data.id);
+          }
+          if (existing) {
+            return prev.map(r => (r.id === data.id ? { ...r, ...data } : r));
+          }
+          return [
+            { ...data, requester_email: '', owner_email: '', is_owner: isOwner, is_requester: !isOwner },
+            ...prev,
+          ];
+        });
+      },
+      onResync: fetchRequests,
+    });
+  }, [filter, statusFilter, user?.id]);
+
   const fetchRequests = async () => {
     try {
       setLoading(true);
@@ -62,10 +89,15 @@ const Requests: React.FC = () => {
     }
   };
 
+  // Reflect our own action right away; the pushed event carries the full row
+  const setStatus = (id: number, status: string) => {
+    setRequests(prev => prev.map(r => (r.id === id ? { ...r, status } : r)));
+  };
+
   const handleApprove = async (id: number) => {
     try {
       await apiService.approveRequest(id);
-      fetchRequests();
+      setStatus(id, 'approved');
     } catch (err: any) {
       alert(err.message || 'Failed to approve request');
     }
@@ -74,7 +106,7 @@ const Requests: React.FC = () => {
   const handleReject = async (id: number) => {
     try {
       await apiService.rejectRequest(id);
-      fetchRequests();
+      setStatus(id, 'rejected');
     } catch (err: any) {
       alert(err.message || 'Failed to reject request');
     }
@@ -83,7 +115,7 @@ const Requests: React.FC = () => {
   const handleCancel = async (id: number) => {
     try {
       await apiService.cancelRequest(id);
-      fetchRequests();
+      setStatus(id, 'rejected');
     } catch (err: any) {
       alert(err.message || 'Failed to cancel request');
     }
@@ -92,7 +124,7 @@ const Requests: React.FC = () => {
   const handleReturn = async (id: number) => {
     try {
       await apiService.returnItem(id);
-      fetchRequests();
+      setStatus(id, 'returned');
     } catch (err: any) {
       alert(err.message || 'Failed to mark as returned');
     }
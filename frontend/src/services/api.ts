@@ -7,16 +7,150 @@ interface ApiResponse<T = any> {
   message?: string;
 }
 
+interface SessionTokens {
+  token: string;
+  refresh_token: string;
+  expires_in: number;
+}
+
+export interface NotificationSelection {
+  ids?: number[];
+  older_than?: string;
+  type?: 'info' | 'success' | 'warning' | 'error';
+  is_read?: boolean;
+}
+
+export type DigestMode = 'off' | 'hourly' | 'daily';
+
+export interface NotificationPreferences {
+  digest_mode: DigestMode;
+  last_digest_at: string | null;
+  pending_digest_events: number;
+}
+
+export interface LiveNotification {
+  id: number;
+  title: string;
+  message: string;
+  type: 'info' | 'success' | 'warning' | 'error';
+  is_read: boolean;
+  created_at: string;
+}
+
+export interface RequestEvent {
+  event: 'request.created' | 'request.approved' | 'request.rejected' | 'request.cancelled' | 'request.returned';
+  actor_id: number;
+  data: {
+    id: number;
+    item_type: string;
+    item_id: number;
+    item_title: string;
+    item_creator: string;
+    requester_id: number;
+    requester_name: string;
+    owner_id: number;
+    owner_name: string;
+    status: string;
+    request_date: string;
+    response_date?: string;
+    pickup_date: string;
+    return_date: string;
+    notes?: string;
+    version: number;
+  };
+}
+
+export interface LoanRecord {
+  request_id: number;
+  item_type: string;
+  item_id: number;
+  item_title: string;
+  owner_id: number;
+  borrower_id: number;
+  requested_at: string;
+  approved_at: string;
+  pickup_date: string;
+  return_date: string;
+  returned_on?: string;
+  status: 'active' | 'returned';
+  response_minutes?: number;
+  planned_days: number;
+  loan_days?: number;
+  late_days?: number;
+}
+
+export interface LendingStats {
+  lent: { loans: number; returned: number; avg_loan_days: number | null; avg_response_hours: number | null };
+  borrowed: { loans: number; returned: number; avg_loan_days: number | null; late_returns: number };
+}
+
+export interface PopularItem {
+  item_type: string;
+  item_id: number;
+  item_title: string;
+  owner_id: number;
+  last_loan_at?: string;
+  loan_count: number;
+  returned_count: number;
+  loan_days: number;
+  late_returns: number;
+  avg_loan_days: number | null;
+}
+
 class ApiService {
   private token: string | null = null;
+  private refreshToken: string | null = null;
+  private refreshing: Promise<boolean> | null = null;
 
   constructor() {
     this.token = localStorage.getItem('auth_token');
+    this.refreshToken = localStorage.getItem('refresh_token');
+  }
+
+  private setSession(session?: Partial<SessionTokens>) {
+    if (session?.token) {
+      this.token = session.token;
+      localStorage.setItem('auth_token', session.token);
+    }
+    if (session?.refresh_token) {
+      this.refreshToken = session.refresh_token;
+      localStorage.setItem('refresh_token', session.refresh_token);
+    }
+  }
+
+  // Exchange the refresh token for a new token pair (shared by concurrent callers)
+  private async refreshSession(): Promise<boolean> {
+    if (!this.refreshToken) {
+      return false;
+    }
+
+    if (!this.refreshing) {
+      this.refreshing = fetch(`${API_BASE_URL}/api/auth/refresh`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ refresh_token: this.refreshToken }),
+      })
+        .then(async (response) => {
+          if (!response.ok) {
+            return false;
+          }
+          const data = await response.json();
+          this.setSession(data.data);
+          return true;
+        })
+        .catch(() => false)
+        .finally(() => {
+          this.refreshing = null;
+        });
+    }
+
+    return this.refreshing;
   }
 
   private async request<T = any>(
     endpoint: string,
-    options: RequestInit = {}
+    options: RequestInit = {},
+    retry = true
   ): Promise<ApiResponse<T>> {
     const url = `${API_BASE_URL}${endpoint}`;
 
@@ -34,6 +168,9 @@ class ApiService {
       const data = await response.json();
 
       if (!response.ok) {
+        if (response.status === 401 && retry && await this.refreshSession()) {
+          return this.request<T>(endpoint, options, false);
+        }
         if (response.status === 401) {
           this.logout();
           window.location.href = '/';
@@ -62,6 +199,28 @@ class ApiService {
     });
   }
 
+  // POST for create endpoints: every attempt carries the same Idempotency-Key,
+  // so retrying after a network error returns the original result instead of
+  // creating a duplicate
+  private async postIdempotent<T = any>(endpoint: string, data: any, attempts = 3): Promise<ApiResponse<T>> {
+    const idempotencyKey = crypto.randomUUID();
+    for (let attempt = 1; ; attempt++) {
+      try {
+        return await this.request<T>(endpoint, {
+          method: 'POST',
+          body: JSON.stringify(data),
+          headers: { 'Idempotency-Key': idempotencyKey },
+        });
+      } catch (error) {
+        // fetch rejects with a TypeError when no response arrived
+        if (!(error instanceof TypeError) || attempt >= attempts) {
+          throw error;
+        }
+        await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** (attempt - 1)));
+      }
+    }
+  }
+
   // Generic PUT method
   async put<T = any>(endpoint: string, data?: any): Promise<ApiResponse<T>> {
     return this.request<T>(endpoint, {
@@ -93,14 +252,10 @@ class ApiService {
       user_id: number;
       username: string;
       email: string;
-      token: string;
       is_admin: boolean;
-    }>('/api/auth/register', userData);
+    } & SessionTokens>('/api/auth/register', userData);
 
-    if (response.data?.token) {
-      this.token = response.data.token;
-      localStorage.setItem('auth_token', this.token);
-    }
+    this.setSession(response.data);
 
     return response;
   }
@@ -117,13 +272,9 @@ class ApiService {
       contact_times?: string[];
       interests?: string[];
       is_admin: boolean;
-      token: string;
-    }>('/api/auth/login', { email, password });
+    } & SessionTokens>('/api/auth/login', { email, password });
 
-    if (response.data?.token) {
-      this.token = response.data.token;
-      localStorage.setItem('auth_token', this.token);
-    }
+    this.setSession(response.data);
 
     return response;
   }
@@ -155,8 +306,22 @@ class ApiService {
   }
 
   logout() {
+    if (this.token) {
+      // Best effort server-side revocation, local state is cleared regardless
+      fetch(`${API_BASE_URL}/api/auth/logout`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          Authorization: `Bearer ${this.token}`,
+        },
+        body: JSON.stringify({ refresh_token: this.refreshToken }),
+      }).catch(() => undefined);
+    }
+
     this.token = null;
+    this.refreshToken = null;
     localStorage.removeItem('auth_token');
+    localStorage.removeItem('refresh_token');
   }
 
   // Books methods
@@ -164,6 +329,8 @@ class ApiService {
     search?: string;
     genre?: string;
     available?: boolean;
+    free_from?: string;
+    free_until?: string;
     limit?: number;
     offset?: number;
   }) {
@@ -200,7 +367,7 @@ class ApiService {
     cover_url?: string;
     tags?: string[];
   }) {
-    return this.post<{ id: number }>('/api/books', bookData);
+    return this.postIdempotent<{ id: number }>('/api/books', bookData);
   }
 
   async updateBook(id: number, bookData: any) {
@@ -220,6 +387,8 @@ class ApiService {
     search?: string;
     complexity?: string;
     available?: boolean;
+    free_from?: string;
+    free_until?: string;
     min_players?: number;
     limit?: number;
     offset?: number;
@@ -259,7 +428,7 @@ class ApiService {
     categories?: string[];
     components?: string[];
   }) {
-    return this.post<{ id: number }>('/api/boardgames', gameData);
+    return this.postIdempotent<{ id: number }>('/api/boardgames', gameData);
   }
 
   async updateBoardGame(id: number, gameData: any) {
@@ -316,13 +485,15 @@ class ApiService {
     return_date: string;
     notes?: string;
   }) {
-    return this.post<{ id: number }>('/api/requests', requestData);
+    return this.postIdempotent<{ id: number }>('/api/requests', requestData);
   }
 
+  // Updates carrying expected_version fail with 409 if the row changed since it was read
   async updateRequest(id: number, requestData: {
     pickup_date?: string;
     return_date?: string;
     notes?: string;
+    expected_version?: number;
   }) {
     return this.put(`/api/requests/${id}`, requestData);
   }
@@ -343,10 +514,91 @@ class ApiService {
     return this.put(`/api/requests/${requestId}/return`);
   }
 
+  // Bulk transitions apply to every listed request or to none of them
+  async bulkApproveRequests(ids: number[]) {
+    return this.put<{ approved: number[]; rejected: number[] }>('/api/requests/bulk/approve', { ids });
+  }
+
+  async bulkRejectRequests(ids: number[]) {
+    return this.put<{ rejected: number[] }>('/api/requests/bulk/reject', { ids });
+  }
+
+  async bulkReturnItems(ids: number[]) {
+    return this.put<{ returned: number[] }>('/api/requests/bulk/return', { ids });
+  }
+
+  async getItemCalendar(params: {
+    item_type: 'book' | 'boardgame';
+    item_id: number;
+    start?: string;
+    end?: string;
+  }) {
+    return this.get<{
+      item_type: string;
+      item_id: number;
+      booked: Array<{ pickup_date: string; return_date: string }>;
+      available?: boolean;
+    }>('/api/requests/calendar', params);
+  }
+
+  // Waitlist methods
+  async getMyWaitlist() {
+    return this.get<Array<{
+      id: number;
+      item_type: string;
+      item_id: number;
+      loan_days: number;
+      notes?: string;
+      created_at: string;
+      item_title?: string;
+      position: number;
+    }>>('/api/waitlist');
+  }
+
+  async getItemWaitlist(params: { item_type: 'book' | 'boardgame'; item_id: number }) {
+    return this.get<{
+      item_type: string;
+      item_id: number;
+      length: number;
+      entry_id: number | null;
+      position: number | null;
+    }>('/api/waitlist/item', params);
+  }
+
+  async joinWaitlist(data: {
+    item_type: 'book' | 'boardgame';
+    item_id: number;
+    loan_days?: number;
+    notes?: string;
+  }) {
+    return this.post<{ id: number; position: number }>('/api/waitlist', data);
+  }
+
+  async leaveWaitlist(entryId: number) {
+    return this.delete(`/api/waitlist/${entryId}`);
+  }
+
   async getRequestStats() {
     return this.get('/api/requests/stats/summary');
   }
 
+  // Loan history methods
+  async getLoanHistory(params?: {
+    role?: 'lender' | 'borrower';
+    limit?: number;
+    offset?: number;
+  }) {
+    return this.get<LoanRecord[]>('/api/loans/history', params);
+  }
+
+  async getLoanStats() {
+    return this.get<LendingStats>('/api/loans/stats');
+  }
+
+  async getPopularItems(params?: { item_type?: 'book' | 'boardgame'; limit?: number }) {
+    return this.get<PopularItem[]>('/api/loans/popular', params);
+  }
+
   // Notifications methods
   async getNotifications(params?: {
     is_read?: boolean;
@@ -380,10 +632,135 @@ class ApiService {
     return this.delete('/api/notifications');
   }
 
+  // Bulk operations select notifications by ids and/or predicates in one request
+  async bulkMarkNotificationsRead(selection: NotificationSelection) {
+    return this.put<{ updated: number }>('/api/notifications/bulk/read', selection);
+  }
+
+  async bulkDeleteNotifications(selection: NotificationSelection) {
+    return this.post<{ deleted: number }>('/api/notifications/bulk/delete', selection);
+  }
+
+  async getNotificationPreferences() {
+    return this.get<NotificationPreferences>('/api/notifications/preferences');
+  }
+
+  async updateNotificationPreferences(preferences: { digest_mode: DigestMode }) {
+    return this.put('/api/notifications/preferences', preferences);
+  }
+
   async getNotificationCount() {
     return this.get('/api/notifications/count');
   }
 
+  // Live notifications over Server-Sent Events; returns a function that closes the stream
+  subscribeToNotifications(handlers: {
+    onNotification: (notification: LiveNotification) => void;
+    onResync?: () => void;
+  }): () => void {
+    let source: EventSource | null = null;
+    let closed = false;
+    let lastEventId: string | null = null;
+
+    const open = () => {
+      if (closed || !this.token) {
+        return;
+      }
+
+      // EventSource cannot send headers, so the token goes in the query string
+      const params = new URLSearchParams({ token: this.token });
+      if (lastEventId) {
+        params.set('since_id', lastEventId);
+      }
+      source = new EventSource(`${API_BASE_URL}/api/notifications/stream?${params}`);
+
+      source.addEventListener('notification', (event) => {
+        const message = event as MessageEvent;
+        lastEventId = message.lastEventId || lastEventId;
+        handlers.onNotification(JSON.parse(message.data));
+      });
+      source.addEventListener('resync', () => handlers.onResync?.());
+
+      source.onerror = async () => {
+        // The browser reconnects on its own unless the server refused the
+        // stream, which happens once the access token has expired
+        if (source?.readyState === EventSource.CLOSED) {
+          source = null;
+          if (await this.refreshSession()) {
+            open();
+          }
+        }
+      };
+    };
+
+    open();
+
+    return () => {
+      closed = true;
+      source?.close();
+    };
+  }
+
+  // Request lifecycle events over a WebSocket; returns a function that closes it
+  subscribeToRequestEvents(handlers: {
+    onEvent: (event: RequestEvent) => void;
+    onResync?: () => void;
+  }): () => void {
+    let socket: WebSocket | null = null;
+    let closed = false;
+    let attempts = 0;
+    let timer: ReturnType<typeof setTimeout> | null = null;
+
+    const connect = () => {
+      if (closed || !this.token) {
+        return;
+      }
+
+      const url = `${API_BASE_URL.replace(/^http/, 'ws')}/api/requests/events?token=${encodeURIComponent(this.token)}`;
+      socket = new WebSocket(url);
+
+      socket.onopen = () => {
+        // Events may have been missed while disconnected
+        if (attempts > 0) {
+          handlers.onResync?.();
+        }
+        attempts = 0;
+      };
+
+      socket.onmessage = (message) => {
+        const event = JSON.parse(message.data);
+        if (event.event === 'resync') {
+          handlers.onResync?.();
+        } else if (event.event !== 'ping') {
+          handlers.onEvent(event);
+        }
+      };
+
+      socket.onclose = async (event) => {
+        socket = null;
+        if (closed) {
+          return;
+        }
+        // 1008: token rejected or revoked, refresh it before reconnecting
+        if (event.code === 1008 && !(await this.refreshSession())) {
+          return;
+        }
+        attempts += 1;
+        timer = setTimeout(connect, Math.min(1000 * 2 ** attempts, 30000));
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      if (timer) {
+        clearTimeout(timer);
+      }
+      socket?.close();
+    };
+  }
+
   // Admin methods
   async getAdminStats() {
     return this.get<{
@@ -408,6 +785,16 @@ class ApiService {
     }>('/api/admin/stats');
   }
 
+  async getLendingReport(params?: { limit?: number }) {
+    return this.get<{
+      top_lenders: Array<{ id: number; username: string; loans_count: number }>;
+      top_borrowers: Array<{ id: number; username: string; borrows_count: number }>;
+      popular_items: PopularItem[];
+      active_loans: number;
+      averages: LendingStats;
+    }>('/api/admin/reports/lending', params);
+  }
+
   async getUsers(params?: {
     search?: string;
     is_active?: boolean;
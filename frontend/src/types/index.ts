@@ -23,6 +23,7 @@ export interface Book {
   owner: User;
   isAvailable: boolean;
   addedDate: string;
+  version?: number;
 }
 
 export interface BoardGame {
@@ -39,6 +40,7 @@ export interface BoardGame {
   owner: User;
   isAvailable: boolean;
   addedDate: string;
+  version?: number;
 }
 
 export interface Request {
@@ -51,6 +53,7 @@ export interface Request {
   responseDate?: string;
   pickupDate?: string;
   returnDate?: string;
+  version?: number;
 }
 
 export interface Notification {
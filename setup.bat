@@ -50,7 +50,8 @@ if not exist .env (
         echo # JWT Configuration
         echo JWT_SECRET_KEY=dev-secret-key-change-in-production
         echo JWT_ALGORITHM=HS256
-        echo JWT_EXPIRATION_HOURS=24
+        echo JWT_ACCESS_EXPIRATION_MINUTES=15
+        echo JWT_REFRESH_EXPIRATION_DAYS=30
     ) > .env
     echo OK: Backend .env created
 ) else (